@@ -22,6 +22,8 @@
 #
 # Version: 1.0
 
+import logging
+
 from django.apps import AppConfig
 from django.utils.version import get_complete_version
 
@@ -32,3 +34,15 @@ if get_complete_version() < (1, 8):
 class MaprAppConfig(AppConfig):
     name = "omero_mapr"
     label = "mapr"
+
+    def ready(self):
+        # load autocomplete prefix tables at worker start
+        from .autocomplete import load_prefix_tables
+        load_prefix_tables()
+        # render the default favicon once
+        from .favicon import default_favicon
+        try:
+            default_favicon()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "Failed to render the default favicon")
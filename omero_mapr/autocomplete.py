@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import logging
+import sys
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from .mapr_settings import mapr_settings
+from .value_index import get_value_index, PREFIX_UPPER
+
+
+logger = logging.getLogger(__name__)
+
+
+NGRAM = 3
+
+# Seconds between checks whether the value index of a menu was rebuilt
+CHECK_INTERVAL = 30
+
+
+def _ngrams(value):
+    return set(value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1))
+
+
+def _page(values, page, limit):
+    if page is not None and page > 0:
+        return values[(page - 1) * limit:page * limit]
+    return values
+
+
+class PrefixTable(object):
+
+    ''' Distinct values of one menu and group held in memory.
+
+        Values are kept in sorted arrays searched with bisect for
+        `value%` lookups, and in a trigram table for `%value%` lookups.
+    '''
+
+    def __init__(self, values):
+        self.values = sorted(set(values))
+        self.lower = sorted((v.lower(), v) for v in self.values)
+        self.lower_keys = [k for k, v in self.lower]
+        self.ngrams = defaultdict(lambda: array('L'))
+        for i, k in enumerate(self.lower_keys):
+            for g in _ngrams(k):
+                self.ngrams[g].append(i)
+        self.ngrams = dict(self.ngrams)
+        self.size = self._memory()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _memory(self):
+        # estimate of the memory used in bytes
+        size = sum(sys.getsizeof(v) for v in self.values)
+        size += sum(sys.getsizeof(k) + sys.getsizeof(t)
+                    for k, t in zip(self.lower_keys, self.lower))
+        size += sys.getsizeof(self.values) + sys.getsizeof(self.lower)
+        size += sys.getsizeof(self.lower_keys)
+        size += sys.getsizeof(self.ngrams)
+        size += sum(sys.getsizeof(g) + sys.getsizeof(p)
+                    for g, p in self.ngrams.items())
+        return size
+
+    def startswith(self, value, case_sensitive=False):
+        ''' Values starting with value ordered by length then
+            case insensitively, as `length(mv.value), lower(mv.value)`
+        '''
+
+        if case_sensitive:
+            lo = bisect_left(self.values, value)
+            hi = bisect_left(self.values, value + PREFIX_UPPER, lo)
+            matches = self.values[lo:hi]
+        else:
+            value = value.lower()
+            lo = bisect_left(self.lower_keys, value)
+            hi = bisect_left(self.lower_keys, value + PREFIX_UPPER, lo)
+            matches = [v for k, v in self.lower[lo:hi]]
+        return sorted(matches, key=lambda v: (len(v), v.lower()))
+
+    def contains(self, value, case_sensitive=False):
+        ''' Values containing but not starting with value ordered
+            case insensitively
+        '''
+
+        needle = value.lower()
+        if len(needle) >= NGRAM:
+            postings = []
+            for g in _ngrams(needle):
+                p = self.ngrams.get(g)
+                if p is None:
+                    return []
+                postings.append(p)
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for p in postings[1:]:
+                candidates.intersection_update(p)
+            candidates = sorted(candidates)
+        else:
+            candidates = range(len(self.lower))
+
+        matches = []
+        for i in candidates:
+            k, v = self.lower[i]
+            if case_sensitive:
+                if value in v and not v.startswith(value):
+                    matches.append(v)
+            elif needle in k and not k.startswith(needle):
+                matches.append(v)
+        return matches
+
+    def autocomplete(self, value, case_sensitive=False,
+                     page=1, limit=settings.PAGE):
+        ''' See L{omero_mapr.tree.marshal_autocomplete} '''
+
+        values = _page(self.startswith(value, case_sensitive), page, limit)
+        values += _page(self.contains(value, case_sensitive), page, limit)
+        return [{'value': v} for v in values]
+
+
+class PrefixTables(object):
+
+    ''' Prefix tables of every menu, per group and for all groups (-1),
+        bounded by a memory budget.
+    '''
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.tables = {}
+        self.built = {}
+        self.checked = {}
+        self.used = 0
+        self._loading = set()
+        self._lock = threading.Lock()
+
+    def load(self, value_index, menu):
+        ''' Loads the tables of a menu from the value index, replacing
+            any previous ones. Tables that would exceed the memory budget
+            are skipped. The tables are built without the lock, so that
+            lookups use the previous ones meanwhile.
+        '''
+
+        built = value_index.built(menu)
+        groups = defaultdict(list)
+        for group_id, value in value_index.values(menu):
+            groups[group_id].append(value)
+            groups[-1].append(value)
+        # all groups first, then the largest groups
+        tables = [(group_id, PrefixTable(groups[group_id]))
+                  for group_id in sorted(groups, key=lambda g: (
+                      g != -1, -len(groups[g])))]
+
+        with self._lock:
+            tables_by_key = dict(self.tables)
+            used = self.used
+            for key in [k for k in tables_by_key if k[0] == menu]:
+                used -= tables_by_key.pop(key).size
+            for group_id, table in tables:
+                size = table.size
+                if used + size > self.budget:
+                    logger.warning(
+                        "Autocomplete: %s group %s (%d values, %d bytes)"
+                        " exceeds the memory budget" % (
+                            menu, group_id, len(table), size))
+                    continue
+                tables_by_key[(menu, group_id)] = table
+                used += size
+            self.tables = tables_by_key
+            self.used = used
+            self.built[menu] = built
+        logger.info("Autocomplete: %s loaded, %d of %d bytes used" % (
+            menu, used, self.budget))
+
+    def _reload(self, value_index, menu):
+        try:
+            self.load(value_index, menu)
+        except Exception:
+            logger.error("Autocomplete: could not reload %s" % menu,
+                         exc_info=True)
+        finally:
+            with self._lock:
+                self._loading.discard(menu)
+
+    def get(self, value_index, menu, group_id=-1):
+        ''' Returns the table of a menu and group or None. At most every
+            CHECK_INTERVAL seconds, the menu is reloaded in the background
+            if the value index has been rebuilt since.
+        '''
+
+        if group_id is None:
+            group_id = -1
+        now = time.time()
+        if now - self.checked.get(menu, 0) >= CHECK_INTERVAL:
+            self.checked[menu] = now
+            built = value_index.built(menu)
+            with self._lock:
+                reload = (built is not None and
+                          self.built.get(menu) != built and
+                          menu not in self._loading)
+                if reload:
+                    self._loading.add(menu)
+            if reload:
+                # meanwhile lookups use the previous tables
+                threading.Thread(
+                    target=self._reload, args=(value_index, menu),
+                    name="mapr-autocomplete-%s" % menu, daemon=True).start()
+        return self.tables.get((menu, group_id))
+
+    def stats(self):
+        ''' Returns the memory usage of each loaded table '''
+
+        return {
+            'budget': self.budget,
+            'used': self.used,
+            'tables': dict(("%s/%s" % k, {'values': len(t),
+                                          'bytes': t.size})
+                           for k, t in self.tables.items()),
+        }
+
+
+_prefix_tables = None
+
+
+def get_prefix_tables():
+    ''' Returns the prefix tables if omero.web.mapr.autocomplete_memory
+        and the value index are configured, otherwise None.
+    '''
+
+    global _prefix_tables
+    budget = mapr_settings.AUTOCOMPLETE_MEMORY
+    if not budget or get_value_index() is None:
+        return None
+    if _prefix_tables is None:
+        _prefix_tables = PrefixTables(budget * 1024 * 1024)
+    return _prefix_tables
+
+
+def load_prefix_tables():
+    ''' Loads the prefix tables of all menus built in the value index '''
+
+    prefix_tables = get_prefix_tables()
+    if prefix_tables is None:
+        return
+    value_index = get_value_index()
+    for menu in mapr_settings.CONFIG:
+        try:
+            if value_index.built(menu) is not None:
+                prefix_tables.load(value_index, menu)
+        except Exception:
+            logger.error("Autocomplete: could not load %s" % menu,
+                         exc_info=True)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+from abc import ABCMeta, abstractmethod
+
+
+class Backend(object, metaclass=ABCMeta):
+
+    ''' Data access used by the mapr views.
+
+        Every method takes the OMERO gateway as conn and the same keyword
+        arguments, and returns the same marshalled dictionaries, as the
+        function of the same name in L{omero_mapr.tree} (or
+        L{omero_mapr.show} for mapr_paths_to_object).
+        Subclasses implement the abstract methods, the others default to
+        them.
+    '''
+
+    @abstractmethod
+    def count_mapannotations(self, conn, **kwargs):
+        ''' Counts distinct values '''
+
+    def estimate_mapannotations(self, conn, **kwargs):
+        ''' Estimates the number of distinct values, counting them
+            exactly unless overridden
+        '''
+        return self.count_mapannotations(conn, **kwargs)
+
+    @abstractmethod
+    def count_mapannotations_batch(self, conn, **kwargs):
+        ''' Counts images, screens and projects of many values '''
+
+    @abstractmethod
+    def search_mapannotations(self, conn, **kwargs):
+        ''' Counts and lists the values matching a term in many menus '''
+
+    @abstractmethod
+    def marshal_mapannotations(self, conn, **kwargs):
+        ''' Lists values with their image counts '''
+
+    @abstractmethod
+    def marshal_screens(self, conn, **kwargs):
+        ''' Lists screens annotated with a value '''
+
+    @abstractmethod
+    def marshal_projects(self, conn, **kwargs):
+        ''' Lists projects annotated with a value '''
+
+    @abstractmethod
+    def marshal_datasets(self, conn, **kwargs):
+        ''' Lists datasets of a project annotated with a value '''
+
+    @abstractmethod
+    def marshal_plates(self, conn, **kwargs):
+        ''' Lists plates of a screen annotated with a value '''
+
+    def marshal_datasets_batch(self, conn, project_ids, **kwargs):
+        ''' Lists datasets of many projects by project id, one query per
+            project unless overridden
+        '''
+        return dict((project_id, self.marshal_datasets(
+            conn, project_id=project_id, **kwargs))
+            for project_id in project_ids)
+
+    def marshal_plates_batch(self, conn, screen_ids, **kwargs):
+        ''' Lists plates of many screens by screen id, one query per
+            screen unless overridden
+        '''
+        return dict((screen_id, self.marshal_plates(
+            conn, screen_id=screen_id, **kwargs))
+            for screen_id in screen_ids)
+
+    @abstractmethod
+    def marshal_images(self, conn, **kwargs):
+        ''' Lists images of a plate or dataset annotated with a value '''
+
+    def marshal_images_batch(self, conn, parent_ids, **kwargs):
+        ''' Lists images of many plates or datasets by parent id, one query
+            per parent unless overridden
+        '''
+        return dict((parent_id, self.marshal_images(
+            conn, parent_id=parent_id, **kwargs))
+            for parent_id in parent_ids)
+
+    @abstractmethod
+    def export_images(self, conn, **kwargs):
+        ''' Generates chunks of all images annotated with a value '''
+
+    @abstractmethod
+    def load_mapannotation(self, conn, **kwargs):
+        ''' Loads the map annotations with a value and their owners '''
+
+    @abstractmethod
+    def marshal_autocomplete(self, conn, **kwargs):
+        ''' Lists values starting with then containing a value '''
+
+    @abstractmethod
+    def mapr_paths_to_object(self, conn, **kwargs):
+        ''' Lists the paths from a value to an object '''
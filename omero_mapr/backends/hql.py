@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+from .. import show, tree
+from .base import Backend
+
+
+class HqlBackend(Backend):
+
+    ''' Default backend running HQL through the OMERO query service '''
+
+    def count_mapannotations(self, conn, **kwargs):
+        return tree.count_mapannotations(conn, **kwargs)
+
+    def estimate_mapannotations(self, conn, **kwargs):
+        return tree.estimate_mapannotations(conn, **kwargs)
+
+    def count_mapannotations_batch(self, conn, **kwargs):
+        return tree.count_mapannotations_batch(conn, **kwargs)
+
+    def search_mapannotations(self, conn, **kwargs):
+        return tree.search_mapannotations(conn, **kwargs)
+
+    def marshal_mapannotations(self, conn, **kwargs):
+        return tree.marshal_mapannotations(conn, **kwargs)
+
+    def marshal_screens(self, conn, **kwargs):
+        return tree.marshal_screens(conn, **kwargs)
+
+    def marshal_projects(self, conn, **kwargs):
+        return tree.marshal_projects(conn, **kwargs)
+
+    def marshal_datasets(self, conn, **kwargs):
+        return tree.marshal_datasets(conn, **kwargs)
+
+    def marshal_plates(self, conn, **kwargs):
+        return tree.marshal_plates(conn, **kwargs)
+
+    def marshal_datasets_batch(self, conn, **kwargs):
+        return tree.marshal_datasets_batch(conn, **kwargs)
+
+    def marshal_plates_batch(self, conn, **kwargs):
+        return tree.marshal_plates_batch(conn, **kwargs)
+
+    def marshal_images(self, conn, **kwargs):
+        return tree.marshal_images(conn, **kwargs)
+
+    def marshal_images_batch(self, conn, **kwargs):
+        return tree.marshal_images_batch(conn, **kwargs)
+
+    def export_images(self, conn, **kwargs):
+        return tree.export_images(conn, **kwargs)
+
+    def load_mapannotation(self, conn, **kwargs):
+        return tree.load_mapannotation(conn, **kwargs)
+
+    def marshal_autocomplete(self, conn, **kwargs):
+        return tree.marshal_autocomplete(conn, **kwargs)
+
+    def mapr_paths_to_object(self, conn, **kwargs):
+        return show.mapr_paths_to_object(conn, **kwargs)
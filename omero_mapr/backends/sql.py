@@ -0,0 +1,947 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import logging
+import sqlite3
+import threading
+
+from datetime import datetime
+
+import omero
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from omeroweb.webclient.tree import _marshal_screen
+from omeroweb.webclient.tree import _marshal_plate
+from omeroweb.webclient.tree import _marshal_image
+
+from ..mapr_settings import mapr_settings
+from ..tracing import _trace
+from .. import tree
+from ..tree import _escape_chars_like, _marshal_map
+from ..value_index import estimate_values, resolve_variants, \
+    search_values
+from .base import Backend
+from .hql import HqlBackend
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Objects of the snapshot cannot be changed through it
+READ_ONLY = {
+    'canEdit': False, 'canAnnotate': False,
+    'canLink': False, 'canDelete': False, 'canChgrp': False,
+    'canChown': False,
+}
+
+# Permissions of the group of an object
+GROUP_PERMISSIONS = """(select g.permissions from experimentergroup g
+    where g.id = %s.group_id)"""
+
+# Rights of a role in the permissions of a group, shifted by the role,
+# see omero.model.PermissionsI
+READ = 4
+WRITE = 2
+ANNOTATE = 1
+USER_SHIFT = 8
+GROUP_SHIFT = 4
+WORLD_SHIFT = 0
+
+# Images linked to map annotations, as ImageAnnotationLink in tree.py
+FROM_IMAGES = """
+    from imageannotationlink ial
+        join annotation a on a.id = ial.child
+        join annotation_mapvalue mv on mv.annotation_id = a.id
+        join image i on i.id = ial.parent
+    """
+
+# Wells linked to map annotations, as WellAnnotationLink in tree.py,
+# formatted with the aliases of the plate and screen tables
+FROM_WELLS = """
+    from wellannotationlink wal
+        join annotation a on a.id = wal.child
+        join annotation_mapvalue mv on mv.annotation_id = a.id
+        join well w on w.id = wal.parent
+        join wellsample ws on ws.well = w.id
+        join plate {plate} on {plate}.id = w.plate
+        join screenplatelink sl on sl.child = {plate}.id
+        join screen {screen} on {screen}.id = sl.parent
+    """
+
+# Images of a screen or project, as SPW_JOINS and PDI_JOINS in show.py
+SPW_JOINS = FROM_IMAGES + """
+        join wellsample ws on ws.image = i.id
+        join well w on w.id = ws.well
+        join screenplatelink sl on sl.child = w.plate
+    """
+
+PDI_JOINS = FROM_IMAGES + """
+        join datasetimagelink dil on dil.child = i.id
+        join projectdatasetlink pdl on pdl.child = dil.parent
+    """
+
+
+def _marks(values):
+    return ", ".join("?" for v in values)
+
+
+def _casefold_clause(casefold, recent, recent_args):
+    ''' SQL version of L{omero_mapr.tree._casefold_clause} returning the
+        clause and its arguments
+    '''
+
+    values, since = casefold
+    clause = "(a.update_id > ? and %s)" % recent
+    args = [since] + recent_args
+    if not values:
+        return clause, args
+    return ("(mv.value in (%s) or %s)" % (_marks(values), clause),
+            list(values) + args)
+
+
+def _permissions(perm):
+    ''' Returns the permissions of the objects of a group with the given
+        permissions bits, marshalled as from HQL
+    '''
+
+    chars = []
+    for shift in (USER_SHIFT, GROUP_SHIFT, WORLD_SHIFT):
+        rights = perm >> shift
+        chars.append('r' if rights & READ else '-')
+        chars.append('w' if rights & WRITE else
+                     'a' if rights & ANNOTATE else '-')
+    permissions = dict(READ_ONLY)
+    permissions['perm'] = "".join(chars)
+    return permissions
+
+
+def _readable(conn):
+    ''' Returns the clause restricting annotations to those the current
+        user can read as OMERO would, from the permissions of the groups
+        of the snapshot and the groups of the user, and its arguments
+    '''
+
+    ec = conn.getEventContext()
+    if ec.isAdmin:
+        return None, []
+    readable = "a.group_id in (select g.id from experimentergroup g " \
+        "where %s(g.permissions & {0}) = {0})"
+    clauses = [readable.format(READ << WORLD_SHIFT) % ""]
+    args = []
+    member = list(ec.memberOfGroups)
+    if member:
+        # group members read all objects unless the group is private
+        clauses.append(readable.format(READ << GROUP_SHIFT) % (
+            "g.id in (%s) and " % _marks(member)))
+        clauses.append("(a.group_id in (%s) and a.owner_id = ?)" %
+                       _marks(member))
+        args.extend(member + member + [ec.userId])
+    leader = list(ec.leaderOfGroups)
+    if leader:
+        clauses.append("a.group_id in (%s)" % _marks(leader))
+        args.extend(leader)
+    return "(%s)" % " or ".join(clauses), args
+
+
+def _where(conn, mapann_ns=[], mapann_names=[], mapann_value=None,
+           query=False, case_sensitive=True, experimenter_id=-1,
+           group_id=-1, mapann_values=None):
+    ''' SQL version of L{omero_mapr.tree._set_parameters} returning the
+        where clause and its arguments, restricted to the annotations the
+        current user can read
+    '''
+
+    where_clause = []
+    args = []
+
+    readable, readable_args = _readable(conn)
+    if readable is not None:
+        where_clause.append(readable)
+        args.extend(readable_args)
+
+    if mapann_names:
+        where_clause.append("mv.name in (%s)" % _marks(mapann_names))
+        args.extend(mapann_names)
+
+    if mapann_ns:
+        where_clause.append("a.ns in (%s)" % _marks(mapann_ns))
+        args.extend(mapann_ns)
+
+    if experimenter_id is not None and experimenter_id != -1:
+        where_clause.append("a.owner_id = ?")
+        args.append(experimenter_id)
+
+    if group_id is not None and group_id != -1:
+        where_clause.append("a.group_id = ?")
+        args.append(group_id)
+
+    _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+    if mapann_values:
+        if not case_sensitive:
+            mapann_values = [v.lower() for v in mapann_values]
+        where_clause.append("%s in (%s)" % (_cwc, _marks(mapann_values)))
+        args.extend(mapann_values)
+    elif mapann_value:
+        if not case_sensitive:
+            mapann_value = mapann_value.lower()
+        candidates = None
+        if query:
+            candidates = search_values(
+                mapann_ns, mapann_names, mapann_value, case_sensitive)
+        like = "%s like ? escape '\\'" % _cwc
+        like_args = ["%%%s%%" % _escape_chars_like(mapann_value)]
+        if candidates is not None:
+            clause, clause_args = _casefold_clause(
+                candidates, like, like_args)
+            where_clause.append(clause)
+            args.extend(clause_args)
+        elif query:
+            where_clause.append(like)
+            args.extend(like_args)
+        else:
+            variants = None
+            if not case_sensitive:
+                variants = resolve_variants(
+                    mapann_ns, mapann_names, mapann_value)
+            if variants is not None:
+                clause, clause_args = _casefold_clause(
+                    variants, "%s = ?" % _cwc, [mapann_value])
+                where_clause.append(clause)
+                args.extend(clause_args)
+            else:
+                where_clause.append("%s = ?" % _cwc)
+                args.append(mapann_value)
+    else:
+        where_clause.append("mv.value != ''")
+
+    return where_clause, args
+
+
+def _keyset(sort_keys, cursor):
+    ''' SQL version of L{omero_mapr.tree._set_cursor} returning the clause
+        selecting rows after the cursor and its arguments
+    '''
+
+    if not cursor:
+        return None, []
+    if not isinstance(cursor, list) or len(cursor) != len(sort_keys):
+        raise omero.ApiUsageException(None, None, "Invalid cursor")
+    for v in cursor:
+        if isinstance(v, bool) or not isinstance(v, (int, str)):
+            raise omero.ApiUsageException(None, None, "Invalid cursor")
+
+    clauses = []
+    args = []
+    for i, (expr, desc) in enumerate(sort_keys):
+        c = []
+        for j in range(i):
+            c.append("%s = ?" % sort_keys[j][0])
+            args.append(cursor[j])
+        c.append("%s %s ?" % (expr, '<' if desc else '>'))
+        args.append(cursor[i])
+        clauses.append("(%s)" % " and ".join(c))
+    return "(%s)" % " or ".join(clauses), args
+
+
+def _paging(page, limit, cursor):
+    if cursor is not None:
+        return " limit ?", [limit]
+    if page is not None and page > 0:
+        return " limit ? offset ?", [limit, (page - 1) * limit]
+    return "", []
+
+
+def _millis(value):
+    # event times are datetimes (PostgreSQL) or ISO strings (SQLite)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp() * 1000)
+
+
+class SqlBackend(HqlBackend):
+
+    ''' Runs the aggregate queries of mapr as SQL against a relational
+        copy of the OMERO database, e.g. a read-only PostgreSQL replica
+        or a SQLite snapshot with the same tables, configured by
+        omero.web.mapr.backend_dsn as postgresql://... or sqlite:///path.
+
+        Annotations are filtered by the permissions of their group and the
+        groups of the current user, and objects get the permissions of
+        their group but are shown read-only. Annotations and exports,
+        which load full OMERO objects, still go through HQL.
+    '''
+
+    def __init__(self, dsn=None):
+        self.dsn = dsn or mapr_settings.BACKEND_DSN
+        if not self.dsn:
+            raise ImproperlyConfigured(
+                "omero.web.mapr.backend_dsn is required by %s" %
+                self.__class__.__name__)
+        self._local = threading.local()
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            if self.dsn.startswith("sqlite:///"):
+                db = sqlite3.connect(self.dsn[len("sqlite:///"):])
+            elif psycopg2 is None:
+                raise ImproperlyConfigured(
+                    "psycopg2 is required to connect to %s" % self.dsn)
+            else:
+                db = psycopg2.connect(self.dsn)
+                db.set_session(readonly=True, autocommit=True)
+            self._local.db = db
+        return db
+
+    def _execute(self, name, sql, args):
+        db = self._connect()
+        if not isinstance(db, sqlite3.Connection):
+            # psycopg2 uses the format paramstyle
+            sql = sql.replace("?", "%s")
+
+        def execute(sql, args, service_opts):
+            cur = db.cursor()
+            try:
+                cur.execute(sql, args)
+                return cur.fetchall()
+            finally:
+                cur.close()
+        execute.__name__ = 'execute'
+        return _trace("sql.%s" % name, execute, sql, args, None)
+
+    def count_mapannotations(self, conn, mapann_value, query=False,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=[],
+                             group_id=-1, experimenter_id=-1):
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, case_sensitive,
+            experimenter_id, group_id)
+        q = """
+            select count(distinct mv.value)
+            %s
+                left outer join wellsample ws on ws.image = i.id
+                left outer join datasetimagelink dil on dil.child = i.id
+            where %s and (ws.id is not null or dil.id is not null)
+            """ % (FROM_IMAGES, " and ".join(where_clause))
+        return self._execute("count_mapannotations", q, args)[0][0]
+
+    def _sketch_groups(self, conn, group_id):
+        ''' Returns the IDs of the groups whose values the current user
+            reads entirely, None for all groups, or False if the user only
+            reads some values of a group, see L{_readable}
+        '''
+
+        ec = conn.getEventContext()
+        if group_id is None:
+            group_id = -1
+        if ec.isAdmin:
+            return None if group_id == -1 else [group_id]
+        group_ids = []
+        for gid, perm in self._execute(
+                "sketch_groups",
+                "select id, permissions from experimentergroup", []):
+            if group_id != -1 and gid != group_id:
+                continue
+            if (perm >> WORLD_SHIFT) & READ or gid in ec.leaderOfGroups:
+                group_ids.append(gid)
+            elif gid in ec.memberOfGroups:
+                if not (perm >> GROUP_SHIFT) & READ:
+                    # members of a private group only read their own values
+                    return False
+                group_ids.append(gid)
+        return group_ids or False
+
+    def estimate_mapannotations(self, conn, mapann_value, query=False,
+                                case_sensitive=False,
+                                mapann_ns=[], mapann_names=[],
+                                group_id=-1, experimenter_id=-1):
+        ''' Estimates the number of values from the sketches of the
+            value index as L{omero_mapr.tree.estimate_mapannotations},
+            taking the permissions of the groups from the snapshot, or
+            counts them with SQL
+        '''
+
+        if not mapann_value and experimenter_id in (None, -1):
+            group_ids = self._sketch_groups(conn, group_id)
+            if group_ids is not False:
+                estimate = estimate_values(mapann_ns, mapann_names, group_ids)
+                if estimate is not None:
+                    return estimate
+        return self.count_mapannotations(
+            conn, mapann_value, query=query, case_sensitive=case_sensitive,
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            group_id=group_id, experimenter_id=experimenter_id)
+
+    def search_mapannotations(self, conn, mapann_value, menus, query=False,
+                              case_sensitive=False,
+                              group_id=-1, experimenter_id=-1, limit=10):
+
+        where_clause, args = _where(
+            conn, [], [], mapann_value, query, case_sensitive,
+            experimenter_id, group_id)
+        scopes = []
+        for mapann_ns, mapann_names in menus.values():
+            scope = []
+            if mapann_ns:
+                scope.append("a.ns in (%s)" % _marks(mapann_ns))
+                args.extend(mapann_ns)
+            if mapann_names:
+                scope.append("mv.name in (%s)" % _marks(mapann_names))
+                args.extend(mapann_names)
+            if not scope:
+                scopes = []
+                break
+            scopes.append("(%s)" % " and ".join(scope))
+        if scopes:
+            where_clause.append("(%s)" % " or ".join(scopes))
+        q = """
+            select a.ns, mv.name, mv.value, count(distinct i.id)
+            %s
+                left outer join wellsample ws on ws.image = i.id
+                left outer join datasetimagelink dil on dil.child = i.id
+            where %s and (ws.id is not null or dil.id is not null)
+            group by a.ns, mv.name, mv.value
+            order by count(distinct i.id) desc, mv.value
+            limit %d
+            """ % (FROM_IMAGES, " and ".join(where_clause),
+                   tree.SEARCH_ROWS + 1)
+        rows = self._execute("search_mapannotations", q, args)
+        return {'menus': tree.group_search_rows(
+                    rows[:tree.SEARCH_ROWS], menus, limit),
+                'truncated': len(rows) > tree.SEARCH_ROWS}
+
+    def count_mapannotations_batch(self, conn, mapann_values,
+                                   case_sensitive=False,
+                                   mapann_ns=[], mapann_names=[],
+                                   group_id=-1, experimenter_id=-1):
+
+        counts = dict((v, {'images': 0, 'screens': 0, 'projects': 0})
+                      for v in mapann_values)
+        if not mapann_values:
+            return counts
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, None, False, case_sensitive,
+            experimenter_id, group_id, mapann_values=mapann_values)
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        q = """
+            select %s, count(distinct i.id),
+                count(distinct sl.parent), count(distinct pdl.parent)
+            %s
+                left outer join wellsample ws on ws.image = i.id
+                left outer join well w on w.id = ws.well
+                left outer join screenplatelink sl on sl.child = w.plate
+                left outer join datasetimagelink dil on dil.child = i.id
+                left outer join projectdatasetlink pdl
+                    on pdl.child = dil.parent
+            where %s and (ws.id is not null or dil.id is not null)
+            group by %s
+            """ % (_cwc, FROM_IMAGES, " and ".join(where_clause), _cwc)
+        found = {}
+        for v, images, screens, projects in self._execute(
+                "count_mapannotations_batch", q, args):
+            found[v] = {'images': images, 'screens': screens,
+                        'projects': projects}
+        for v in mapann_values:
+            c = found.get(v if case_sensitive else v.lower())
+            if c is not None:
+                counts[v] = c
+        return counts
+
+    def marshal_mapannotations(self, conn, mapann_value, query=False,
+                               case_sensitive=False,
+                               mapann_ns=[], mapann_names=[],
+                               group_id=-1, experimenter_id=-1,
+                               page=1, limit=settings.PAGE, cursor=None):
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, case_sensitive,
+            experimenter_id, group_id)
+        having_clause = ""
+        keyset, keyset_args = _keyset(
+            [("count(distinct i.id)", True), ("mv.value", False)], cursor)
+        if keyset is not None:
+            having_clause = "having %s" % keyset
+        paging, paging_args = _paging(page, limit, cursor)
+        q = """
+            select mv.value, count(distinct i.id),
+                count(distinct sl.parent), count(distinct pdl.parent)
+            %s
+                left outer join wellsample ws on ws.image = i.id
+                left outer join well w on w.id = ws.well
+                left outer join screenplatelink sl on sl.child = w.plate
+                left outer join datasetimagelink dil on dil.child = i.id
+                left outer join projectdatasetlink pdl
+                    on pdl.child = dil.parent
+            where %s and (
+                (dil.id is null and sl.id is not null) or
+                (ws.id is null and pdl.id is not null))
+            group by mv.value
+            %s
+            order by count(distinct i.id) desc, mv.value
+            %s
+            """ % (FROM_IMAGES, " and ".join(where_clause),
+                   having_clause, paging)
+
+        mapannotations = []
+        rows = self._execute("marshal_mapannotations", q,
+                             args + keyset_args + paging_args)
+        for value, c, screens, projects in rows:
+            if c > 0:
+                mt = _marshal_map(conn, [value, "%s (%d)" % (value, c),
+                                         None, experimenter_id, {}, None,
+                                         screens + projects])
+                mt.update({'extra': {'counter': c}})
+                mapannotations.append(mt)
+
+        if cursor is not None:
+            next_cursor = None
+            if rows and len(rows) == limit:
+                next_cursor = [rows[-1][1], rows[-1][0]]
+            return mapannotations, next_cursor
+        return mapannotations
+
+    def _containers(self, name, q, where_clause, args, sort_keys,
+                    page, limit, cursor):
+        keyset, keyset_args = _keyset(sort_keys, cursor)
+        if keyset is not None:
+            where_clause = where_clause + [keyset]
+        paging, paging_args = _paging(page, limit, cursor)
+        q = q % (" and ".join(where_clause), paging)
+        return self._execute(name, q, args + keyset_args + paging_args)
+
+    def _marshal_containers(self, conn, name, q, where_clause, args,
+                            mapann_value, page, limit, cursor):
+        containers = []
+        rows = self._containers(
+            name, q, where_clause, args,
+            [("lower(c.name)", False), ("c.id", False),
+             ("mv.value", False)], page, limit, cursor)
+        for v, c_id, c_name, sort_name, owner_id, child_count, c, perm \
+                in rows:
+            mc = _marshal_screen(conn, [c_id, "%s (%d)" % (c_name, c),
+                                        owner_id, _permissions(perm),
+                                        child_count])
+            if mapann_value is not None:
+                mc.update({'extra': {'counter': c, 'value': v}})
+            containers.append(mc)
+        if cursor is not None:
+            next_cursor = None
+            if len(rows) == limit:
+                next_cursor = [rows[-1][3], rows[-1][1], rows[-1][0]]
+            return containers, next_cursor
+        return containers
+
+    def marshal_screens(self, conn, mapann_value, query=False,
+                        mapann_ns=[], mapann_names=[],
+                        group_id=-1, experimenter_id=-1,
+                        page=1, limit=settings.PAGE, cursor=None):
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, True,
+            experimenter_id, group_id)
+        q = """
+            select mv.value, c.id, c.name, lower(c.name), c.owner_id,
+                count(distinct pl.id), count(distinct ws.id), %s
+            %s
+            where %%s
+            group by c.id, c.name, c.owner_id, c.group_id, mv.value
+            order by lower(c.name), c.id, mv.value
+            %%s
+            """ % (GROUP_PERMISSIONS % 'c',
+                   FROM_WELLS.format(plate='pl', screen='c'))
+        return self._marshal_containers(
+            conn, "marshal_screens", q, where_clause, args,
+            mapann_value, page, limit, cursor)
+
+    def marshal_projects(self, conn, mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=settings.PAGE, cursor=None):
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, True,
+            experimenter_id, group_id)
+        q = """
+            select mv.value, c.id, c.name, lower(c.name), c.owner_id,
+                count(distinct ds.id), count(distinct i.id), %s
+            %s
+                join datasetimagelink dil on dil.child = i.id
+                join dataset ds on ds.id = dil.parent
+                join projectdatasetlink pdl on pdl.child = ds.id
+                join project c on c.id = pdl.parent
+            where %%s
+            group by c.id, c.name, c.owner_id, c.group_id, mv.value
+            order by lower(c.name), c.id, mv.value
+            %%s
+            """ % (GROUP_PERMISSIONS % 'c', FROM_IMAGES)
+        return self._marshal_containers(
+            conn, "marshal_projects", q, where_clause, args,
+            mapann_value, page, limit, cursor)
+
+    def _marshal_children(self, conn, name, node, q, where_clause, args,
+                          mapann_value, page, limit, cursor):
+        children = []
+        rows = self._containers(
+            name, q, where_clause, args,
+            [("lower(c.name)", False), ("c.id", False),
+             ("mv.value", False)], page, limit, cursor)
+        for v, c_id, c_name, sort_name, owner_id, child_count, perm \
+                in rows:
+            mc = _marshal_plate(conn, [c_id, c_name, owner_id,
+                                       _permissions(perm), child_count])
+            extra = {'extra': {'node': node}}
+            if mapann_value is not None:
+                extra['extra']['value'] = v
+            mc.update(extra)
+            children.append(mc)
+        if cursor is not None:
+            next_cursor = None
+            if len(rows) == limit:
+                next_cursor = [rows[-1][3], rows[-1][1], rows[-1][0]]
+            return children, next_cursor
+        return children
+
+    def marshal_datasets(self, conn, project_id,
+                         mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=settings.PAGE, cursor=None):
+
+        if not isinstance(project_id, int):
+            return ([], None) if cursor is not None else []
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, True,
+            experimenter_id, group_id)
+        where_clause.append("pdl.parent = ?")
+        args.append(project_id)
+        q = """
+            select mv.value, c.id, c.name, lower(c.name), c.owner_id,
+                count(distinct i.id), %s
+            %s
+                join datasetimagelink dil on dil.child = i.id
+                join dataset c on c.id = dil.parent
+                join projectdatasetlink pdl on pdl.child = c.id
+            where %%s
+            group by c.id, c.name, c.owner_id, c.group_id, mv.value
+            order by lower(c.name), c.id, mv.value
+            %%s
+            """ % (GROUP_PERMISSIONS % 'c', FROM_IMAGES)
+        return self._marshal_children(
+            conn, "marshal_datasets", "dataset", q, where_clause, args,
+            mapann_value, page, limit, cursor)
+
+    def marshal_plates(self, conn, screen_id,
+                       mapann_value, query=False,
+                       mapann_ns=[], mapann_names=[],
+                       group_id=-1, experimenter_id=-1,
+                       page=1, limit=settings.PAGE, cursor=None):
+
+        if not isinstance(screen_id, int):
+            return ([], None) if cursor is not None else []
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, True,
+            experimenter_id, group_id)
+        where_clause.append("s.id = ?")
+        args.append(screen_id)
+        q = """
+            select mv.value, c.id, c.name, lower(c.name), c.owner_id,
+                count(distinct ws.id), %s
+            %s
+            where %%s
+            group by c.id, c.name, c.owner_id, c.group_id, mv.value
+            order by lower(c.name), c.id, mv.value
+            %%s
+            """ % (GROUP_PERMISSIONS % 'c',
+                   FROM_WELLS.format(plate='c', screen='s'))
+        return self._marshal_children(
+            conn, "marshal_plates", "plate", q, where_clause, args,
+            mapann_value, page, limit, cursor)
+
+    # one query per parent against the copy rather than one HQL query
+    marshal_datasets_batch = Backend.marshal_datasets_batch
+    marshal_plates_batch = Backend.marshal_plates_batch
+    marshal_images_batch = Backend.marshal_images_batch
+
+    def marshal_images(self, conn, parent, parent_id,
+                       mapann_value, query=False,
+                       mapann_ns=[], mapann_names=[],
+                       load_pixels=False,
+                       group_id=-1, experimenter_id=-1,
+                       page=1, date=False, thumb_version=False,
+                       limit=settings.PAGE, executor=None, cursor=None):
+
+        if not isinstance(parent_id, int) or \
+                parent not in ('plate', 'dataset'):
+            return ([], None) if cursor is not None else []
+
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, query, True,
+            experimenter_id, group_id)
+        if parent == 'plate':
+            joins = """
+                join wellsample ws on ws.image = i.id
+                join well w on w.id = ws.well
+                """
+            where_clause.append("w.plate = ?")
+        else:
+            joins = "join datasetimagelink dil on dil.child = i.id"
+            where_clause.append("dil.parent = ?")
+        args.append(parent_id)
+
+        select = ["image.id", "image.name", "lower(image.name)",
+                  "image.owner_id", "image.fileset",
+                  GROUP_PERMISSIONS % "image"]
+        from_clause = ["image image"]
+        if load_pixels:
+            select.extend(["pix.sizex", "pix.sizey", "pix.sizez",
+                           "pix.sizet"])
+            from_clause.append(
+                "left outer join pixels pix on pix.image = image.id")
+        if date:
+            select.extend(["ev.time", "image.acquisitiondate"])
+            from_clause.append(
+                "left outer join event ev on ev.id = image.creation_id")
+
+        keyset, keyset_args = _keyset(
+            [("lower(image.name)", False), ("image.id", False)], cursor)
+        paging, paging_args = _paging(page, limit, cursor)
+        q = """
+            select %s from %s
+            where image.id in (select i.id %s %s where %s)
+            %s
+            order by lower(image.name), image.id
+            %s
+            """ % (", ".join(select), " ".join(from_clause),
+                   FROM_IMAGES, joins, " and ".join(where_clause),
+                   "and %s" % keyset if keyset is not None else "",
+                   paging)
+
+        images = []
+        rows = self._execute("marshal_images", q,
+                             args + keyset_args + paging_args)
+        for row in rows:
+            kwargs = {'conn': conn,
+                      'row': [row[0], row[1], row[3], _permissions(row[5]),
+                              row[4]]}
+            if load_pixels:
+                kwargs['row_pixels'] = list(row[6:10])
+            if date:
+                kwargs['date'] = _millis(row[-2])
+                kwargs['acqDate'] = _millis(row[-1])
+            images.append(_marshal_image(**kwargs))
+
+        if thumb_version and images:
+            ids = [i['id'] for i in images]
+            user_id = conn.getUserId()
+            q = """
+                select pix.image, t.version
+                from thumbnail t join pixels pix on pix.id = t.pixels
+                where pix.image in (%s) and t.owner_id = ?
+                and t.id = (select max(t2.id) from thumbnail t2
+                            where t2.pixels = pix.id and t2.owner_id = ?)
+                """ % _marks(ids)
+            thumb_versions = dict(self._execute(
+                "marshal_images.thumb_version", q, ids + [user_id, user_id]))
+            for i in images:
+                if i['id'] in thumb_versions:
+                    i['thumbVersion'] = thumb_versions[i['id']]
+
+        if cursor is not None:
+            next_cursor = None
+            if len(rows) == limit:
+                next_cursor = [rows[-1][2], rows[-1][0]]
+            return images, next_cursor
+        return images
+
+    def marshal_autocomplete(self, conn, mapann_value, query=True,
+                             case_sensitive=False,
+                             mapann_ns=[], mapann_names=[],
+                             group_id=-1, experimenter_id=-1,
+                             page=1, limit=settings.PAGE):
+
+        autocomplete = []
+        if not mapann_value:
+            return autocomplete
+
+        mapann_value = mapann_value if case_sensitive \
+            else mapann_value.lower()
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, None, False, case_sensitive,
+            experimenter_id, group_id)
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        like = "%s like ? escape '\\'" % _cwc
+        prefix = "%s%%" % _escape_chars_like(mapann_value)
+        paging, paging_args = _paging(page, limit, None)
+
+        _q = """
+            select mv.value
+            from imageannotationlink ial
+                join annotation a on a.id = ial.child
+                join annotation_mapvalue mv on mv.annotation_id = a.id
+            where %s
+            group by mv.value
+            order by %s
+            %s
+            """
+        # query by value%, then by %value% and exclude value%
+        queries = [
+            (like, [prefix], "length(mv.value), lower(mv.value)"),
+            ("%s and not %s" % (like, like), ["%" + prefix, prefix],
+             "lower(mv.value)")]
+        candidates = search_values(
+            mapann_ns, mapann_names, mapann_value, case_sensitive)
+        if candidates is not None:
+            # values known to the value index, split by whether they start
+            # with mapann_value, like only for annotations updated since
+            values, since = candidates
+            known = ([], [])
+            for v in values:
+                start = (v if case_sensitive else v.lower()).startswith(
+                    mapann_value)
+                known[0 if start else 1].append(v)
+            for i, (clause, clause_args, order_by) in enumerate(queries):
+                clause, clause_args = _casefold_clause(
+                    (known[i], since), clause, clause_args)
+                queries[i] = (clause, clause_args, order_by)
+
+        for clause, clause_args, order_by in queries:
+            q = _q % (" and ".join(where_clause + [clause]), order_by, paging)
+            for row in self._execute("marshal_autocomplete", q,
+                                     args + clause_args + paging_args):
+                autocomplete.append({'value': row[0]})
+
+        return autocomplete
+
+    def _find_paths(self, joins, columns, where_clause, args,
+                    page_size, limit):
+        # columns are (type, sql) pairs of the objects in the path
+        group_by = ["mv.value", "i.owner_id"] + [c for t, c in columns]
+        paging, paging_args = _paging(page_size, limit, None)
+        q = """
+            select %s
+            %s
+            where %s
+            group by %s
+            %s
+            """ % (", ".join(group_by), joins, " and ".join(where_clause),
+                   ", ".join(group_by), paging)
+
+        paths = []
+        for row in self._execute("mapr_paths_to_object", q,
+                                 args + paging_args):
+            path = [{'type': 'experimenter', 'id': row[1]},
+                    {'type': 'map', 'id': row[0]}]
+            for (t, c), obj_id in zip(columns, row[2:]):
+                path.append({'type': t, 'id': obj_id})
+            paths.append(path)
+        return paths
+
+    def mapr_paths_to_object(self, conn, mapann_value,
+                             mapann_ns=[], mapann_names=[],
+                             screen_id=None, plate_id=None,
+                             project_id=None, dataset_id=None,
+                             image_id=None,
+                             experimenter_id=None, group_id=None,
+                             page_size=None, limit=settings.PAGE,
+                             first=False):
+
+        if first:
+            page_size = 1
+            limit = 1
+        where_clause, args = _where(
+            conn, mapann_ns, mapann_names, mapann_value, False, True,
+            experimenter_id, group_id)
+
+        if image_id:
+            where_clause.append("i.id = ?")
+            args.append(image_id)
+
+        spw = screen_id or plate_id or not (project_id or dataset_id)
+        pdi = project_id or dataset_id or not (screen_id or plate_id)
+        # without an object both branches only list owner and value
+        dedupe = not (screen_id or plate_id or project_id or dataset_id or
+                      image_id)
+
+        paths = []
+        if spw:
+            columns = [('screen', "sl.parent")]
+            spw_where = list(where_clause)
+            spw_args = list(args)
+            if screen_id:
+                spw_where.append("sl.parent = ?")
+                spw_args.append(screen_id)
+            if plate_id:
+                spw_where.append("w.plate = ?")
+                spw_args.append(plate_id)
+            if plate_id or image_id:
+                columns.append(('plate', "w.plate"))
+            if image_id:
+                columns.append(('image', "i.id"))
+            if not (screen_id or plate_id or image_id):
+                columns = []
+            paths.extend(self._find_paths(
+                SPW_JOINS, columns, spw_where, spw_args, page_size, limit))
+            if first and paths:
+                return paths
+
+        if pdi:
+            columns = [('project', "pdl.parent")]
+            pdi_where = list(where_clause)
+            pdi_args = list(args)
+            if project_id:
+                pdi_where.append("pdl.parent = ?")
+                pdi_args.append(project_id)
+            if dataset_id:
+                pdi_where.append("dil.parent = ?")
+                pdi_args.append(dataset_id)
+            if dataset_id or image_id:
+                columns.append(('dataset', "dil.parent"))
+            if image_id:
+                columns.append(('image', "i.id"))
+            if not (project_id or dataset_id or image_id):
+                columns = []
+            paths.extend(self._find_paths(
+                PDI_JOINS, columns, pdi_where, pdi_args, page_size, limit))
+
+        if dedupe:
+            # the same owner and value may be found in both branches
+            seen = set()
+            unique = []
+            for path in paths:
+                key = (path[0]['id'], path[1]['id'])
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(path)
+            paths = unique
+
+        return paths
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import hashlib
+import json
+import logging
+
+from django_redis import get_redis_connection
+
+from .mapr_settings import mapr_settings
+from .metrics import CACHE_REQUESTS
+
+
+logger = logging.getLogger(__name__)
+
+
+GENERATION_KEY = "mapr.generation.%s"
+RESULT_KEY = "mapr.result.%s.%s.%s.%s"
+
+# keyword arguments which do not affect the result
+IGNORED_KWARGS = ('executor',)
+
+
+def get_ttl(menu):
+    ''' Returns the result cache TTL in seconds of a menu, configured
+        as {"cache": {"ttl": 3600}} in omero.web.mapr.config,
+        or 0 if results of the menu are not cached.
+    '''
+
+    try:
+        return int(mapr_settings.CONFIG[menu]['cache']['ttl'])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def _generation(redis, menu):
+    return int(redis.get(GENERATION_KEY % menu) or 0)
+
+
+def invalidate(menu):
+    ''' Invalidates all cached results of a menu by bumping its
+        generation counter.
+    '''
+
+    redis = get_redis_connection("default")
+    return redis.incr(GENERATION_KEY % menu)
+
+
+def _cache_key(redis, conn, menu, func, kwargs):
+    # results depend on what the current user is allowed to see
+    args = json.dumps(
+        dict((k, v) for k, v in kwargs.items() if k not in IGNORED_KWARGS),
+        sort_keys=True, default=str)
+    return RESULT_KEY % (
+        menu, _generation(redis, menu), func.__name__,
+        hashlib.sha1(("%s:%s" % (conn.getUserId(), args)).encode(
+            'utf-8')).hexdigest())
+
+
+def cached(conn, menu, func, **kwargs):
+    ''' Calls func(conn=conn, **kwargs), caching the JSON serializable
+        result in redis for the TTL of the menu.
+
+        The key is built from the menu and its generation, the function,
+        the current user and all keyword arguments (value, query,
+        case_sensitive, group, experimenter, page, limit...).
+        Redis errors are logged and the function is called directly.
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param menu The mapr menu.
+        @type menu L{string}
+        @param func One of the marshal or count functions of
+        L{omero_mapr.tree}
+        @type func L{function}
+    '''
+
+    ttl = get_ttl(menu)
+    if not ttl:
+        return func(conn=conn, **kwargs)
+
+    try:
+        redis = get_redis_connection("default")
+        key = _cache_key(redis, conn, menu, func, kwargs)
+        data = redis.get(key)
+    except Exception as e:
+        logger.warning("Result cache unavailable: %s" % e)
+        return func(conn=conn, **kwargs)
+
+    if data is not None:
+        CACHE_REQUESTS.inc('result', 'hit')
+        return json.loads(data)
+    CACHE_REQUESTS.inc('result', 'miss')
+
+    result = func(conn=conn, **kwargs)
+    try:
+        redis.setex(key, ttl, json.dumps(result))
+    except Exception as e:
+        logger.warning("Result cache unavailable: %s" % e)
+    return result
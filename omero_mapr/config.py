@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import hashlib
+import json
+
+from collections import namedtuple
+
+from .mapr_settings import mapr_settings
+
+
+SerializedConfig = namedtuple('SerializedConfig', ('config', 'json', 'hash'))
+
+_serialized = None
+
+
+def serialized_config():
+    ''' Returns omero.web.mapr.config serialized as JSON with the hash of
+        the JSON. The config is serialized once per process, and again
+        if it is replaced, e.g. when the settings are reloaded.
+    '''
+
+    global _serialized
+    config = mapr_settings.CONFIG
+    serialized = _serialized
+    if serialized is None or serialized.config is not config:
+        data = json.dumps(config)
+        serialized = _serialized = SerializedConfig(
+            config, data,
+            hashlib.sha1(data.encode('utf-8')).hexdigest()[:16])
+    return serialized
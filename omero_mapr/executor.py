@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import contextvars
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from .mapr_settings import mapr_settings
+from .tracing import _shared_query_service
+
+
+THREAD_NAME_PREFIX = "mapr_query"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    ''' Returns the pool shared by all requests of the process, of
+        omero.web.mapr.query_workers threads, or None if it is 0
+    '''
+
+    global _pool
+    if _pool is None and mapr_settings.QUERY_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=mapr_settings.QUERY_WORKERS,
+                    thread_name_prefix=THREAD_NAME_PREFIX)
+    return _pool
+
+
+class QueryExecutor(object):
+
+    ''' Request scoped executor running independent queries concurrently
+        in the pool shared by all requests.
+
+        Use as a context manager; leaving the block waits for all
+        calls submitted by the request. Exceptions are raised by
+        Future.result() so callers handle them as if the call was made
+        directly.
+        With no workers (omero.web.mapr.query_workers = 0, the default)
+        calls run sequentially on submit, as do calls submitted from a
+        thread of the pool, which would otherwise wait for the pool.
+        Calls run in a copy of the caller's context, so that queries are
+        traced as part of the request. Given the gateway of the request,
+        its query service is created once by the caller and used by all
+        calls instead of each thread getting it from the gateway.
+        Given max_workers, calls run in a pool of the executor instead.
+    '''
+
+    def __init__(self, conn=None, max_workers=None):
+        self._own_pool = None
+        if max_workers is None:
+            self._pool = _get_pool()
+        elif max_workers > 0:
+            self._pool = self._own_pool = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=THREAD_NAME_PREFIX)
+        else:
+            self._pool = None
+        if threading.current_thread().name.startswith(THREAD_NAME_PREFIX):
+            self._pool = None
+        self._futures = []
+        self._query_service = None
+        if self._pool is not None and conn is not None:
+            self._query_service = (conn, conn.getQueryService())
+
+    def submit(self, func, *args, **kwargs):
+        if self._pool is not None:
+            ctx = contextvars.copy_context()
+            if self._query_service is not None:
+                ctx.run(_shared_query_service.set, self._query_service)
+            future = self._pool.submit(ctx.run, func, *args, **kwargs)
+            self._futures.append(future)
+            return future
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        wait(self._futures)
+        self._futures = []
+        if self._own_pool is not None:
+            self._own_pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
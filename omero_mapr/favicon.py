@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import base64
+import logging
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+import requests
+
+from django_redis import get_redis_connection
+from requests.adapters import HTTPAdapter
+
+from .mapr_settings import mapr_settings
+from .metrics import CACHE_REQUESTS
+from .utils.lru import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    from PIL import Image  # see ticket:2597
+except ImportError:
+    try:
+        import Image  # see ticket:2597
+    except ImportError:
+        logger.error(
+            "You need to install the Python Imaging Library. Get it at"
+            " http://www.pythonware.com/products/pil/")
+        logger.error(traceback.format_exc())
+
+
+FAVICON_KEY = "mapr.favicon.%s"
+# domains of the cached icons scored by the time they were cached
+INDEX_KEY = "mapr.favicons"
+
+# cached in place of an icon that could not be loaded
+FAILURE = b""
+
+# larger responses are not icons
+MAX_ICON_SIZE = 64 * 1024
+
+# seconds an icon is kept by each worker before asking redis again
+LOCAL_TTL = 300
+
+# number of icons loaded concurrently by the pool of each worker process,
+# shared by its requests and separate from the pool of the queries
+MAX_WORKERS = 4
+
+# image types by their leading bytes, icons are PNG otherwise
+MIMETYPES = (
+    (b"\x00\x00\x01\x00", "image/x-icon"),
+    (b"GIF8", "image/gif"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+
+_icons = LRUCache(maxsize=1024, ttl=LOCAL_TTL)
+
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS,
+                           thread_name_prefix="mapr_favicon")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    ''' Returns the HTTP session of this process, reusing connections
+        to the favicon webservice.
+    '''
+
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                      max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+@lru_cache(maxsize=1)
+def default_favicon():
+    ''' Returns omero.web.mapr.favicon as a 16x16 PNG, rendered once. '''
+
+    with Image.open(mapr_settings.DEFAULT_FAVICON) as img:
+        img.thumbnail((16, 16), Image.LANCZOS)
+        f = BytesIO()
+        img.save(f, "PNG")
+        return f.getvalue()
+
+
+def _fetch(domain):
+    url = "%s%s" % (mapr_settings.FAVICON_WEBSERVICE, domain)
+    timeout = mapr_settings.FAVICON_TIMEOUT
+    try:
+        with get_session().get(url, stream=True, timeout=timeout) as r:
+            if r.status_code != 200:
+                logger.debug("Favicon of %s not found: %s"
+                             % (domain, r.status_code))
+                return FAILURE
+            icon = r.raw.read(MAX_ICON_SIZE + 1, decode_content=True)
+    except requests.RequestException as e:
+        logger.info("Failed to load favicon of %s: %s" % (domain, e))
+        return FAILURE
+    if not icon or len(icon) > MAX_ICON_SIZE:
+        return FAILURE
+    return icon
+
+
+def _store(redis, icons):
+    now = time.time()
+    pipe = redis.pipeline()
+    for domain, icon in icons.items():
+        ttl = (mapr_settings.FAVICON_TTL if icon
+               else mapr_settings.FAVICON_FAILURE_TTL)
+        pipe.setex(FAVICON_KEY % domain, ttl, icon)
+    pipe.zadd(INDEX_KEY, dict((domain, now) for domain in icons))
+    # forget the domains whose icons have expired
+    pipe.zremrangebyscore(INDEX_KEY, 0, now - mapr_settings.FAVICON_TTL)
+    pipe.zcard(INDEX_KEY)
+    excess = pipe.execute()[-1] - mapr_settings.FAVICON_MAX_ENTRIES
+    if excess > 0:
+        # evict the icons cached first
+        evicted = redis.zpopmin(INDEX_KEY, excess)
+        redis.delete(*[FAVICON_KEY % (
+            d.decode('utf-8') if isinstance(d, bytes) else d)
+            for d, score in evicted])
+
+
+def _load(domains):
+    try:
+        redis = get_redis_connection("default")
+        cached = redis.mget([FAVICON_KEY % d for d in domains])
+    except Exception as e:
+        logger.warning("Favicon cache unavailable: %s" % e)
+        redis = None
+        cached = [None] * len(domains)
+    icons = dict((d, icon) for d, icon in zip(domains, cached)
+                 if icon is not None)
+    missing = [d for d in domains if d not in icons]
+    CACHE_REQUESTS.inc('favicon', 'hit', amount=len(icons))
+    if not missing:
+        return icons
+    CACHE_REQUESTS.inc('favicon', 'miss', amount=len(missing))
+
+    if len(missing) > 1:
+        fetched = dict(zip(missing, _pool.map(_fetch, missing)))
+    else:
+        fetched = dict((d, _fetch(d)) for d in missing)
+    if redis is not None:
+        try:
+            _store(redis, fetched)
+        except Exception as e:
+            logger.warning("Favicon cache unavailable: %s" % e)
+    icons.update(fetched)
+    return icons
+
+
+def get_favicons(domains):
+    ''' Returns a dict of the favicon of each domain loaded from
+        omero.web.mapr.favicon_webservice, or the default favicon if it
+        could not be loaded.
+
+        Icons are kept by each worker for LOCAL_TTL seconds and in redis
+        for omero.web.mapr.favicon_ttl seconds, at most
+        omero.web.mapr.favicon_max_entries of them. Failures are cached
+        for omero.web.mapr.favicon_failure_ttl seconds. Icons which are
+        not cached are loaded concurrently, by at most MAX_WORKERS threads.
+
+        @param domains Scheme and host of external URLs,
+        e.g. http://www.ensembl.org/
+        @type domains L{list}
+    '''
+
+    icons = {}
+    missing = []
+    for domain in set(domains):
+        icon = _icons.get(domain)
+        if icon is None:
+            missing.append(domain)
+        else:
+            icons[domain] = icon
+    if icons:
+        CACHE_REQUESTS.inc('favicon', 'hit', amount=len(icons))
+    if missing:
+        for domain, icon in _load(missing).items():
+            _icons.set(domain, icon)
+            icons[domain] = icon
+    return dict((d, icon or default_favicon()) for d, icon in icons.items())
+
+
+def get_favicon(domain):
+    ''' Returns the favicon of the domain, see L{get_favicons}
+
+        @param domain Scheme and host of the external URL
+        @type domain L{string}
+    '''
+
+    return get_favicons([domain])[domain]
+
+
+def data_uri(icon):
+    ''' Returns the icon as a data URI '''
+
+    mimetype = "image/png"
+    for prefix, t in MIMETYPES:
+        if icon.startswith(prefix):
+            mimetype = t
+            break
+    return "data:%s;base64,%s" % (
+        mimetype, base64.b64encode(icon).decode('ascii'))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...cache import invalidate
+from ...mapr_settings import mapr_settings
+
+
+class Command(BaseCommand):
+
+    help = "Invalidate the cached mapr results of the configured menus"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'menu', nargs='*',
+            help="Menus to invalidate, defaults to all configured menus")
+
+    def handle(self, *args, **options):
+        menus = options['menu'] or list(mapr_settings.CONFIG)
+        for menu in menus:
+            if menu not in mapr_settings.CONFIG:
+                raise CommandError("Unknown menu: %s" % menu)
+            generation = invalidate(menu)
+            self.stdout.write("%s: generation %d" % (menu, generation))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from omero.gateway import BlitzGateway
+
+from ...mapr_settings import mapr_settings
+from ...value_index import TOP_K, get_value_index
+
+
+class Command(BaseCommand):
+
+    help = "Build the mapr value index of the configured menus"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'menu', nargs='*',
+            help="Menus to build, defaults to all configured menus")
+        parser.add_argument(
+            '--casefold', action='store_true',
+            help="Only add the values of the annotations updated since the"
+                 " last run to the case-fold tables, e.g. from cron")
+        parser.add_argument('--server', default='localhost')
+        parser.add_argument('--port', type=int, default=4064)
+        parser.add_argument('--user', default='public')
+        parser.add_argument(
+            '--password', default=os.environ.get('OMERO_PASSWORD'),
+            help="Defaults to the OMERO_PASSWORD environment variable")
+
+    def handle(self, *args, **options):
+        index = get_value_index()
+        if index is None:
+            raise CommandError("omero.web.mapr.value_index is not set")
+
+        menus = options['menu'] or list(mapr_settings.CONFIG)
+        for menu in menus:
+            if menu not in mapr_settings.CONFIG:
+                raise CommandError("Unknown menu: %s" % menu)
+
+        conn = BlitzGateway(options['user'], options['password'],
+                            host=options['server'], port=options['port'],
+                            secure=True)
+        if not conn.connect():
+            raise CommandError("Could not connect to %s" % options['server'])
+        try:
+            for menu in menus:
+                config = mapr_settings.CONFIG[menu]
+                mapann_ns = config.get('ns', [])
+                mapann_names = config.get('all', [])
+                if not options['casefold']:
+                    count = index.build(conn, menu, mapann_ns=mapann_ns,
+                                        mapann_names=mapann_names)
+                    self.stdout.write("%s: %d rows" % (menu, count))
+                    # the leaderboard holds the values listed by wildcards
+                    top = config.get('wildcard', {}).get('limit') or TOP_K
+                    count = index.build_top(conn, menu, mapann_ns=mapann_ns,
+                                            mapann_names=mapann_names,
+                                            top=top)
+                    self.stdout.write("%s: %d top values" % (menu, count))
+                if not conn.isAdmin():
+                    # the case-fold tables are used by every user
+                    if options['casefold']:
+                        raise CommandError(
+                            "--casefold requires an administrator")
+                    self.stdout.write(
+                        "%s: case-fold table skipped, requires an"
+                        " administrator" % menu)
+                    continue
+                count = index.refresh_casefold(conn, mapann_ns=mapann_ns,
+                                               mapann_names=mapann_names)
+                self.stdout.write("%s: %d values case-folded" % (menu, count))
+        finally:
+            conn.close()
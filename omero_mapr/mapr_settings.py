@@ -25,6 +25,7 @@ import os
 
 from django.conf import settings
 from omeroweb.settings import process_custom_settings, report_settings
+from omeroweb.settings import parse_boolean
 from omero_mapr.utils import config_list_to_dict
 
 
@@ -46,6 +47,156 @@ MAPR_SETTINGS_MAPPING = {
                 " Icons are cached in redis which must be available."
             )
          ],
+    "omero.web.mapr.favicon_ttl":
+        ["MAPR_FAVICON_TTL",
+         604800,
+         int,
+         (
+             "Number of seconds a favicon is cached in redis."
+         )],
+    "omero.web.mapr.favicon_failure_ttl":
+        ["MAPR_FAVICON_FAILURE_TTL",
+         3600,
+         int,
+         (
+             "Number of seconds the default favicon is shown for a domain"
+             " whose favicon could not be loaded before trying again."
+         )],
+    "omero.web.mapr.favicon_max_entries":
+        ["MAPR_FAVICON_MAX_ENTRIES",
+         10000,
+         int,
+         (
+             "Maximum number of favicons cached in redis. The favicons"
+             " cached first are evicted."
+         )],
+    "omero.web.mapr.favicon_timeout":
+        ["MAPR_FAVICON_TIMEOUT",
+         2.0,
+         float,
+         (
+             "Number of seconds to wait for the favicon webservice to"
+             " connect and to respond."
+         )],
+    "omero.web.mapr.value_index":
+        ["MAPR_VALUE_INDEX",
+         "",
+         str,
+         (
+             "Path to a local SQLite file holding the materialized index of"
+             " distinct values for each configured menu. When set and built"
+             " (see the mapr_value_index management command), autocomplete"
+             " and counts are answered from the index instead of OMERO."
+         )],
+    "omero.web.mapr.autocomplete_memory":
+        ["MAPR_AUTOCOMPLETE_MEMORY",
+         0,
+         int,
+         (
+             "Memory budget in MB for the in-process autocomplete prefix"
+             " tables loaded from the value index at worker start."
+             " Menus and groups that do not fit fall back to the value index."
+             " 0 disables the prefix tables."
+         )],
+    "omero.web.mapr.query_workers":
+        ["MAPR_QUERY_WORKERS",
+         0,
+         int,
+         (
+             "Number of threads shared by the requests of a worker process"
+             " to run independent queries concurrently, e.g. screens and"
+             " projects. 0 runs all queries sequentially."
+         )],
+    "omero.web.mapr.count_batch_size":
+        ["MAPR_COUNT_BATCH_SIZE",
+         1000,
+         int,
+         (
+             "Maximum number of values counted by a single request to the"
+             " batch count endpoint api/<menu>/counts/."
+         )],
+    "omero.web.mapr.trace_sample_rate":
+        ["MAPR_TRACE_SAMPLE_RATE",
+         1.0,
+         float,
+         (
+             "Fraction (0 to 1) of the HQL queries logged at DEBUG level"
+             " with their duration, fingerprint and row count."
+         )],
+    "omero.web.mapr.slow_query_ms":
+        ["MAPR_SLOW_QUERY_MS",
+         0,
+         int,
+         (
+             "HQL queries taking longer than this number of milliseconds"
+             " are always logged as warnings. 0 disables it."
+         )],
+    "omero.web.mapr.server_timing":
+        ["MAPR_SERVER_TIMING",
+         "false",
+         parse_boolean,
+         (
+             "Add the number and total duration of the HQL queries of"
+             " each API request as a Server-Timing response header."
+         )],
+    "omero.web.mapr.thumbnail_cache_ttl":
+        ["MAPR_THUMBNAIL_CACHE_TTL",
+         0,
+         int,
+         (
+             "Number of seconds the thumbnail versions of the images listed"
+             " with thumbVersion=true are cached in redis per user."
+             " Cached versions are refreshed with the thumbnails updated"
+             " since they were loaded. 0 disables the cache."
+         )],
+    "omero.web.mapr.light_permissions":
+        ["MAPR_LIGHT_PERMISSIONS",
+         "false",
+         parse_boolean,
+         (
+             "Project only the group of the listed containers and images"
+             " instead of loading whole objects for their permissions, which"
+             " are then derived from the permissions of the group, the owner"
+             " and the role of the current user in the group."
+         )],
+    "omero.web.mapr.inline_bundle":
+        ["MAPR_INLINE_BUNDLE",
+         "false",
+         parse_boolean,
+         (
+             "Embed the value count, the screens and projects and the"
+             " children of the first of them (see api/<menu>/bundle/)"
+             " in the page opened with ?value=, instead of the tree loading"
+             " them with one request per level."
+         )],
+    "omero.web.mapr.backend":
+        ["MAPR_BACKEND",
+         "omero_mapr.backends.hql.HqlBackend",
+         str,
+         (
+             "Dotted path of the class answering mapr queries."
+             " omero_mapr.backends.sql.SqlBackend runs them as SQL against"
+             " a copy of the OMERO database set by"
+             " omero.web.mapr.backend_dsn."
+         )],
+    "omero.web.mapr.backend_dsn":
+        ["MAPR_BACKEND_DSN",
+         "",
+         str,
+         (
+             "Database used by the SQL backend, postgresql://user@host/db"
+             " for a (read-only) replica of the OMERO database, which"
+             " requires psycopg2, or sqlite:///path for a local snapshot."
+         )],
+    "omero.web.mapr.metrics":
+        ["MAPR_METRICS",
+         "false",
+         parse_boolean,
+         (
+             "Expose request latencies, HQL query counts, durations and rows"
+             " and cache hit rates of each OMERO.web worker in the"
+             " Prometheus text format at mapr/metrics/."
+         )],
     }
 
 
@@ -67,6 +218,32 @@ class MaprSettings(object):
                                      MAPR_DEFAULT_FAVICON)  # noqa
     FAVICON_WEBSERVICE = prefix_setting('FAVICON_WEBSERVICE',
                                         MAPR_FAVICON_WEBSERVICE)  # noqa
+    FAVICON_TTL = prefix_setting('FAVICON_TTL', MAPR_FAVICON_TTL)  # noqa
+    FAVICON_FAILURE_TTL = prefix_setting('FAVICON_FAILURE_TTL',
+                                         MAPR_FAVICON_FAILURE_TTL)  # noqa
+    FAVICON_MAX_ENTRIES = prefix_setting('FAVICON_MAX_ENTRIES',
+                                         MAPR_FAVICON_MAX_ENTRIES)  # noqa
+    FAVICON_TIMEOUT = prefix_setting('FAVICON_TIMEOUT',
+                                     MAPR_FAVICON_TIMEOUT)  # noqa
+    VALUE_INDEX = prefix_setting('VALUE_INDEX', MAPR_VALUE_INDEX)  # noqa
+    AUTOCOMPLETE_MEMORY = prefix_setting('AUTOCOMPLETE_MEMORY',
+                                         MAPR_AUTOCOMPLETE_MEMORY)  # noqa
+    QUERY_WORKERS = prefix_setting('QUERY_WORKERS', MAPR_QUERY_WORKERS)  # noqa
+    COUNT_BATCH_SIZE = prefix_setting('COUNT_BATCH_SIZE',
+                                      MAPR_COUNT_BATCH_SIZE)  # noqa
+    TRACE_SAMPLE_RATE = prefix_setting('TRACE_SAMPLE_RATE',
+                                       MAPR_TRACE_SAMPLE_RATE)  # noqa
+    SLOW_QUERY_MS = prefix_setting('SLOW_QUERY_MS', MAPR_SLOW_QUERY_MS)  # noqa
+    SERVER_TIMING = prefix_setting('SERVER_TIMING', MAPR_SERVER_TIMING)  # noqa
+    METRICS = prefix_setting('METRICS', MAPR_METRICS)  # noqa
+    THUMBNAIL_CACHE_TTL = prefix_setting('THUMBNAIL_CACHE_TTL',
+                                         MAPR_THUMBNAIL_CACHE_TTL)  # noqa
+    LIGHT_PERMISSIONS = prefix_setting('LIGHT_PERMISSIONS',
+                                       MAPR_LIGHT_PERMISSIONS)  # noqa
+    INLINE_BUNDLE = prefix_setting('INLINE_BUNDLE',
+                                   MAPR_INLINE_BUNDLE)  # noqa
+    BACKEND = prefix_setting('BACKEND', MAPR_BACKEND)  # noqa
+    BACKEND_DSN = prefix_setting('BACKEND_DSN', MAPR_BACKEND_DSN)  # noqa
 
 
 mapr_settings = MaprSettings()
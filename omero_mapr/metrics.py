@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import threading
+
+from bisect import bisect_left
+
+
+# Upper bounds in seconds of the latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (n, _escape(v)) for n, v in pairs)
+
+
+def _format(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+
+    ''' Monotonic counter per combination of label values '''
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield "%s%s %s" % (self.name, _labels(self.labelnames, labels),
+                               _format(value))
+
+
+class Histogram(object):
+
+    ''' Cumulative histogram per combination of label values '''
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(b) for b in sorted(buckets)) + (
+            float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket followed by the sum
+                counts = self._values[labels] = [0] * len(self.buckets) + [0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def count(self, *labels):
+        counts = self._values.get(labels)
+        return sum(counts[:-1]) if counts is not None else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((k, list(v)) for k, v in self._values.items())
+        for labels, counts in values:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield "%s_bucket%s %d" % (
+                    self.name,
+                    _labels(self.labelnames, labels, [('le', _format(bound))]),
+                    cumulative)
+            label_str = _labels(self.labelnames, labels)
+            yield "%s_sum%s %s" % (self.name, label_str, _format(counts[-1]))
+            yield "%s_count%s %d" % (self.name, label_str, cumulative)
+
+
+class Registry(object):
+
+    ''' Metrics of this process rendered in the Prometheus text format '''
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'mapr_request_duration_seconds',
+    'Time spent in mapr views.', ('view',)))
+
+HQL_DURATION = REGISTRY.register(Histogram(
+    'mapr_hql_duration_seconds',
+    'Time spent in HQL queries per function.', ('function',)))
+
+HQL_ERRORS = REGISTRY.register(Counter(
+    'mapr_hql_errors_total',
+    'HQL queries that raised an exception per function.', ('function',)))
+
+HQL_ROWS = REGISTRY.register(Counter(
+    'mapr_hql_rows_total',
+    'Rows returned by HQL queries per function.', ('function',)))
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'mapr_cache_requests_total',
+    'Cache lookups per cache and result (hit or miss).',
+    ('cache', 'result')))
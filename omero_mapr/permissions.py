@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import omero
+
+from copy import deepcopy
+
+from omero.rtypes import rlong
+
+from .mapr_settings import mapr_settings
+from .tracing import get_query_service
+from .utils.lru import LRUCache
+
+
+# (read, annotate, write) bits of the groups, shared by all users
+GROUP_PERMISSIONS = LRUCache(maxsize=1024, ttl=300)
+
+
+def _group_permissions(conn, group_id):
+    bits = GROUP_PERMISSIONS.get(group_id)
+    if bits is None:
+        service_opts = deepcopy(conn.SERVICE_OPTS)
+        service_opts.setOmeroGroup(-1)
+        params = omero.sys.ParametersI()
+        params.add('gid', rlong(group_id))
+        group = get_query_service(conn, "group_permissions").findByQuery(
+            "select g from ExperimenterGroup g where g.id = :gid",
+            params, service_opts)
+        perms = group.getDetails().getPermissions()
+        bits = (perms.isGroupRead(), perms.isGroupAnnotate(),
+                perms.isGroupWrite())
+        GROUP_PERMISSIONS.set(group_id, bits)
+    return bits
+
+
+class PermissionsProjection(object):
+
+    ''' Selects the permissions of the listed objects.
+
+        By default whole objects are projected as
+        <alias>_details_permissions, for the server to compute what the
+        current user can do with each of them.
+        With omero.web.mapr.light_permissions only the group id is projected
+        and the permissions are derived from the permission bits of the
+        group and the owner, once per (group, owner) pair.
+    '''
+
+    def __init__(self, conn, light=None):
+        self.conn = conn
+        if light is None:
+            light = mapr_settings.LIGHT_PERMISSIONS
+        self.light = light
+        self._memo = {}
+
+    def select(self, alias):
+        ''' Returns the projection of the permissions of alias
+
+            @param alias The alias of the object in the query.
+            @type alias L{string}
+        '''
+
+        if self.light:
+            return "%s.details.group.id as %s_details_group" % (alias, alias)
+        return "%s as %s_details_permissions" % (alias, alias)
+
+    def get(self, row, alias, owner_id):
+        ''' Returns the permissions of the object of a row, as expected by
+            L{omeroweb.webclient.tree.parse_permissions_css}
+
+            @param row The unwrapped map of the row.
+            @type row L{dict}
+            @param alias The alias of the object in the query.
+            @type alias L{string}
+            @param owner_id The owner of the object.
+            @type owner_id L{long}
+        '''
+
+        if not self.light:
+            return row['%s_details_permissions' % alias]
+        group_id = row['%s_details_group' % alias]
+        key = (group_id, owner_id)
+        permissions = self._memo.get(key)
+        if permissions is None:
+            permissions = self._memo[key] = self._derive(group_id, owner_id)
+        return permissions
+
+    def _derive(self, group_id, owner_id):
+        _, annotate, write = _group_permissions(self.conn, group_id)
+        ec = self.conn.getEventContext()
+        owned = owner_id == ec.userId
+        member = group_id in ec.memberOfGroups
+        leader = group_id in ec.leaderOfGroups
+        can_edit = owned or ec.isAdmin or leader or (member and write)
+        return {
+            'canEdit': can_edit,
+            'canAnnotate': can_edit or (member and (annotate or write)),
+            'canLink': can_edit,
+            'canDelete': can_edit,
+            'canChgrp': owned or ec.isAdmin,
+            'canChown': ec.isAdmin,
+        }
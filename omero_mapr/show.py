@@ -32,6 +32,7 @@ from omero.rtypes import rint, rlong, unwrap
 
 import omeroweb.webclient.show as omeroweb_show
 from .tree import _set_parameters
+from .tracing import get_query_service
 
 from omeroweb.utils import reverse_with_params
 
@@ -133,8 +134,7 @@ class MapShow(omeroweb_show.Show):
                  "JOIN a.mapValue mv "
                  "WHERE mv.value = :mvalue")
 
-            qs = self.conn.getQueryService()
-            logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+            qs = get_query_service(self.conn)
             m = qs.findByQuery(q, params, service_opts)
             # hardcode to always tell to load all users
             return omero.gateway.MapAnnotationWrapper(self.conn, m)
@@ -143,15 +143,75 @@ class MapShow(omeroweb_show.Show):
 omeroweb_show.Show = MapShow
 
 
+SPW_JOINS = """
+    from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+        join ial.parent i join i.wellSamples ws join ws.well w
+        join w.plate pl join pl.screenLinks sl
+    """
+
+PDI_JOINS = """
+    from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+        join ial.parent i join i.datasetLinks dil join dil.parent ds
+        join ds.projectLinks pdl
+    """
+
+
+def _find_paths(qs, joins, columns, where_clause, params, service_opts):
+    # columns are (type, hql) pairs of the objects in the path
+    select = ["mv.value as map_value", "i.details.owner.id as owner"]
+    select += ["%s as %s_id" % (hql, t) for t, hql in columns]
+    group_by = ["mv.value", "i.details.owner.id"] + [
+        hql for t, hql in columns]
+    q = """
+        select new map(%s, count(i.id) as imgCount)
+        %s
+        where %s
+        group by %s
+        """ % (", ".join(select), joins, " and ".join(where_clause),
+               ", ".join(group_by))
+
+    paths = []
+    for e in unwrap(qs.projection(q, params, service_opts)):
+        e = e[0]
+        path = [{'type': 'experimenter', 'id': e["owner"]},
+                {'type': 'map', 'id': e["map_value"]}]
+        for t, hql in columns:
+            path.append({'type': t, 'id': e["%s_id" % t]})
+        paths.append(path)
+    return paths
+
+
 def mapr_paths_to_object(conn, mapann_value,
                          mapann_ns=[], mapann_names=[],
                          screen_id=None, plate_id=None,
                          project_id=None, dataset_id=None,
                          image_id=None,
                          experimenter_id=None, group_id=None,
-                         page_size=None, limit=settings.PAGE):
-
-    qs = conn.getQueryService()
+                         page_size=None, limit=settings.PAGE,
+                         first=False):
+
+    ''' Lists the paths from a Map annotation value to an object,
+        [experimenter, map, screen, plate, image] or
+        [experimenter, map, project, dataset, image], with the levels below
+        the requested object left out.
+
+        Only the Screen/Plate or Project/Dataset branch implied by the
+        object is queried. Both are queried for an image, the
+        Project/Dataset one only if no path was found with first.
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param first Only look for one path
+        @type first L{boolean}
+    '''
+
+    if first:
+        page_size = 1
+        limit = 1
+
+    qs = get_query_service(conn)
     params, where_clause = _set_parameters(
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=False, mapann_value=mapann_value,
@@ -163,171 +223,65 @@ def mapr_paths_to_object(conn, mapann_value,
     if group_id is not None:
         service_opts.setOmeroGroup(group_id)
 
-    q = []
-    q.append(" SELECT distinct new map( "
-             " mv.value as map_value, "
-             " i.details.owner.id as owner, ")
-
-    q_select = []
-    if screen_id or plate_id:
-        q_select.append(" sl.parent.id as screen_id, ")
-        if plate_id:
-            q_select.append(" pl.id as plate_id, ")
-    elif project_id or dataset_id:
-        q_select.append(" pdl.parent.id as project_id,  ")
-        if dataset_id:
-            q_select.append(" ds.id as dataset_id, ")
-    elif image_id:
-        q_select.append(" COALESCE(sl.parent.id,null) as screen_id, "
-                        " COALESCE(pdl.parent.id,null) as project_id, "
-                        " COALESCE(pl.id,null) as plate_id, "
-                        " COALESCE(ds.id,null) as dataset_id "
-                        " i.id as image_id, ")
-
-    if q_select:
-        q.append(" ".join(q_select))
-
-    q.append(" count(i.id) as imgCount) "
-             " FROM ImageAnnotationLink ial "
-             " join ial.child a "
-             " join a.mapValue mv "
-             " join ial.parent i "
-             " left outer join i.details.owner "
-             " left outer join i.wellSamples ws "
-             " left outer join ws.well w "
-             " left outer join w.plate pl "
-             " left outer join pl.screenLinks sl "
-             " left outer join i.datasetLinks dil "
-             " left outer join dil.parent ds "
-             " left outer join ds.projectLinks pdl "
-             " WHERE ( "
-             " (dil is null "
-             " and ds is null and pdl is null "
-             " and ws is not null "
-             " and w is not null and pl is not null "
-             " and sl is not null) "
-             " OR "
-             " (ws is null "
-             " and w is null and pl is null and sl is null "
-             " and dil is not null "
-             " and ds is not null and pdl is not null ) "
-             " ) "
-             " AND ")
-
     if image_id:
-        q.append(" i.id = :iid and ")
         params.add('iid', rlong(image_id))
-    elif screen_id:
-        q.append(" sl.parent.id = :sid and ")
-        params.add('sid', rlong(screen_id))
-    elif plate_id:
-        q.append(" pl.id = :pid and ")
-        params.add('pid', rlong(plate_id))
-    elif project_id:
-        q.append(" pdl.parent.id = :pid and ")
-        params.add('pid', rlong(project_id))
-    elif dataset_id:
-        q.append(" ds.id = :did and ")
-        params.add('did', rlong(dataset_id))
-
-    if len(where_clause) > 0:
-        q.append(" and ".join(where_clause))
-
-    q.append(" group by mv.value, i.details.owner.id ")
-
-    q_groupby = []
-    if screen_id:
-        q_groupby.append(" sl.parent.id ")
-    elif plate_id:
-        q_groupby.append(" sl.parent.id ")
-        q_groupby.append(" pl.id ")
-    elif project_id:
-        q_groupby.append(" pdl.parent.id ")
-    elif dataset_id:
-        q_groupby.append(" pdl.parent.id ")
-        q_groupby.append(" ds.id ")
-    elif image_id:
-        q_groupby.append(" COALESCE(sl.parent.id,null) ")
-        q_groupby.append(" COALESCE(pdl.parent.id,null) ")
-        q_groupby.append(" COALESCE(pl.id,null) ")
-        q_groupby.append(" COALESCE(ds.id,null) ")
-        q_groupby.append(" i.id ")
-
-    if q_groupby:
-        q.append(", " + ", ".join(q_groupby))
-
-    query = "".join(q)
-
-    # Hierarchies for this object
+        where_clause.append("i.id = :iid")
+
+    spw = screen_id or plate_id or not (project_id or dataset_id)
+    pdi = project_id or dataset_id or not (screen_id or plate_id)
+    # without an object both branches only list owner and value
+    dedupe = not (screen_id or plate_id or project_id or dataset_id or
+                  image_id)
+
     paths = []
+    if spw:
+        columns = [('screen', "sl.parent.id")]
+        spw_params = deepcopy(params)
+        spw_where = list(where_clause)
+        if screen_id:
+            spw_params.add('sid', rlong(screen_id))
+            spw_where.append("sl.parent.id = :sid")
+        if plate_id:
+            spw_params.add('plid', rlong(plate_id))
+            spw_where.append("pl.id = :plid")
+        if plate_id or image_id:
+            columns.append(('plate', "pl.id"))
+        if image_id:
+            columns.append(('image', "i.id"))
+        if not (screen_id or plate_id or image_id):
+            columns = []
+        paths.extend(_find_paths(
+            qs, SPW_JOINS, columns, spw_where, spw_params, service_opts))
+        if first and paths:
+            return paths
+
+    if pdi:
+        columns = [('project', "pdl.parent.id")]
+        pdi_where = list(where_clause)
+        if project_id:
+            params.add('prid', rlong(project_id))
+            pdi_where.append("pdl.parent.id = :prid")
+        if dataset_id:
+            params.add('did', rlong(dataset_id))
+            pdi_where.append("ds.id = :did")
+        if dataset_id or image_id:
+            columns.append(('dataset', "ds.id"))
+        if image_id:
+            columns.append(('image', "i.id"))
+        if not (project_id or dataset_id or image_id):
+            columns = []
+        paths.extend(_find_paths(
+            qs, PDI_JOINS, columns, pdi_where, params, service_opts))
+
+    if dedupe:
+        # the same owner and value may be found in both branches
+        seen = set()
+        unique = []
+        for path in paths:
+            key = (path[0]['id'], path[1]['id'])
+            if key not in seen:
+                seen.add(key)
+                unique.append(path)
+        paths = unique
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (query, params))
-    for e in unwrap(qs.projection(query, params, service_opts)):
-        path = []
-
-        # Experimenter is always present
-        try:
-            experimenter_id = e[0]["owner"]
-        except Exception:
-            experimenter_id = -1
-        path.append({
-            'type': 'experimenter',
-            'id': experimenter_id
-        })
-
-        try:
-            map_value = e[0]["map_value"]
-            path.append({
-                'type': 'map',
-                'id': map_value,
-            })
-        except Exception:
-            pass
-
-        try:
-            if e[0]["screen_id"] is not None:
-                path.append({
-                    'type': 'screen',
-                    'id': e[0]["screen_id"]
-                })
-        except Exception:
-            pass
-
-        try:
-            if e[0]["plate_id"] is not None:
-                plate_id = e[0]["plate_id"]
-                path.append({
-                    'type': 'plate',
-                    'id': plate_id,
-                })
-        except Exception:
-            pass
-
-        try:
-            if e[0]["project_id"] is not None:
-                path.append({
-                    'type': 'project',
-                    'id': e[0]["project_id"]
-                })
-        except Exception:
-            pass
-
-        try:
-            if e[0]["dataset_id"] is not None:
-                path.append({
-                    'type': 'dataset',
-                    'id': e[0]["dataset_id"],
-                })
-        except Exception:
-            pass
-
-        # Image is always present
-        try:
-            path.append({
-                'type': 'image',
-                'id': e[0]["image_id"]
-            })
-        except Exception:
-            pass
-        paths.append(path)
     return paths
@@ -21,6 +21,47 @@
 //   Here we override jstree setup and configure
 
 
+// Answer the first requests of the tree from the bundle embedded in the page
+// (see omero.web.mapr.inline_bundle), each response only once.
+$.ajaxTransport("+*", function(options, originalOptions) {
+    if (typeof MAPANNOTATIONS === "undefined" || !MAPANNOTATIONS.BUNDLE) {
+        return;
+    }
+    var bundle = MAPANNOTATIONS.BUNDLE,
+        data = originalOptions.data || {},
+        url = originalOptions.url,
+        rsp;
+    if (data.orphaned || parseInt(data.page || 1) > 1 ||
+            (data.group !== undefined && String(data.group) !== String(bundle.group)) ||
+            (data.value !== undefined && data.value !== bundle.value)) {
+        return;
+    }
+    if (url === WEBCLIENT.URLS.api_experimenter && bundle.experimenter) {
+        rsp = {'experimenter': bundle.experimenter};
+        bundle.experimenter = null;
+    } else if (url === WEBCLIENT.URLS.tree_top_level && bundle.mapannotations &&
+            (data.id === undefined || data.id == -1 || data.id === bundle.value)) {
+        rsp = bundle.mapannotations;
+        bundle.mapannotations = null;
+    } else if (url === WEBCLIENT.URLS.api_plates && bundle.plates[data.id]) {
+        rsp = {'plates': bundle.plates[data.id]};
+        delete bundle.plates[data.id];
+    } else if (url === WEBCLIENT.URLS.api_datasets && bundle.datasets[data.id]) {
+        rsp = {'datasets': bundle.datasets[data.id]};
+        delete bundle.datasets[data.id];
+    } else {
+        return;
+    }
+    return {
+        send: function(headers, complete) {
+            complete(200, "success", {'text': JSON.stringify(rsp)},
+                     "Content-Type: application/json");
+        },
+        abort: function() {}
+    };
+});
+
+
 // jQuery load callback...
 
 $(function () {
@@ -35,6 +76,10 @@ $(function () {
         }
         if (MAPANNOTATIONS.CTX.value.length > 0) {
             payload['value'] = MAPANNOTATIONS.CTX.value;
+        } else if (node.id === '#') {
+            // estimate the number of values to show the tree at once,
+            // they are counted exactly on demand (see below)
+            payload['count_mode'] = 'approx';
         }
         // case sensitive results in a JSTree
         //if (MAPANNOTATIONS.CTX.case_sensitive.length > 0) {
@@ -105,6 +150,32 @@ $(function () {
     };
 
 
+    // ----- Exact count -----
+    // replace the estimated number of values of the experimenter
+    // once it is hovered or opened
+    var exactCount = function(e, data) {
+        var inst = data.instance;
+        var node = inst.get_node(data.node);
+        if (!node || node.type !== 'experimenter') return;
+        var obj = node.data.obj;
+        if (!obj.extra || !obj.extra.approximate || obj.extra.counting) {
+            return;
+        }
+        obj.extra.counting = true;
+        var payload = {'experimenter': obj.id,
+                       'group': WEBCLIENT.active_group_id};
+        $.getJSON(WEBCLIENT.URLS.api_experimenter, payload, function(rsp) {
+            obj.childCount = rsp.experimenter.childCount;
+            delete obj.extra.approximate;
+            inst.redraw_node(node);
+        }).always(function() {
+            delete obj.extra.counting;
+        });
+    };
+    $('#dataTree').on('hover_node.jstree', exactCount);
+    $('#dataTree').on('open_node.jstree', exactCount);
+
+
     // ----- Show -----
     // e.g. /mapr/gene/?value=CDC5&show=screen-51
     // $('#dataTree').on('loaded.jstree', function(e, data) {
@@ -121,7 +192,7 @@ $(function () {
             // Find node that contains study:
             // /mapr/api/gene/paths_to_object/?map.value=CEP120&project=18328
             var url = MAPANNOTATIONS.URLS.paths_to_object + '?' + show.replace('-', '=');
-            $.getJSON(url, {'map.value': value}, function(data) {
+            $.getJSON(url, {'map.value': value, 'first': true}, function(data) {
                 if (data.paths && data.paths.length > 0) {
                     // Just traverse the first path, start looking at child of root
                     let pathToObj = data.paths[0].slice(1);
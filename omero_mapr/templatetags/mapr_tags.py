@@ -25,11 +25,10 @@
 #
 
 import logging
-import json
 
 from django import template
 from django.utils.safestring import mark_safe
-from ..mapr_settings import mapr_settings
+from ..config import serialized_config
 
 register = template.Library()
 
@@ -38,4 +37,4 @@ logger = logging.getLogger(__name__)
 
 @register.simple_tag
 def mapr_menu_config():
-    return mark_safe(json.dumps(mapr_settings.CONFIG))
+    return mark_safe(serialized_config().json)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import logging
+
+from copy import deepcopy
+
+import omero
+
+from django_redis import get_redis_connection
+from omero.rtypes import rlong, unwrap
+
+from .mapr_settings import mapr_settings
+from .metrics import CACHE_REQUESTS
+from .tracing import get_query_service
+
+
+logger = logging.getLogger(__name__)
+
+
+# hash of image id -> "thumbnail id:version" of the thumbnails of an owner,
+# "" if the image has no thumbnail
+VERSIONS_KEY = "mapr.thumbs.%s"
+# last update event of the thumbnails of an owner seen by the cache
+WATERMARK_KEY = "mapr.thumbs.%s.since"
+
+
+def _all_groups(conn):
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+    service_opts.setOmeroGroup(-1)
+    return service_opts
+
+
+def _latest(rows, versions):
+    ''' Keeps the version of the most recent (max id) thumbnail per image
+        and returns the last update event of the rows
+    '''
+
+    since = 0
+    latest = {}
+    for iid, tid, version, event_id in rows:
+        since = max(since, event_id)
+        if iid not in latest or tid > latest[iid][0]:
+            latest[iid] = (tid, version)
+    for iid, (tid, version) in latest.items():
+        current = versions.get(iid)
+        if not current or tid >= int(current.split(":")[0]):
+            versions[iid] = "%d:%d" % (tid, version)
+    return since
+
+
+def _load_watermark(qs, params, service_opts):
+    q = """
+        select max(t.details.updateEvent.id) from Thumbnail t
+        where t.details.owner.id = :thumbOwner
+        """
+    rows = unwrap(qs.projection(q, params, service_opts))
+    return rows[0][0] if rows and rows[0][0] is not None else 0
+
+
+def _refresh(qs, params, service_opts, since, versions):
+    # thumbnails created or regenerated since the cache last looked
+    params = deepcopy(params)
+    params.add('since', rlong(since))
+    q = """
+        select pix.image.id, t.id, t.version, t.details.updateEvent.id
+        from Thumbnail t join t.pixels pix
+        where t.details.owner.id = :thumbOwner
+        and t.details.updateEvent.id > :since
+        """
+    rows = unwrap(qs.projection(q, params, service_opts))
+    return max(since, _latest(rows, versions))
+
+
+def _fill(qs, params, service_opts, image_ids, versions):
+    params = deepcopy(params)
+    params.addIds(image_ids)
+    q = """
+        select image.id, thumbs.id, thumbs.version,
+            thumbs.details.updateEvent.id
+        from Image image
+            join image.pixels pix join pix.thumbnails thumbs
+        where image.id in (:ids)
+        and thumbs.details.owner.id = :thumbOwner
+        """
+    for iid in image_ids:
+        versions[iid] = ""
+    return _latest(unwrap(qs.projection(q, params, service_opts)), versions)
+
+
+def get_thumbnail_versions(conn, image_ids):
+    ''' Returns the version of the most recent thumbnail owned by the
+        current user of each image, cached in redis per user.
+
+        Versions missing from the cache are loaded in bulk, without the
+        max(id) subquery per image. Cached versions are kept up to date
+        by loading only the thumbnails updated since the last update event
+        seen, so that browsing a plate again costs a lookup in redis and a
+        query returning the thumbnails which changed meanwhile.
+
+        Returns None if omero.web.mapr.thumbnail_cache_ttl is 0 or redis
+        is unavailable, in which case the versions should be queried.
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param image_ids The Image IDs.
+        @type image_ids L{list}
+    '''
+
+    ttl = mapr_settings.THUMBNAIL_CACHE_TTL
+    if not ttl:
+        return None
+    if not image_ids:
+        return {}
+
+    owner = conn.getUserId()
+    versions_key = VERSIONS_KEY % owner
+    watermark_key = WATERMARK_KEY % owner
+    try:
+        redis = get_redis_connection("default")
+        since = redis.get(watermark_key)
+        cached = redis.hmget(versions_key, image_ids)
+    except Exception as e:
+        logger.warning("Thumbnail cache unavailable: %s" % e)
+        return None
+
+    if since is None:
+        # without a watermark cached versions can't be refreshed
+        cached = [None] * len(image_ids)
+    versions = {}
+    missing = []
+    for iid, v in zip(image_ids, cached):
+        if v is None:
+            missing.append(iid)
+        else:
+            versions[iid] = v.decode('utf-8') if isinstance(v, bytes) else v
+    CACHE_REQUESTS.inc('thumbnail', 'hit',
+                       amount=len(image_ids) - len(missing))
+    CACHE_REQUESTS.inc('thumbnail', 'miss', amount=len(missing))
+
+    qs = get_query_service(conn, "thumbnail_versions")
+    params = omero.sys.ParametersI()
+    params.add('thumbOwner', rlong(owner))
+    service_opts = _all_groups(conn)
+
+    # The watermark is taken before filling the cache so that
+    # thumbnails changed while filling are refreshed next time
+    updated = dict(versions)
+    since_missing = since is None
+    if since_missing:
+        since = _load_watermark(qs, params, service_opts)
+        new_since = since
+    else:
+        since = int(since)
+        new_since = _refresh(qs, params, service_opts, since, updated)
+    if missing:
+        new_since = max(new_since, _fill(
+            qs, params, service_opts, missing, updated))
+
+    changed = dict((iid, v) for iid, v in updated.items()
+                   if versions.get(iid) != v)
+    try:
+        pipe = redis.pipeline()
+        if since_missing:
+            pipe.delete(versions_key)
+        if changed:
+            pipe.hset(versions_key, mapping=changed)
+        pipe.set(watermark_key, new_since)
+        pipe.expire(versions_key, ttl)
+        pipe.expire(watermark_key, ttl)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Thumbnail cache unavailable: %s" % e)
+
+    return dict((iid, int(updated[iid].split(":")[1])) for iid in image_ids
+                if updated.get(iid))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import hashlib
+import logging
+import random
+import re
+import sys
+import threading
+import time
+
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+
+from .mapr_settings import mapr_settings
+from .metrics import HQL_DURATION, HQL_ERRORS, HQL_ROWS, REQUEST_DURATION
+
+
+logger = logging.getLogger(__name__)
+
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+# totals of the current request, see server_timing
+_request_trace = ContextVar('mapr_request_trace', default=None)
+
+# (gateway, query service) created by the request thread for the threads of
+# its L{omero_mapr.executor.QueryExecutor}, see get_query_service
+_shared_query_service = ContextVar('mapr_shared_query_service',
+                                   default=None)
+
+
+@lru_cache(maxsize=512)
+def fingerprint(q):
+    ''' Returns a short hash of the query with whitespace collapsed and
+        literals replaced, identifying queries built from the same template.
+    '''
+
+    normalized = _LITERALS.sub("?", _WHITESPACE.sub(" ", q).strip())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+class _Compact(object):
+
+    ''' Formats a query on one line, only if it is logged '''
+
+    def __init__(self, q):
+        self.q = q
+
+    def __str__(self):
+        return _WHITESPACE.sub(" ", self.q).strip()
+
+
+class RequestTrace(object):
+
+    ''' Number and duration of the queries of one request, shared with
+        the threads of its L{omero_mapr.executor.QueryExecutor}
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, duration):
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+
+    def header(self):
+        return 'hql;dur=%.1f;desc="%d queries"' % (
+            self.duration * 1000, self.count)
+
+
+def _rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def _trace(name, method, q, params, service_opts):
+    start = time.perf_counter()
+    result = None
+    try:
+        result = method(q, params, service_opts)
+        return result
+    except Exception:
+        HQL_ERRORS.inc(name)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        trace = _request_trace.get()
+        if trace is not None:
+            trace.add(duration)
+        rows = _rows(result)
+        HQL_DURATION.observe(duration, name)
+        HQL_ROWS.inc(name, amount=rows)
+
+        ms = duration * 1000
+        slow = mapr_settings.SLOW_QUERY_MS
+        if slow and ms >= slow:
+            logger.warning(
+                "Slow HQL %s %s %s %.1fms rows=%d: %s PARAMS: %r",
+                name, method.__name__, fingerprint(q), ms, rows,
+                _Compact(q), params)
+        elif (logger.isEnabledFor(logging.DEBUG) and
+                random.random() < mapr_settings.TRACE_SAMPLE_RATE):
+            logger.debug(
+                "HQL %s %s %s %.1fms rows=%d: %s PARAMS: %r",
+                name, method.__name__, fingerprint(q), ms, rows,
+                _Compact(q), params)
+
+
+class TracedQueryService(object):
+
+    ''' Wraps the query service to time and log every query,
+        attributing them to name, e.g. the calling function
+    '''
+
+    def __init__(self, qs, name):
+        self._qs = qs
+        self.name = name
+
+    def projection(self, q, params, service_opts=None):
+        return _trace(self.name, self._qs.projection,
+                      q, params, service_opts)
+
+    def findAllByQuery(self, q, params, service_opts=None):
+        return _trace(self.name, self._qs.findAllByQuery,
+                      q, params, service_opts)
+
+    def findByQuery(self, q, params, service_opts=None):
+        return _trace(self.name, self._qs.findByQuery,
+                      q, params, service_opts)
+
+
+def get_query_service(conn, name=None):
+    ''' Returns the traced query service of the connection
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param name Name the queries are reported under, defaults to
+        the name of the calling function
+        @type name L{string}
+    '''
+
+    if name is None:
+        name = sys._getframe(1).f_code.co_name
+    shared = _shared_query_service.get()
+    if shared is not None and shared[0] is conn:
+        # not created concurrently by the threads of an executor
+        qs = shared[1]
+    else:
+        qs = conn.getQueryService()
+    return TracedQueryService(qs, name)
+
+
+def trace_view(func):
+    ''' View decorator recording the latency of the view and collecting
+        the totals of the queries it makes, added as a Server-Timing header
+        if omero.web.mapr.server_timing is enabled.
+    '''
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        trace = RequestTrace()
+        token = _request_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            rsp = func(request, *args, **kwargs)
+        finally:
+            _request_trace.reset(token)
+            REQUEST_DURATION.observe(time.perf_counter() - start,
+                                     func.__name__)
+        if mapr_settings.SERVER_TIMING and trace.count:
+            rsp['Server-Timing'] = trace.header()
+        return rsp
+    return wrapper
@@ -20,11 +20,13 @@
 #
 # Version: 1.0
 
+import base64
+import json
 import logging
 import omero
 import copy
 
-from omero.rtypes import rstring, rlist, unwrap, wrap
+from omero.rtypes import rstring, rlong, rlist, unwrap, wrap
 from django.conf import settings
 from copy import deepcopy
 from past.builtins import long
@@ -36,10 +38,22 @@ from omeroweb.webclient.tree import _marshal_plate
 from omeroweb.webclient.tree import _marshal_image
 from omeroweb.webclient.tree import _marshal_annotation, _marshal_exp_obj
 
+from .mapr_settings import mapr_settings
+from .permissions import PermissionsProjection
+from .thumbnails import get_thumbnail_versions
+from .tracing import get_query_service
+
 
 logger = logging.getLogger(__name__)
 
 
+# Number of images loaded per query while exporting
+EXPORT_CHUNK = 1000
+
+# Maximum number of values loaded by search_mapannotations
+SEARCH_ROWS = 10000
+
+
 def _escape_chars_like(query):
     escape_chars = {
         "%": r"\%",
@@ -51,10 +65,107 @@ def _escape_chars_like(query):
     return query
 
 
+def encode_cursor(key):
+    ''' Encodes the sort key of the last row of a page as an opaque cursor
+    '''
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(
+        json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    ''' Decodes a cursor created by encode_cursor. An empty cursor
+        requests the first page.
+
+        @raise ValueError if the cursor is invalid
+    '''
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor: %s" % cursor)
+
+
+def _set_cursor(params, sort_keys, cursor, limit):
+
+    ''' Helper to page with a keyset (cursor) instead of an offset
+
+        @param params Instance of ParametersI
+        @type params L{omero.sys.ParametersI}
+        @param sort_keys HQL expressions the query is ordered by,
+        with True for descending order
+        @type sort_keys L{list} of (L{string}, L{boolean}) tuples
+        @param cursor Sort key of the last row of the previous page
+        or an empty list for the first page
+        @type cursor L{list}
+        @param limit The limit of results per page to get
+        @type limit L{long}
+        @return The clause selecting rows after the cursor or None
+    '''
+
+    params.page(0, limit)
+    if not cursor:
+        return None
+    if not isinstance(cursor, list) or len(cursor) != len(sort_keys):
+        raise omero.ApiUsageException(None, None, "Invalid cursor")
+
+    clauses = []
+    for i, (expr, desc) in enumerate(sort_keys):
+        v = cursor[i]
+        if isinstance(v, bool) or not isinstance(v, (int, str)):
+            raise omero.ApiUsageException(None, None, "Invalid cursor")
+        params.add("cursor%d" % i, rstring(v) if isinstance(v, str)
+                   else rlong(v))
+        c = ["%s = :cursor%d" % (sort_keys[j][0], j) for j in range(i)]
+        c.append("%s %s :cursor%d" % (expr, '<' if desc else '>', i))
+        clauses.append("(%s)" % " and ".join(c))
+    return "(%s)" % " or ".join(clauses)
+
+
+# the value index is imported when used as it is built with _set_parameters
+def _resolve_variants(mapann_ns, mapann_names, mapann_value):
+    from .value_index import resolve_variants
+    return resolve_variants(mapann_ns, mapann_names, mapann_value)
+
+
+def _search_values(mapann_ns, mapann_names, mapann_value, case_sensitive):
+    from .value_index import search_values
+    return search_values(mapann_ns, mapann_names, mapann_value,
+                         case_sensitive=case_sensitive)
+
+
+def _casefold_clause(params, name, casefold, recent):
+
+    ''' Helper matching the values known to the case-fold table of the
+        value index or, for annotations updated since the table was last
+        refreshed, the clause recent
+
+        @param params Instance of ParametersI
+        @type params L{omero.sys.ParametersI}
+        @param name Name of the parameter holding the values
+        @type name L{string}
+        @param casefold (values, since) from the value index
+        @type casefold L{tuple}
+        @param recent HQL clause matching the value without the index
+        @type recent L{string}
+    '''
+
+    values, since = casefold
+    params.add('since', rlong(since))
+    recent = "(a.details.updateEvent.id > :since and %s)" % recent
+    if not values:
+        return recent
+    params.add(name, rlist([rstring(v) for v in values]))
+    return "(mv.value in (:%s) or %s)" % (name, recent)
+
+
 def _set_parameters(mapann_ns=[], mapann_names=[],
                     mapann_value=None, query=False, case_sensitive=True,
                     params=None, experimenter_id=-1,
-                    page=None, limit=settings.PAGE):
+                    page=None, limit=settings.PAGE, mapann_values=None):
 
     ''' Helper to map ParametersI
 
@@ -77,6 +188,9 @@ def _set_parameters(mapann_ns=[], mapann_names=[],
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param mapann_values The Map annotation values to filter by,
+        instead of mapann_value
+        @type mapann_values L{list}
     '''
 
     if params is None:
@@ -102,17 +216,44 @@ def _set_parameters(mapann_ns=[], mapann_names=[],
         params.addId(experimenter_id)
         where_clause.append("a.details.owner.id = :id")
 
-    if mapann_value:
+    if mapann_values:
+        if not case_sensitive:
+            mapann_values = [v.lower() for v in mapann_values]
+        _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        params.add('values', rlist([rstring(v) for v in mapann_values]))
+        where_clause.append("%s in (:values)" % _cwc)
+    elif mapann_value:
         mapann_value = mapann_value if case_sensitive else mapann_value.lower()
         _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+        candidates = None
+        if query:
+            candidates = _search_values(
+                mapann_ns, mapann_names, mapann_value, case_sensitive)
         if query:
             params.addString(
                 "query",
                 rstring("%%%s%%" % _escape_chars_like(mapann_value)))
-            where_clause.append("%s like :query" % _cwc)
+            if candidates is not None:
+                # the values containing mapann_value known to the value
+                # index, like only for annotations updated since
+                where_clause.append(_casefold_clause(
+                    params, 'candidates', candidates,
+                    "%s like :query" % _cwc))
+            else:
+                where_clause.append("%s like :query" % _cwc)
         else:
+            variants = None
+            if not case_sensitive:
+                variants = _resolve_variants(
+                    mapann_ns, mapann_names, mapann_value)
             params.addString('value', mapann_value)
-            where_clause.append("%s  = :value" % _cwc)
+            if variants is not None:
+                # match the spellings of the value instead of lower(),
+                # allowing the use of an index on the values
+                where_clause.append(_casefold_clause(
+                    params, 'variants', variants, "%s = :value" % _cwc))
+            else:
+                where_clause.append("%s  = :value" % _cwc)
     else:
         where_clause.append("mv.value != '' ")
 
@@ -191,7 +332,7 @@ def count_mapannotations(conn, mapann_value, query=False,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
 
     q = """
         select
@@ -208,16 +349,270 @@ def count_mapannotations(conn, mapann_value, query=False,
          )
         """ % (" and ".join(where_clause))
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
     counter = unwrap(qs.projection(q, params, service_opts))[0][0]
     return counter
 
 
+def _estimate_values(mapann_ns, mapann_names, group_ids):
+    from .value_index import estimate_values
+    return estimate_values(mapann_ns, mapann_names, group_ids=group_ids)
+
+
+def _readable_groups(conn, group_id):
+    ''' Returns the IDs of the groups whose values of all members the
+        current user reads, None for all groups, or False if the user
+        is not a member of any group or only reads some values of a group
+    '''
+
+    if group_id is None:
+        group_id = -1
+    ec = conn.getEventContext()
+    if ec.isAdmin:
+        return None if group_id == -1 else [group_id]
+    group_ids = []
+    for g in conn.getGroupsMemberOf():
+        if group_id != -1 and g.getId() != group_id:
+            continue
+        if not (g.getDetails().getPermissions().isGroupRead() or
+                g.getId() in ec.leaderOfGroups):
+            # members of a private group only read their own values
+            return False
+        group_ids.append(g.getId())
+    return group_ids or False
+
+
+def estimate_mapannotations(conn, mapann_value, query=False,
+                            case_sensitive=False,
+                            mapann_ns=[], mapann_names=[],
+                            group_id=-1, experimenter_id=-1):
+    ''' Estimates the number of distinct values counted by
+        L{count_mapannotations} from the HyperLogLog sketches of the
+        groups the user reads, kept by the value index. Values are
+        counted by L{count_mapannotations} when they are filtered or
+        the sketches do not cover the groups.
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param query Flag allowing to search for value patters.
+        @type query L{boolean}
+        @param mapann_ns The Map annotation namespace to filter by.
+        @type mapann_ns L{string}
+        @param mapann_names The Map annotation names to filter by.
+        @type mapann_names L{string}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+    '''
+
+    if not mapann_value and experimenter_id in (None, -1):
+        group_ids = _readable_groups(conn, group_id)
+        if group_ids is not False:
+            estimate = _estimate_values(mapann_ns, mapann_names, group_ids)
+            if estimate is not None:
+                return estimate
+
+    return count_mapannotations(
+        conn, mapann_value, query=query, case_sensitive=case_sensitive,
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        group_id=group_id, experimenter_id=experimenter_id)
+
+
+def count_mapannotations_batch(conn, mapann_values, case_sensitive=False,
+                               mapann_ns=[], mapann_names=[],
+                               group_id=-1, experimenter_id=-1):
+    ''' Count images, screens and projects of many mapannotation values
+        in a single query
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_values The Map annotation values to count.
+        @type mapann_values L{list}
+        @param mapann_ns The Map annotation namespace to filter by.
+        @type mapann_ns L{string}
+        @param mapann_names The Map annotation names to filter by.
+        @type mapann_names L{string}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+        @return Dictionary of counts per requested value
+    '''
+
+    counts = dict((v, {'images': 0, 'screens': 0, 'projects': 0})
+                  for v in mapann_values)
+    if not mapann_values:
+        return counts
+
+    params, where_clause = _set_parameters(
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        mapann_values=mapann_values,
+        case_sensitive=case_sensitive,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=None)
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = get_query_service(conn)
+
+    _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+    q = """
+        select %s,
+            count(distinct i.id),
+            count(distinct sl.parent.id),
+            count(distinct pdl.parent.id)
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            join ial.parent i
+            left outer join i.wellSamples ws
+                left outer join ws.well w
+                left outer join w.plate pl
+                left outer join pl.screenLinks sl
+            left outer join i.datasetLinks dil
+                left outer join dil.parent ds
+                left outer join ds.projectLinks pdl
+        where %s AND
+         (
+             (ws is not null)
+             OR
+             (dil is not null)
+         )
+        group by %s
+        """ % (_cwc, " and ".join(where_clause), _cwc)
+
+    found = {}
+    for e in unwrap(qs.projection(q, params, service_opts)):
+        found[e[0]] = {'images': e[1], 'screens': e[2], 'projects': e[3]}
+    for v in mapann_values:
+        c = found.get(v if case_sensitive else v.lower())
+        if c is not None:
+            counts[v] = c
+    return counts
+
+
+def group_search_rows(rows, menus, limit):
+    ''' Groups rows of (ns, key, value, image count) by the menus whose
+        namespaces and keys they match, see L{search_mapannotations}
+    '''
+
+    results = dict((menu, {'count': 0, 'values': []}) for menu in menus)
+    seen = dict((menu, set()) for menu in menus)
+    for ns, name, value, images in rows:
+        for menu, (mapann_ns, mapann_names) in menus.items():
+            if mapann_ns and ns not in mapann_ns:
+                continue
+            if mapann_names and name not in mapann_names:
+                continue
+            if value in seen[menu]:
+                continue
+            seen[menu].add(value)
+            results[menu]['count'] += 1
+            # rows are ordered by image count
+            if len(results[menu]['values']) < limit:
+                results[menu]['values'].append(
+                    {'value': value, 'key': name, 'images': images})
+    return results
+
+
+def search_mapannotations(conn, mapann_value, menus, query=False,
+                          case_sensitive=False,
+                          group_id=-1, experimenter_id=-1, limit=10):
+    ''' Searches a value in many menus at once, with a single query
+        grouping the matching values by namespace and key
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_value The Map annotation value to search for.
+        @type mapann_value L{string}
+        @param menus The namespaces and keys of each menu,
+        e.g. {'gene': (['openmicroscopy.org/mapr/gene'], ['Gene Symbol'])}
+        @type menus L{dict}
+        @param query Flag allowing to search for value patters.
+        @type query L{boolean}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+        @param limit The number of values returned per menu,
+        those annotating most images first
+        @type limit L{long}
+        @return Dictionary of the number of matching values and the top
+        values of each menu, and whether the values were truncated after
+        SEARCH_ROWS of them
+    '''
+
+    params, where_clause = _set_parameters(
+        mapann_value=mapann_value, query=query,
+        case_sensitive=case_sensitive,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=None)
+    params.page(0, SEARCH_ROWS + 1)
+
+    # values of any menu, unless a menu takes any namespace and key
+    scopes = []
+    for i, (mapann_ns, mapann_names) in enumerate(menus.values()):
+        scope = []
+        if mapann_ns:
+            params.add('ns%d' % i, rlist([rstring(n) for n in mapann_ns]))
+            scope.append("a.ns in (:ns%d)" % i)
+        if mapann_names:
+            params.add('filter%d' % i,
+                       rlist([rstring(n) for n in mapann_names]))
+            scope.append("mv.name in (:filter%d)" % i)
+        if not scope:
+            scopes = []
+            break
+        scopes.append("(%s)" % " and ".join(scope))
+    if scopes:
+        where_clause.append("(%s)" % " or ".join(scopes))
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = get_query_service(conn)
+
+    q = """
+        select a.ns, mv.name, mv.value, count(distinct i.id)
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            join ial.parent i
+            left outer join i.wellSamples ws
+            left outer join i.datasetLinks dil
+        where %s AND
+         (
+             (ws is not null)
+             OR
+             (dil is not null)
+         )
+        group by a.ns, mv.name, mv.value
+        order by count(distinct i.id) desc, mv.value
+        """ % (" and ".join(where_clause))
+
+    rows = unwrap(qs.projection(q, params, service_opts))
+    return {'menus': group_search_rows(rows[:SEARCH_ROWS], menus, limit),
+            'truncated': len(rows) > SEARCH_ROWS}
+
+
 def marshal_mapannotations(conn, mapann_value, query=False,
                            case_sensitive=False,
                            mapann_ns=[], mapann_names=[],
                            group_id=-1, experimenter_id=-1,
-                           page=1, limit=settings.PAGE):
+                           page=1, limit=settings.PAGE, cursor=None):
     ''' Marshals mapannotation values
 
         @param conn OMERO gateway.
@@ -242,6 +637,10 @@ def marshal_mapannotations(conn, mapann_value, query=False,
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param cursor Sort key of the last row of the previous page to
+        page with a keyset instead of page, [] for the first page.
+        (results, next cursor) is returned if given
+        @type cursor L{list}
     '''
 
     mapannotations = []
@@ -251,7 +650,15 @@ def marshal_mapannotations(conn, mapann_value, query=False,
         mapann_value=mapann_value, query=query,
         case_sensitive=case_sensitive,
         params=None, experimenter_id=experimenter_id,
-        page=page, limit=limit)
+        page=page if cursor is None else None, limit=limit)
+
+    having_clause = ""
+    if cursor is not None:
+        keyset = _set_cursor(
+            params, [("count(distinct i.id)", True), ("mv.value", False)],
+            cursor, limit)
+        if keyset is not None:
+            having_clause = "having %s" % keyset
 
     service_opts = deepcopy(conn.SERVICE_OPTS)
 
@@ -260,7 +667,7 @@ def marshal_mapannotations(conn, mapann_value, query=False,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
 
     q = """
         select
@@ -291,32 +698,69 @@ def marshal_mapannotations(conn, mapann_value, query=False,
                  and ds is not null and pdl is not null)
          )
         group by mv.value
-        order by count(distinct i.id) DESC
-        """ % (" and ".join(where_clause))
+        %s
+        order by count(distinct i.id) DESC, mv.value
+        """ % (" and ".join(where_clause), having_clause)
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+    rows = 0
+    next_cursor = None
     for e in qs.projection(q, params, service_opts):
         e = unwrap(e)
+        rows += 1
+        next_cursor = [e[1], e[0]]
         if e[1] > 0:
-            c = e[1]
-            e = [e[0],
-                 "%s (%d)" % (e[0], e[1]),
-                 None,
-                 experimenter_id,  # e[0]["ownerId"],
-                 {},  # e[0]["map_details_permissions"],
-                 None,  # e[0]["ns"],
-                 e[2]+e[3]]
-            mt = _marshal_map(conn, e[0:7])
-            mt.update({'extra': {'counter': c}})
-            mapannotations.append(mt)
+            mapannotations.append(_marshal_value(
+                conn, e[0], e[1], e[2]+e[3], experimenter_id))
 
+    if cursor is not None:
+        return mapannotations, next_cursor if rows == limit else None
+    return mapannotations
+
+
+def _marshal_value(conn, value, image_count, child_count, experimenter_id):
+    e = [value,
+         "%s (%d)" % (value, image_count),
+         None,
+         experimenter_id,  # e[0]["ownerId"],
+         {},  # e[0]["map_details_permissions"],
+         None,  # e[0]["ns"],
+         child_count]
+    mt = _marshal_map(conn, e)
+    mt.update({'extra': {'counter': image_count}})
+    return mt
+
+
+def marshal_top_values(conn, rows, experimenter_id=-1, limit=None):
+    ''' Marshals mapannotation values listed from the leaderboard of the
+        value index like L{marshal_mapannotations}
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param rows (value, image count, child count) rows
+        @type rows L{list}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+        @param limit The limit of results per page, (results, next cursor)
+        is returned if given
+        @type limit L{long}
+    '''
+
+    mapannotations = [
+        _marshal_value(conn, value, image_count, child_count, experimenter_id)
+        for value, image_count, child_count in rows]
+    if limit is not None:
+        next_cursor = None
+        if rows and len(rows) == limit:
+            next_cursor = [rows[-1][1], rows[-1][0]]
+        return mapannotations, next_cursor
     return mapannotations
 
 
 def marshal_screens(conn, mapann_value, query=False,
                     mapann_ns=[], mapann_names=[],
                     group_id=-1, experimenter_id=-1,
-                    page=1, limit=settings.PAGE):
+                    page=1, limit=settings.PAGE, cursor=None):
 
     ''' Marshals screens
 
@@ -342,6 +786,10 @@ def marshal_screens(conn, mapann_value, query=False,
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param cursor Sort key of the last row of the previous page to
+        page with a keyset instead of page, [] for the first page.
+        (results, next cursor) is returned if given
+        @type cursor L{list}
     '''
 
     screens = []
@@ -350,7 +798,15 @@ def marshal_screens(conn, mapann_value, query=False,
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=query, mapann_value=mapann_value,
         params=None, experimenter_id=experimenter_id,
-        page=page, limit=limit)
+        page=page if cursor is None else None, limit=limit)
+
+    if cursor is not None:
+        keyset = _set_cursor(
+            params, [("lower(screen.name)", False), ("screen.id", False),
+                     ("mv.value", False)],
+            cursor, limit)
+        if keyset is not None:
+            where_clause.append(keyset)
 
     service_opts = deepcopy(conn.SERVICE_OPTS)
 
@@ -366,13 +822,15 @@ def marshal_screens(conn, mapann_value, query=False,
     # - from ImageAnnotationLink ial join ial.child a join a.mapValue mv
     # -     join ial.parent i join i.wellSamples ws join ws.well w
     # -     join w.plate pl join pl.screenLinks sl join sl.parent screen
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
+    perms = PermissionsProjection(conn)
     q = """
         select new map(mv.value as value,
             screen.id as id,
             screen.name as name,
+            lower(screen.name) as sortName,
             screen.details.owner.id as ownerId,
-            screen as screen_details_permissions,
+            %s,
             count(distinct pl.id) as childCount,
             count(distinct ws.id) as imgCount)
         from WellAnnotationLink wal join wal.child a join a.mapValue mv
@@ -381,18 +839,19 @@ def marshal_screens(conn, mapann_value, query=False,
             join sl.parent screen
         where %s
         group by screen.id, screen.name, mv.value
-        order by lower(screen.name), screen.id
-        """ % (" and ".join(where_clause))
+        order by lower(screen.name), screen.id, mv.value
+        """ % (perms.select("screen"), " and ".join(where_clause))
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+    next_cursor = None
     for e in qs.projection(q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
+        next_cursor = [e[0]['sortName'], e[0]['id'], v]
         c = e[0]['imgCount']
         e = [e[0]['id'],
              "%s (%d)" % (e[0]['name'], c),
              e[0]['ownerId'],
-             e[0]['screen_details_permissions'],
+             perms.get(e[0], 'screen', e[0]['ownerId']),
              e[0]['childCount']]
         ms = _marshal_screen(conn, e[0:5])
         extra = {'extra': {'counter': c}}
@@ -401,13 +860,15 @@ def marshal_screens(conn, mapann_value, query=False,
             ms.update(extra)
         screens.append(ms)
 
+    if cursor is not None:
+        return screens, next_cursor if len(screens) == limit else None
     return screens
 
 
 def marshal_projects(conn, mapann_value, query=False,
                      mapann_ns=[], mapann_names=[],
                      group_id=-1, experimenter_id=-1,
-                     page=1, limit=settings.PAGE):
+                     page=1, limit=settings.PAGE, cursor=None):
 
     ''' Marshals projects
 
@@ -433,6 +894,10 @@ def marshal_projects(conn, mapann_value, query=False,
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param cursor Sort key of the last row of the previous page to
+        page with a keyset instead of page, [] for the first page.
+        (results, next cursor) is returned if given
+        @type cursor L{list}
     '''
 
     projects = []
@@ -441,7 +906,15 @@ def marshal_projects(conn, mapann_value, query=False,
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=query, mapann_value=mapann_value,
         params=None, experimenter_id=experimenter_id,
-        page=page, limit=limit)
+        page=page if cursor is None else None, limit=limit)
+
+    if cursor is not None:
+        keyset = _set_cursor(
+            params, [("lower(project.name)", False), ("project.id", False),
+                     ("mv.value", False)],
+            cursor, limit)
+        if keyset is not None:
+            where_clause.append(keyset)
 
     service_opts = deepcopy(conn.SERVICE_OPTS)
 
@@ -450,13 +923,15 @@ def marshal_projects(conn, mapann_value, query=False,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
+    perms = PermissionsProjection(conn)
     q = """
         select new map(mv.value as value,
             project.id as id,
             project.name as name,
+            lower(project.name) as sortName,
             project.details.owner.id as ownerId,
-            project as project_details_permissions,
+            %s,
             count(distinct dataset.id) as childCount,
             count(distinct i.id) as imgCount)
         from ImageAnnotationLink ial join ial.child a join a.mapValue mv
@@ -465,18 +940,19 @@ def marshal_projects(conn, mapann_value, query=False,
             join pl.parent project
         where %s
         group by project.id, project.name, mv.value
-        order by lower(project.name), project.id
-        """ % (" and ".join(where_clause))
+        order by lower(project.name), project.id, mv.value
+        """ % (perms.select("project"), " and ".join(where_clause))
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+    next_cursor = None
     for e in qs.projection(q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
+        next_cursor = [e[0]['sortName'], e[0]['id'], v]
         c = e[0]['imgCount']
         e = [e[0]['id'],
              "%s (%d)" % (e[0]["name"], c),
              e[0]['ownerId'],
-             e[0]['project_details_permissions'],
+             perms.get(e[0], 'project', e[0]['ownerId']),
              e[0]['childCount']]
         ms = _marshal_screen(conn, e[0:5])
         extra = {'extra': {'counter': c}}
@@ -485,6 +961,8 @@ def marshal_projects(conn, mapann_value, query=False,
             ms.update(extra)
         projects.append(ms)
 
+    if cursor is not None:
+        return projects, next_cursor if len(projects) == limit else None
     return projects
 
 
@@ -492,7 +970,7 @@ def marshal_datasets(conn, project_id,
                      mapann_value, query=False,
                      mapann_ns=[], mapann_names=[],
                      group_id=-1, experimenter_id=-1,
-                     page=1, limit=settings.PAGE):
+                     page=1, limit=settings.PAGE, cursor=None):
 
     ''' Marshals plates
 
@@ -520,18 +998,30 @@ def marshal_datasets(conn, project_id,
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param cursor Sort key of the last row of the previous page to
+        page with a keyset instead of page, [] for the first page.
+        (results, next cursor) is returned if given
+        @type cursor L{list}
     '''
     datasets = []
 
     # early exit
     if project_id is None or not isinstance(project_id, long):
-        return datasets
+        return (datasets, None) if cursor is not None else datasets
 
     params, where_clause = _set_parameters(
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=query, mapann_value=mapann_value,
         params=None, experimenter_id=experimenter_id,
-        page=page, limit=limit)
+        page=page if cursor is None else None, limit=limit)
+
+    if cursor is not None:
+        keyset = _set_cursor(
+            params, [("lower(dataset.name)", False), ("dataset.id", False),
+                     ("mv.value", False)],
+            cursor, limit)
+        if keyset is not None:
+            where_clause.append(keyset)
 
     params.addLong("pid", project_id)
     where_clause.append('project.id = :pid')
@@ -543,13 +1033,15 @@ def marshal_datasets(conn, project_id,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
+    perms = PermissionsProjection(conn)
     q = """
         select new map(mv.value as value,
             dataset.id as id,
             dataset.name as name,
+            lower(dataset.name) as sortName,
             dataset.details.owner.id as ownerId,
-            dataset as dataset_details_permissions,
+            %s,
             count(distinct i.id) as childCount)
         from ImageAnnotationLink ial join ial.child a join a.mapValue mv
             join ial.parent i join i.datasetLinks dil
@@ -558,16 +1050,17 @@ def marshal_datasets(conn, project_id,
         where %s
         group by dataset.id, dataset.name, mv.value
         order by lower(dataset.name), dataset.id, mv.value
-        """ % (" and ".join(where_clause))
+        """ % (perms.select("dataset"), " and ".join(where_clause))
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+    next_cursor = None
     for e in qs.projection(q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
+        next_cursor = [e[0]['sortName'], e[0]['id'], v]
         e = [e[0]['id'],
              e[0]['name'],
              e[0]['ownerId'],
-             e[0]['dataset_details_permissions'],
+             perms.get(e[0], 'dataset', e[0]['ownerId']),
              e[0]['childCount']]
         mp = _marshal_plate(conn, e[0:5])
         extra = {'extra': {'node': 'dataset'}}
@@ -576,6 +1069,8 @@ def marshal_datasets(conn, project_id,
         mp.update(extra)
         datasets.append(mp)
 
+    if cursor is not None:
+        return datasets, next_cursor if len(datasets) == limit else None
     return datasets
 
 
@@ -583,7 +1078,7 @@ def marshal_plates(conn, screen_id,
                    mapann_value, query=False,
                    mapann_ns=[], mapann_names=[],
                    group_id=-1, experimenter_id=-1,
-                   page=1, limit=settings.PAGE):
+                   page=1, limit=settings.PAGE, cursor=None):
 
     ''' Marshals plates
 
@@ -611,19 +1106,31 @@ def marshal_plates(conn, screen_id,
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param cursor Sort key of the last row of the previous page to
+        page with a keyset instead of page, [] for the first page.
+        (results, next cursor) is returned if given
+        @type cursor L{list}
     '''
 
     plates = []
 
     # early exit
     if screen_id is None or not isinstance(screen_id, long):
-        return plates
+        return (plates, None) if cursor is not None else plates
 
     params, where_clause = _set_parameters(
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=query, mapann_value=mapann_value,
         params=None, experimenter_id=experimenter_id,
-        page=page, limit=limit)
+        page=page if cursor is None else None, limit=limit)
+
+    if cursor is not None:
+        keyset = _set_cursor(
+            params, [("lower(plate.name)", False), ("plate.id", False),
+                     ("mv.value", False)],
+            cursor, limit)
+        if keyset is not None:
+            where_clause.append(keyset)
 
     params.addLong("sid", screen_id)
     where_clause.append('screen.id = :sid')
@@ -635,7 +1142,7 @@ def marshal_plates(conn, screen_id,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
 
     # TODO: Joining wellsample should be enough since wells are annotated
     # with the same annotations as images. In the future if that changes,
@@ -644,12 +1151,14 @@ def marshal_plates(conn, screen_id,
     # - from ImageAnnotationLink ial join ial.child a join a.mapValue mv
     # -     join ial.parent i join i.wellSamples ws join ws.well w
     # -     join w.plate plate join plate.screenLinks sl join sl.parent screen
+    perms = PermissionsProjection(conn)
     q = """
         select new map(mv.value as value,
             plate.id as id,
             plate.name as name,
+            lower(plate.name) as sortName,
             plate.details.owner.id as ownerId,
-            plate as plate_details_permissions,
+            %s,
             count(distinct ws.id) as childCount)
         from WellAnnotationLink wal join wal.child a join a.mapValue mv
             join wal.parent w join w.wellSamples ws
@@ -658,16 +1167,17 @@ def marshal_plates(conn, screen_id,
         where %s
         group by plate.id, plate.name, mv.value
         order by lower(plate.name), plate.id, mv.value
-        """ % (" and ".join(where_clause))
+        """ % (perms.select("plate"), " and ".join(where_clause))
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
+    next_cursor = None
     for e in qs.projection(q, params, service_opts):
         e = unwrap(e)
         v = e[0]['value']
+        next_cursor = [e[0]['sortName'], e[0]['id'], v]
         e = [e[0]['id'],
              e[0]['name'],
              e[0]['ownerId'],
-             e[0]['plate_details_permissions'],
+             perms.get(e[0], 'plate', e[0]['ownerId']),
              e[0]['childCount']]
         mp = _marshal_plate(conn, e[0:5])
         extra = {'extra': {'node': 'plate'}}
@@ -676,16 +1186,314 @@ def marshal_plates(conn, screen_id,
         mp.update(extra)
         plates.append(mp)
 
+    if cursor is not None:
+        return plates, next_cursor if len(plates) == limit else None
     return plates
 
 
+def _project_per_parent(qs, query, params, ids, parent_ids, sort_keys,
+                        service_opts, page=1, limit=settings.PAGE):
+
+    ''' Helper loading the rows of a query over many parents, ordered by
+        parent id first, and keeping a page of the rows of each parent.
+        At most page * limit rows per parent are loaded by each query,
+        further queries continue after the last row loaded for the
+        parents which are not complete yet.
+
+        @param query Returns the query given the clauses to add to its
+        where clause
+        @type query L{function}
+        @param params Instance of ParametersI
+        @type params L{omero.sys.ParametersI}
+        @param ids Name of the parameter holding the parent IDs
+        @type ids L{string}
+        @param sort_keys (HQL expression, row key) pairs the query is
+        ordered by, the parent id first
+        @type sort_keys L{list}
+        @param page Page number of the rows of each parent. `None` or 0
+        to load all rows with one query
+        @type page L{long}
+        @param limit The limit of rows per parent and page
+        @type limit L{long}
+        @return Generator of the unwrapped rows kept
+    '''
+
+    offset = (page - 1) * limit if page else 0
+    seen = {}
+    remaining = list(parent_ids)
+    cursor = []
+    while remaining:
+        params.add(ids, rlist([rlong(i) for i in remaining]))
+        keyset = None
+        if page:
+            maximum = len(remaining) * (offset + limit)
+            keyset = _set_cursor(
+                params, [(expr, False) for expr, key in sort_keys],
+                cursor, maximum)
+        rows = qs.projection(
+            query([keyset] if keyset else []), params, service_opts)
+        for e in rows:
+            e = unwrap(e)[0]
+            parent_id = e['parentId']
+            cursor = [e[key] for expr, key in sort_keys]
+            n = seen[parent_id] = seen.get(parent_id, 0) + 1
+            if n <= offset or (page and n > offset + limit):
+                continue
+            yield e
+        if not page or len(rows) < maximum:
+            break
+        # the rows of the parents before the last one are all loaded
+        remaining = [i for i in remaining if i >= cursor[0] and
+                     seen.get(i, 0) < offset + limit]
+
+
+CHILDREN_QUERIES = {
+    'screen': """
+        select new map(mv.value as value,
+            screen.id as parentId,
+            plate.id as id,
+            plate.name as name,
+            lower(plate.name) as sortName,
+            plate.details.owner.id as ownerId,
+            %s,
+            count(distinct ws.id) as childCount)
+        from WellAnnotationLink wal join wal.child a join a.mapValue mv
+            join wal.parent w join w.wellSamples ws
+            join w.plate plate join plate.screenLinks sl
+            join sl.parent screen
+        where %s
+        group by screen.id, plate.id, plate.name, mv.value
+        order by screen.id, lower(plate.name), plate.id, mv.value
+        """,
+    'project': """
+        select new map(mv.value as value,
+            project.id as parentId,
+            dataset.id as id,
+            dataset.name as name,
+            lower(dataset.name) as sortName,
+            dataset.details.owner.id as ownerId,
+            %s,
+            count(distinct i.id) as childCount)
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            join ial.parent i join i.datasetLinks dil
+            join dil.parent dataset join dataset.projectLinks pl
+            join pl.parent project
+        where %s
+        group by project.id, dataset.id, dataset.name, mv.value
+        order by project.id, lower(dataset.name), dataset.id, mv.value
+        """,
+}
+
+
+def _marshal_children_batch(conn, parent, parent_ids,
+                            mapann_value, query=False,
+                            mapann_ns=[], mapann_names=[],
+                            group_id=-1, experimenter_id=-1,
+                            page=1, limit=settings.PAGE):
+    node, ids = {'screen': ('plate', 'sids'),
+                 'project': ('dataset', 'pids')}[parent]
+    children = dict((parent_id, []) for parent_id in parent_ids)
+
+    # early exit
+    if not parent_ids:
+        return children
+
+    # paged per parent below
+    params, where_clause = _set_parameters(
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        query=query, mapann_value=mapann_value,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=limit)
+    where_clause.append('%s.id in (:%s)' % (parent, ids))
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = get_query_service(conn, "marshal_%ss_batch" % node)
+    perms = PermissionsProjection(conn)
+
+    def children_query(keyset):
+        return CHILDREN_QUERIES[parent] % (
+            perms.select(node), " and ".join(where_clause + keyset))
+
+    sort_keys = [("%s.id" % parent, 'parentId'),
+                 ("lower(%s.name)" % node, 'sortName'),
+                 ("%s.id" % node, 'id'),
+                 ("mv.value", 'value')]
+    for e in _project_per_parent(qs, children_query, params, ids,
+                                 parent_ids, sort_keys, service_opts,
+                                 page=page, limit=limit):
+        v = e['value']
+        mc = _marshal_plate(conn, [e['id'],
+                                   e['name'],
+                                   e['ownerId'],
+                                   perms.get(e, node, e['ownerId']),
+                                   e['childCount']])
+        extra = {'extra': {'node': node}}
+        if mapann_value is not None:
+            extra['extra']['value'] = v
+        mc.update(extra)
+        children[e['parentId']].append(mc)
+    return children
+
+
+def marshal_plates_batch(conn, screen_ids,
+                         mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         group_id=-1, experimenter_id=-1,
+                         page=1, limit=settings.PAGE):
+
+    ''' Marshals the plates of many screens with one query
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param screen_ids The Screen IDs to filter by.
+        @type screen_ids L{list}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param page Page number of the plates of each screen. `None` or 0
+        for no paging, defaults to 1
+        @type page L{long}
+        @param limit The limit of plates per screen and page
+        defaults to the value set in settings.PAGE
+        @type page L{long}
+
+        See L{marshal_plates} for the other parameters.
+        Returns the lists of plates by screen id.
+    '''
+
+    return _marshal_children_batch(
+        conn, 'screen', screen_ids, mapann_value, query=query,
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        group_id=group_id, experimenter_id=experimenter_id,
+        page=page, limit=limit)
+
+
+def marshal_datasets_batch(conn, project_ids,
+                           mapann_value, query=False,
+                           mapann_ns=[], mapann_names=[],
+                           group_id=-1, experimenter_id=-1,
+                           page=1, limit=settings.PAGE):
+
+    ''' Marshals the datasets of many projects with one query
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param project_ids The Project IDs to filter by.
+        @type project_ids L{list}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param page Page number of the datasets of each project. `None` or 0
+        for no paging, defaults to 1
+        @type page L{long}
+        @param limit The limit of datasets per project and page
+        defaults to the value set in settings.PAGE
+        @type page L{long}
+
+        See L{marshal_datasets} for the other parameters.
+        Returns the lists of datasets by project id.
+    '''
+
+    return _marshal_children_batch(
+        conn, 'project', project_ids, mapann_value, query=query,
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        group_id=group_id, experimenter_id=experimenter_id,
+        page=page, limit=limit)
+
+
+def _images_query(perms, load_pixels, date, parent=None):
+    extra_values = []
+    if parent is not None:
+        extra_values.append(", %s.id as parentId" % parent)
+    if load_pixels:
+        extra_values.append("""
+            ,
+            pix.sizeX as sizeX,
+            pix.sizeY as sizeY,
+            pix.sizeZ as sizeZ,
+            pix.sizeT as sizeT
+        """)
+
+    if date:
+        extra_values.append(""",
+            image.details.creationEvent.time as date,
+            image.acquisitionDate as acqDate
+        """)
+
+    q = """
+        select new map(image.id as id,
+            image.name as name,
+            lower(image.name) as sortName,
+            image.details.owner.id as ownerId,
+            %s,
+            image.fileset.id as filesetId %s)
+        from Image image
+        """ % (perms.select("image"), "".join(extra_values))
+
+    if load_pixels:
+        # We use 'left outer join', since we still want images if no pixels
+        q += ' left outer join image.pixels pix '
+    return q
+
+
+def _marshal_image_row(conn, perms, e, load_pixels, date):
+    d = [e["id"],
+         e["name"],
+         e["ownerId"],
+         perms.get(e, 'image', e["ownerId"]),
+         e["filesetId"]]
+    kwargs = {'conn': conn, 'row': d[0:5]}
+    if load_pixels:
+        d = [e["sizeX"], e["sizeY"], e["sizeZ"], e["sizeT"]]
+        kwargs['row_pixels'] = d
+    if date:
+        kwargs['acqDate'] = e['acqDate']
+        kwargs['date'] = e['date']
+    return _marshal_image(**kwargs)
+
+
+def _load_thumb_versions(conn, image_ids, service_opts):
+    # We want version of most recent thumbnail (max thumbId) owned by user
+    if not image_ids:
+        return {}
+    if mapr_settings.THUMBNAIL_CACHE_TTL:
+        thumb_versions = get_thumbnail_versions(conn, image_ids)
+        # None if the cache is unavailable
+        if thumb_versions is not None:
+            return thumb_versions
+
+    thumb_qs = get_query_service(conn, "marshal_images.thumb_version")
+    params = omero.sys.ParametersI()
+    params.addIds(image_ids)
+    params.add('thumbOwner', wrap(conn.getUserId()))
+    q = """select image.id, thumbs.version from Image image
+        join image.pixels pix join pix.thumbnails thumbs
+        where image.id in (:ids)
+        and thumbs.id = (
+            select max(t.id)
+            from Thumbnail t
+            where t.pixels = pix.id
+            and t.details.owner.id = :thumbOwner
+        )
+        """
+    thumb_versions = {}
+    for t in thumb_qs.projection(q, params, service_opts):
+        iid, tv = unwrap(t)
+        thumb_versions[iid] = tv
+    return thumb_versions
+
+
 def marshal_images(conn, parent, parent_id,
                    mapann_value, query=False,
                    mapann_ns=[], mapann_names=[],
                    load_pixels=False,
                    group_id=-1, experimenter_id=-1,
                    page=1, date=False, thumb_version=False,
-                   limit=settings.PAGE):
+                   limit=settings.PAGE, executor=None, cursor=None):
 
     ''' Marshals images
 
@@ -715,18 +1523,25 @@ def marshal_images(conn, parent, parent_id,
         @param limit The limit of results per page to get
         defaults to the value set in settings.PAGE
         @type page L{long}
+        @param executor Runs the thumbnail version query concurrently
+        with the image query if given
+        @type executor L{omero_mapr.executor.QueryExecutor}
+        @param cursor Sort key of the last row of the previous page to
+        page with a keyset instead of page, [] for the first page.
+        (results, next cursor) is returned if given
+        @type cursor L{list}
     '''
     images = []
 
     # early exit
     if (parent_id is None or not isinstance(parent_id, long)) or not parent:
-        return images
+        return (images, None) if cursor is not None else images
 
     params, where_clause = _set_parameters(
         mapann_ns=mapann_ns, mapann_names=mapann_names,
         query=query, mapann_value=mapann_value,
         params=None, experimenter_id=experimenter_id,
-        page=page, limit=limit)
+        page=page if cursor is None else None, limit=limit)
 
     service_opts = deepcopy(conn.SERVICE_OPTS)
 
@@ -737,40 +1552,11 @@ def marshal_images(conn, parent, parent_id,
 
     from_join_clauses = []
 
-    qs = conn.getQueryService()
-
-    extra_values = []
-    if load_pixels:
-        extra_values.append("""
-            ,
-            pix.sizeX as sizeX,
-            pix.sizeY as sizeY,
-            pix.sizeZ as sizeZ,
-            pix.sizeT as sizeT
-        """)
-
-    if date:
-        extra_values.append(""",
-            image.details.creationEvent.time as date,
-            image.acquisitionDate as acqDate
-        """)
-
-    q = """
-        select new map(image.id as id,
-            image.name as name,
-            image.details.owner.id as ownerId,
-            image as image_details_permissions,
-            image.fileset.id as filesetId %s)
-        from Image image
-        """ % "".join(extra_values)
+    qs = get_query_service(conn)
+    thumb_qs = get_query_service(conn, "marshal_images.thumb_version")
+    perms = PermissionsProjection(conn)
 
-    if load_pixels:
-        # We use 'left outer join', since we still want images if no pixels
-        q += ' left outer join image.pixels pix '
-
-    q += """
-        where image.id in (
-        """
+    q = _images_query(perms, load_pixels, date)
 
     if parent == 'plate':
         from_join_clauses.append("""
@@ -794,62 +1580,295 @@ def marshal_images(conn, parent, parent_id,
         params.addLong("did", parent_id)
         where_clause.append('dataset.id = :did')
 
-    q += """
-        %s %s
-        order by lower(image.name))
+    subquery = """
+        where image.id in (
+            %s %s)
         """ % (' select image.id from ' + ' '.join(from_join_clauses),
                build_clause(where_clause, 'where', 'and'))
-
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-    for e in qs.projection(q, params, service_opts):
-        e = unwrap(e)[0]
-        d = [e["id"],
-             e["name"],
-             e["ownerId"],
-             e["image_details_permissions"],
-             e["filesetId"]]
-        kwargs = {'conn': conn, 'row': d[0:5]}
-        if load_pixels:
-            d = [e["sizeX"], e["sizeY"], e["sizeZ"], e["sizeT"]]
-            kwargs['row_pixels'] = d
-        if date:
-            kwargs['acqDate'] = e['acqDate']
-            kwargs['date'] = e['date']
-
-        im = _marshal_image(**kwargs)
-        images.append(im)
-
-    # Load thumbnails separately
-    # We want version of most recent thumbnail (max thumbId) owned by user
-    if thumb_version and len(images) > 0:
-        user_id = conn.getUserId()
-        iids = [i['id'] for i in images]
-        params = omero.sys.ParametersI()
-        params.addIds(iids)
-        params.add('thumbOwner', wrap(user_id))
-        q = """select image.id, thumbs.version from Image image
-            join image.pixels pix join pix.thumbnails thumbs
-            where image.id in (:ids)
-            and thumbs.id = (
+    order_by = " order by lower(image.name), image.id "
+    if cursor is not None:
+        keyset = _set_cursor(
+            params, [("lower(image.name)", False), ("image.id", False)],
+            cursor, limit)
+        if keyset is not None:
+            subquery += " and %s " % keyset
+
+    # Load thumbnails alongside the images, using the same page and order,
+    # unless their versions are cached
+    thumb_versions = None
+    cache_thumbs = thumb_version and mapr_settings.THUMBNAIL_CACHE_TTL
+    if thumb_version and executor is not None and not cache_thumbs:
+        thumb_params = deepcopy(params)
+        thumb_params.add('thumbOwner', wrap(conn.getUserId()))
+        thumb_q = """
+            select image.id, thumbs.version from Image image
+                left outer join image.pixels pix
+                left outer join pix.thumbnails thumbs
+                    with thumbs.details.owner.id = :thumbOwner
+            %s
+            and (thumbs.id is null or thumbs.id = (
                 select max(t.id)
                 from Thumbnail t
                 where t.pixels = pix.id
                 and t.details.owner.id = :thumbOwner
-            )
-            """
-        thumb_versions = {}
-        logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
-        for t in qs.projection(q, params, service_opts):
-            iid, tv = unwrap(t)
-            thumb_versions[iid] = tv
+            ))
+            %s
+            """ % (subquery, order_by)
+        thumb_versions = executor.submit(
+            thumb_qs.projection, thumb_q, thumb_params, service_opts)
+
+    q += subquery + order_by
+
+    next_cursor = None
+    for e in qs.projection(q, params, service_opts):
+        e = unwrap(e)[0]
+        next_cursor = [e['sortName'], e['id']]
+        images.append(_marshal_image_row(conn, perms, e, load_pixels, date))
+
+    if thumb_versions is not None:
+        thumb_versions = dict(
+            (iid, tv) for iid, tv in unwrap(thumb_versions.result())
+            if tv is not None)
+    elif thumb_version:
+        thumb_versions = _load_thumb_versions(
+            conn, [i['id'] for i in images], service_opts)
+
+    if thumb_versions:
         # For all images, set thumb version if we have it...
         for i in images:
             if i['id'] in thumb_versions:
                 i['thumbVersion'] = thumb_versions[i['id']]
 
+    if cursor is not None:
+        return images, next_cursor if len(images) == limit else None
+    return images
+
+
+IMAGE_PARENT_JOINS = {
+    'plate': ("""
+        join image.wellSamples ws join ws.well well join well.plate plate
+        """, """
+        join i.wellSamples pws join pws.well pw
+        where pw.plate.id in (:pids)
+        """),
+    'dataset': ("""
+        join image.datasetLinks dil join dil.parent dataset
+        """, """
+        join i.datasetLinks pdil
+        where pdil.parent.id in (:pids)
+        """),
+}
+
+
+def marshal_images_batch(conn, parent, parent_ids,
+                         mapann_value, query=False,
+                         mapann_ns=[], mapann_names=[],
+                         load_pixels=False,
+                         group_id=-1, experimenter_id=-1,
+                         page=1, date=False, thumb_version=False,
+                         limit=settings.PAGE):
+
+    ''' Marshals the images of many plates or datasets with one query,
+        and their thumbnail versions with another one
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param parent 'plate' or 'dataset'
+        @type parent L{string}
+        @param parent_ids The Plate or Dataset IDs to filter by.
+        @type parent_ids L{list}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param page Page number of the images of each parent. `None` or 0
+        for no paging, defaults to 1
+        @type page L{long}
+        @param limit The limit of images per parent and page
+        defaults to the value set in settings.PAGE
+        @type page L{long}
+
+        See L{marshal_images} for the other parameters.
+        Returns the lists of images by parent id.
+    '''
+
+    images = dict((parent_id, []) for parent_id in parent_ids)
+
+    # early exit
+    if not parent_ids or parent not in IMAGE_PARENT_JOINS:
+        return images
+
+    # paged per parent below
+    params, where_clause = _set_parameters(
+        mapann_ns=mapann_ns, mapann_names=mapann_names,
+        query=query, mapann_value=mapann_value,
+        params=None, experimenter_id=experimenter_id,
+        page=None, limit=limit)
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = get_query_service(conn)
+    perms = PermissionsProjection(conn)
+
+    joins, parent_clause = IMAGE_PARENT_JOINS[parent]
+
+    def images_query(keyset):
+        q = _images_query(perms, load_pixels, date, parent=parent)
+        q += """
+            %s
+            where %s.id in (:pids)
+            and image.id in (
+                select i.id from ImageAnnotationLink ial
+                    join ial.child a join a.mapValue mv join ial.parent i
+                %s
+                and %s)
+            %s
+            order by %s.id, lower(image.name), image.id
+            """ % (joins, parent, parent_clause, " and ".join(where_clause),
+                   "".join("and %s" % k for k in keyset), parent)
+        return q
+
+    sort_keys = [("%s.id" % parent, 'parentId'),
+                 ("lower(image.name)", 'sortName'),
+                 ("image.id", 'id')]
+    listed = []
+    for e in _project_per_parent(qs, images_query, params, 'pids',
+                                 parent_ids, sort_keys, service_opts,
+                                 page=page, limit=limit):
+        im = _marshal_image_row(conn, perms, e, load_pixels, date)
+        images[e['parentId']].append(im)
+        listed.append(im)
+
+    if thumb_version:
+        # one lookup for the images of all parents
+        thumb_versions = _load_thumb_versions(
+            conn, list(set(i['id'] for i in listed)), service_opts)
+        for i in listed:
+            if i['id'] in thumb_versions:
+                i['thumbVersion'] = thumb_versions[i['id']]
+
     return images
 
 
+def _marshal_export_row(row):
+    image_id, name, fileset_id, plate_id, plate_name, screen_id, \
+        screen_name, dataset_id, dataset_name, project_id, project_name = row
+
+    image = {'id': image_id, 'name': name, 'filesetId': fileset_id}
+    for key, obj_id, obj_name in (('plate', plate_id, plate_name),
+                                  ('screen', screen_id, screen_name),
+                                  ('dataset', dataset_id, dataset_name),
+                                  ('project', project_id, project_name)):
+        if obj_id is not None:
+            image[key] = {'id': obj_id, 'name': obj_name}
+    return image
+
+
+def export_images(conn, mapann_value, query=False,
+                  mapann_ns=[], mapann_names=[],
+                  group_id=-1, experimenter_id=-1,
+                  chunk=EXPORT_CHUNK):
+    ''' Generates every image annotated with the value across all screens
+        and projects, as chunks (lists) of dictionaries holding
+        the image id, name and fileset id with its plate and screen or
+        dataset and project. An image in several containers is
+        listed once per container.
+
+        Images are paged by id so memory stays flat however many match.
+
+        @param conn OMERO gateway.
+        @type conn L{omero.gateway.BlitzGateway}
+        @param mapann_value The Map annotation value to filter by.
+        @type mapann_value L{string}
+        @param query Flag allowing to search for value patters.
+        @type query L{boolean}
+        @param mapann_ns The Map annotation namespace to filter by.
+        @type mapann_ns L{string}
+        @param mapann_names The Map annotation names to filter by.
+        @type mapann_names L{string}
+        @param group_id The Group ID to filter by or -1 for all groups,
+        defaults to -1
+        @type group_id L{long}
+        @param experimenter_id The Experimenter (user) ID to filter by
+        or -1 for all experimenters
+        @type experimenter_id L{long}
+        @param chunk Number of images loaded per query
+        @type chunk L{long}
+    '''
+
+    service_opts = deepcopy(conn.SERVICE_OPTS)
+
+    # Set the desired group context
+    if group_id is None:
+        group_id = -1
+    service_opts.setOmeroGroup(group_id)
+
+    qs = get_query_service(conn)
+
+    # ids of the next chunk of matching images
+    q = """
+        select distinct i.id
+        from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+            join ial.parent i
+            left outer join i.wellSamples ws
+            left outer join i.datasetLinks dil
+        where %s AND
+         (
+             (ws is not null)
+             OR
+             (dil is not null)
+         )
+         AND i.id > :last
+        order by i.id
+        """
+
+    # details of the chunk
+    q2 = """
+        select distinct i.id, i.name, fs.id,
+            pl.id, pl.name, s.id, s.name,
+            ds.id, ds.name, p.id, p.name
+        from Image i
+            left outer join i.fileset fs
+            left outer join i.wellSamples ws
+                left outer join ws.well w
+                left outer join w.plate pl
+                left outer join pl.screenLinks sl
+                left outer join sl.parent s
+            left outer join i.datasetLinks dil
+                left outer join dil.parent ds
+                left outer join ds.projectLinks pdl
+                left outer join pdl.parent p
+        where i.id in (:ids)
+        order by i.id, pl.id, ds.id
+        """
+
+    last = -1
+    while True:
+        params, where_clause = _set_parameters(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            query=query, mapann_value=mapann_value,
+            params=None, experimenter_id=experimenter_id,
+            page=1, limit=chunk)
+        params.add('last', rlong(last))
+        _q = q % (" and ".join(where_clause))
+
+        ids = [e[0] for e in unwrap(qs.projection(_q, params, service_opts))]
+        if not ids:
+            break
+
+        params = omero.sys.ParametersI()
+        params.addIds(ids)
+        yield [_marshal_export_row(e) for e in
+               unwrap(qs.projection(q2, params, service_opts))]
+
+        if len(ids) < chunk:
+            break
+        last = ids[-1]
+
+
 def load_mapannotation(conn, mapann_value,
                        mapann_ns=[], mapann_names=[],
                        group_id=-1, experimenter_id=-1,
@@ -898,7 +1917,7 @@ def load_mapannotation(conn, mapann_value,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
 
     q = """
         select distinct a
@@ -909,7 +1928,6 @@ def load_mapannotation(conn, mapann_value,
             order by a.ns asc
         """ % (" and ".join(where_clause))
 
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
     for ann in qs.findAllByQuery(q, params, service_opts):
         d = _marshal_annotation(conn, ann, None)
         exp = _marshal_exp_obj(ann.details.owner)
@@ -970,10 +1988,29 @@ def marshal_autocomplete(conn, mapann_value, query=True,
     where_clause2 = copy.deepcopy(where_clause)
 
     _cwc = 'mv.value' if case_sensitive else 'lower(mv.value)'
+    # values containing mapann_value known to the value index, split by
+    # whether they start with it as the queries below do
+    prefixed = contained = None
+    candidates = _search_values(
+        mapann_ns, mapann_names, mapann_value, case_sensitive)
+    if candidates is not None:
+        values, since = candidates
+        prefixed = ([], since)
+        contained = ([], since)
+        for v in values:
+            if (v if case_sensitive else v.lower()).startswith(mapann_value):
+                prefixed[0].append(v)
+            else:
+                contained[0].append(v)
+
     params.addString(
         "query",
         rstring("%s%%" % _escape_chars_like(mapann_value)))
-    where_clause.append(' %s like :query ' % _cwc)
+    if prefixed is not None:
+        where_clause.append(_casefold_clause(
+            params, 'candidates', prefixed, '%s like :query' % _cwc))
+    else:
+        where_clause.append(' %s like :query ' % _cwc)
     order_by = "length(mv.value) ASC, lower(mv.value) ASC"
 
     params2.addString(
@@ -982,8 +2019,12 @@ def marshal_autocomplete(conn, mapann_value, query=True,
     params2.addString(
         "query2",
         rstring("%s%%" % _escape_chars_like(mapann_value)))
-    where_clause2.append('%s like :query' % _cwc)
-    where_clause2.append('%s not like :query2' % _cwc)
+    contains = '%s like :query and %s not like :query2' % (_cwc, _cwc)
+    if contained is not None:
+        where_clause2.append(_casefold_clause(
+            params2, 'candidates', contained, contains))
+    else:
+        where_clause2.append(contains)
     order_by2 = "lower(mv.value)"
 
     service_opts = deepcopy(conn.SERVICE_OPTS)
@@ -993,7 +2034,7 @@ def marshal_autocomplete(conn, mapann_value, query=True,
         group_id = -1
     service_opts.setOmeroGroup(group_id)
 
-    qs = conn.getQueryService()
+    qs = get_query_service(conn)
 
     _q = """
         select new map(mv.value as value)
@@ -1006,7 +2047,6 @@ def marshal_autocomplete(conn, mapann_value, query=True,
     # query by value%
     q = _q.format(
         where_clause=(" and ".join(where_clause)), order_by=order_by)
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
     for e in qs.projection(q, params, service_opts):
         e = unwrap(e)
         autocomplete.append({'value': e[0]["value"]})
@@ -1014,7 +2054,6 @@ def marshal_autocomplete(conn, mapann_value, query=True,
     # query by %value% and exclude value%
     q = _q.format(
         where_clause=(" and ".join(where_clause2)), order_by=order_by2)
-    logger.debug("HQL QUERY: %s\nPARAMS: %r" % (q, params))
     for e in qs.projection(q, params2, service_opts):
         e = unwrap(e)
         autocomplete.append({'value': e[0]["value"]})
@@ -56,10 +56,19 @@ urlpatterns += [
         name="maprindex"),
 
     url(r'^api/config/$', views.api_mapr_config, name='mapr_config'),
+    url(r'^metrics/$', views.api_metrics, name='mapr_metrics'),
+    url(r'^api/search/$', views.api_search,
+        name='mapannotations_api_search'),
 
     url(r'^api/(?P<menu>%s)/count/$' % (CONFIG_REGEX),
         views.api_experimenter_list,
         name='mapannotations_api_experimenters'),
+    url(r'^api/(?P<menu>%s)/bundle/$' % (CONFIG_REGEX),
+        views.api_bundle,
+        name='mapannotations_api_bundle'),
+    url(r'^api/(?P<menu>%s)/counts/$' % (CONFIG_REGEX),
+        views.api_mapannotation_count_batch,
+        name='mapannotations_api_counts'),
     url(r'^api/(?P<menu>%s)/datasets/$' % CONFIG_REGEX,
         views.api_datasets_list,
         name='mapannotations_api_datasets'),
@@ -69,6 +78,9 @@ urlpatterns += [
     url(r'^api/(?P<menu>%s)/images/$' % CONFIG_REGEX,
         views.api_image_list,
         name='mapannotations_api_images'),
+    url(r'^api/(?P<menu>%s)/images/export/$' % CONFIG_REGEX,
+        views.api_image_export,
+        name='mapannotations_api_images_export'),
 
     url(r'^api/(?P<menu>%s)/paths_to_object/$' % CONFIG_REGEX,
         views.api_paths_to_object,
@@ -96,5 +108,8 @@ urlpatterns += [
     url(r'^favicon/$',
         views.mapannotations_favicon,
         name='mapannotations_favicon'),
+    url(r'^favicons/$',
+        views.mapannotations_favicons,
+        name='mapannotations_favicons'),
 
 ]
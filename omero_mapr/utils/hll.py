@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import hashlib
+import math
+
+
+# 2 ** PRECISION registers, a standard error of about 1.6%
+PRECISION = 12
+
+
+class HyperLogLog(object):
+
+    ''' HyperLogLog sketch estimating the number of distinct strings
+        added to it in 2 ** PRECISION bytes. Sketches of disjoint or
+        overlapping sets merge into the sketch of their union.
+    '''
+
+    def __init__(self, registers=None):
+        self.m = 1 << PRECISION
+        if registers is None:
+            registers = bytes(self.m)
+        if len(registers) != self.m:
+            raise ValueError("Expected %d registers" % self.m)
+        self.registers = bytearray(registers)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.sha1(
+            value.encode('utf-8')).digest()[:8], 'big')
+        index = h >> (64 - PRECISION)
+        rest = h & ((1 << (64 - PRECISION)) - 1)
+        # position of the leftmost 1 bit of the remaining bits
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(
+            max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def estimate(self):
+        ''' Returns the estimated number of distinct values '''
+
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small sets
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
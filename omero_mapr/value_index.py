@@ -0,0 +1,824 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from contextlib import closing
+from copy import deepcopy
+
+from omero.rtypes import rlong, unwrap
+from django.conf import settings
+
+from .mapr_settings import mapr_settings
+from .tree import _set_parameters, marshal_mapannotations
+from .tracing import get_query_service
+from .utils.hll import HyperLogLog
+from .utils.lru import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of aggregated rows loaded from OMERO per query while building
+BUILD_BATCH = 10000
+
+# Upper bound used to turn a prefix into an index friendly range
+PREFIX_UPPER = u"\U0010ffff"
+
+SCHEMA = """
+    create table if not exists mapr_menu (
+        menu text primary key,
+        built real not null,
+        user_id integer
+    );
+    create table if not exists mapr_value (
+        menu text not null,
+        group_id integer not null,
+        ns text,
+        name text,
+        value text not null,
+        value_lower text not null,
+        image_count integer not null,
+        screen_count integer not null,
+        project_count integer not null
+    );
+    create index if not exists mapr_value_value
+        on mapr_value (menu, value);
+    create index if not exists mapr_value_value_lower
+        on mapr_value (menu, value_lower);
+    create table if not exists mapr_casefold_scope (
+        scope text primary key,
+        since integer not null,
+        refreshed real not null,
+        user_id integer,
+        all_groups integer
+    );
+    create table if not exists mapr_casefold (
+        scope text not null,
+        value_lower text not null,
+        value text not null,
+        primary key (scope, value_lower, value)
+    ) without rowid;
+    create table if not exists mapr_top_menu (
+        menu text primary key,
+        top integer not null,
+        built real not null,
+        user_id integer
+    );
+    create table if not exists mapr_top (
+        menu text not null,
+        group_id integer not null,
+        rank integer not null,
+        value text not null,
+        image_count integer not null,
+        child_count integer not null,
+        primary key (menu, group_id, rank)
+    ) without rowid;
+    create table if not exists mapr_sketch (
+        scope text not null,
+        group_id integer not null,
+        registers blob not null,
+        primary key (scope, group_id)
+    ) without rowid;
+    """
+
+# Number of values of the leaderboard of a menu without wildcard limit
+TOP_K = 1000
+
+INDEX_QUERY = """
+    select a.ns, mv.name, mv.value, i.details.group.id,
+        count(distinct i.id),
+        count(distinct sl.parent.id),
+        count(distinct pdl.parent.id)
+    from ImageAnnotationLink ial join ial.child a join a.mapValue mv
+        join ial.parent i
+        left outer join i.wellSamples ws
+            left outer join ws.well w
+            left outer join w.plate pl
+            left outer join pl.screenLinks sl
+        left outer join i.datasetLinks dil
+            left outer join dil.parent ds
+            left outer join ds.projectLinks pdl
+    where %s AND
+     (
+         (ws is not null)
+         OR
+         (dil is not null)
+     )
+    group by a.ns, mv.name, mv.value, i.details.group.id
+    order by mv.value, a.ns, mv.name, i.details.group.id
+    """
+
+
+# Substring index of the case-fold table, requires SQLite 3.34+
+SEARCH_SCHEMA = """
+    create virtual table mapr_casefold_search using fts5(
+        value_lower, value unindexed, scope unindexed,
+        tokenize='trigram case_sensitive 1');
+    insert into mapr_casefold_search (value_lower, value, scope)
+        select value_lower, value, scope from mapr_casefold;
+    create trigger mapr_casefold_search_insert
+    after insert on mapr_casefold
+    begin
+        insert into mapr_casefold_search (value_lower, value, scope)
+        values (new.value_lower, new.value, new.scope);
+    end;
+    """
+
+# Maximum number of values a substring is resolved to, longer lists
+# are left to OMERO
+SEARCH_LIMIT = 1000
+
+# Seconds the lookups of the case-fold table are kept in memory
+LOOKUP_TTL = 60
+
+CASEFOLD_QUERY = """
+    select distinct mv.value
+    from MapAnnotation a join a.mapValue mv
+    where %s AND a.details.updateEvent.id > :since
+    order by mv.value
+    """
+
+WATERMARK_QUERY = """
+    select max(a.details.updateEvent.id)
+    from MapAnnotation a join a.mapValue mv
+    where %s
+    """
+
+
+def casefold_scope(mapann_ns, mapann_names):
+    ''' Returns the key of the case-fold table of the values of the
+        namespaces and keys of a menu
+    '''
+
+    return json.dumps([sorted(mapann_ns or []), sorted(mapann_names or [])])
+
+
+class ValueIndex(object):
+
+    ''' Materialized index of the distinct map annotation values of each
+        configured menu, stored in a local SQLite file.
+
+        Every row holds a distinct value per namespace, key and group
+        together with the number of images, screens and projects it is
+        linked to. The index is built from the same joins used by
+        L{omero_mapr.tree.count_mapannotations} and reflects the data
+        visible to the user who built it: it only covers the queries of
+        that user, not filtered by experimenter.
+
+        The leaderboard of a menu keeps the values annotating most images,
+        listed when browsing all values of a wildcard menu.
+
+        Built by an administrator, the index also keeps a HyperLogLog
+        sketch of the values of each group, estimating the number of
+        values of the groups any user reads.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._search = False
+        # (values, since) pairs stay valid after a refresh, see variants
+        self._lookups = LRUCache(maxsize=4096, ttl=LOOKUP_TTL)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    db.execute("pragma journal_mode=wal")
+                    db.executescript(SCHEMA)
+                    self._add_user(db)
+                    self._search = self._create_search(db)
+                    self._initialized = True
+        return db
+
+    def _add_user(self, db):
+        # indexes built before the user was stored cover nobody
+        for table, column in (("mapr_menu", "user_id"),
+                              ("mapr_top_menu", "user_id"),
+                              ("mapr_casefold_scope", "user_id"),
+                              ("mapr_casefold_scope", "all_groups")):
+            columns = [r[1] for r in db.execute(
+                "pragma table_info(%s)" % table)]
+            if column not in columns:
+                db.execute("alter table %s add column %s integer" %
+                           (table, column))
+
+    def _create_search(self, db):
+        if db.execute(
+                "select 1 from sqlite_master "
+                "where name = 'mapr_casefold_search'").fetchone():
+            return True
+        try:
+            db.executescript(SEARCH_SCHEMA)
+            return True
+        except sqlite3.OperationalError as e:
+            logger.info("Value index: no trigram search, %s" % e)
+            return False
+
+    def built(self, menu):
+        ''' Returns the time the menu was last built or None, also if
+            the index is unavailable
+        '''
+
+        try:
+            with closing(self._connect()) as db:
+                row = db.execute(
+                    "select built from mapr_menu where menu = ?",
+                    (menu,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+        return row[0] if row is not None else None
+
+    def covers(self, menu, user_id, experimenter_id=-1):
+        ''' Whether the index can answer queries of a user for the menu
+
+            @param menu The mapr menu.
+            @type menu L{string}
+            @param user_id The ID of the current user
+            @type user_id L{long}
+            @param experimenter_id The Experimenter (user) ID to filter by
+            or -1 for all experimenters
+            @type experimenter_id L{long}
+        '''
+
+        if experimenter_id is not None and experimenter_id != -1:
+            return False
+        try:
+            with closing(self._connect()) as db:
+                row = db.execute(
+                    "select 1 from mapr_menu where menu = ? and user_id = ?",
+                    (menu, user_id)).fetchone()
+            return row is not None
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return False
+
+    def _load(self, conn, mapann_ns, mapann_names, batch):
+        service_opts = deepcopy(conn.SERVICE_OPTS)
+        service_opts.setOmeroGroup(-1)
+        qs = get_query_service(conn)
+
+        page = 1
+        while True:
+            params, where_clause = _set_parameters(
+                mapann_ns=mapann_ns, mapann_names=mapann_names,
+                mapann_value=None, params=None,
+                page=page, limit=batch)
+            q = INDEX_QUERY % (" and ".join(where_clause))
+
+            rows = unwrap(qs.projection(q, params, service_opts))
+            for ns, name, value, group_id, images, screens, projects in rows:
+                yield (group_id, ns, name, value, value.lower(),
+                       images, screens, projects)
+            if len(rows) < batch:
+                break
+            page += 1
+
+    def build(self, conn, menu, mapann_ns=[], mapann_names=[],
+              batch=BUILD_BATCH):
+        ''' (Re)builds the index of a menu, replacing previous rows
+
+            @param conn OMERO gateway.
+            @type conn L{omero.gateway.BlitzGateway}
+            @param menu The mapr menu.
+            @type menu L{string}
+            @param mapann_ns The Map annotation namespace to filter by.
+            @type mapann_ns L{string}
+            @param mapann_names The Map annotation names to filter by.
+            @type mapann_names L{string}
+            @param batch Number of rows loaded per query
+            @type batch L{long}
+        '''
+
+        count = 0
+        user_id = conn.getUserId()
+        # sketches of the values of each group and of all groups (-1)
+        sketches = {-1: HyperLogLog()}
+        with closing(self._connect()) as db, db:
+            db.execute("delete from mapr_value where menu = ?", (menu,))
+            for row in self._load(conn, mapann_ns, mapann_names, batch):
+                db.execute(
+                    "insert into mapr_value values (?,?,?,?,?,?,?,?,?)",
+                    (menu,) + row)
+                group_id, value = row[0], row[3]
+                sketches.setdefault(group_id, HyperLogLog()).add(value)
+                sketches[-1].add(value)
+                count += 1
+            db.execute(
+                "insert or replace into mapr_menu (menu, built, user_id) "
+                "values (?, ?, ?)", (menu, time.time(), user_id))
+            if conn.isAdmin():
+                # other users only read the values of some groups
+                scope = casefold_scope(mapann_ns, mapann_names)
+                db.execute("delete from mapr_sketch where scope = ?",
+                           (scope,))
+                db.executemany(
+                    "insert into mapr_sketch values (?, ?, ?)",
+                    [(scope, group_id, sqlite3.Binary(sketch.to_bytes()))
+                     for group_id, sketch in sketches.items()])
+        logger.info("Value index: %d rows built for %s" % (count, menu))
+        return count
+
+    def build_top(self, conn, menu, mapann_ns=[], mapann_names=[],
+                  top=TOP_K):
+        ''' (Re)builds the leaderboard of a menu, the top values annotating
+            most images listed by L{omero_mapr.tree.marshal_mapannotations}
+            for all groups and for each group of the index of the menu.
+
+            @param conn OMERO gateway.
+            @type conn L{omero.gateway.BlitzGateway}
+            @param menu The mapr menu.
+            @type menu L{string}
+            @param mapann_ns The Map annotation namespace to filter by.
+            @type mapann_ns L{string}
+            @param mapann_names The Map annotation names to filter by.
+            @type mapann_names L{string}
+            @param top Number of values kept per group
+            @type top L{long}
+        '''
+
+        with closing(self._connect()) as db:
+            groups = [-1] + [r[0] for r in db.execute(
+                "select distinct group_id from mapr_value "
+                "where menu = ? order by group_id", (menu,))]
+
+        leaderboard = []
+        for group_id in groups:
+            values = marshal_mapannotations(
+                conn, mapann_value=None,
+                mapann_ns=mapann_ns, mapann_names=mapann_names,
+                group_id=group_id, page=1, limit=top)
+            for rank, v in enumerate(values, 1):
+                leaderboard.append((menu, group_id, rank, v['id'],
+                                    v['extra']['counter'], v['childCount']))
+
+        with closing(self._connect()) as db, db:
+            db.execute("delete from mapr_top where menu = ?", (menu,))
+            db.executemany(
+                "insert into mapr_top values (?,?,?,?,?,?)", leaderboard)
+            db.execute(
+                "insert or replace into mapr_top_menu "
+                "(menu, top, built, user_id) values (?, ?, ?, ?)",
+                (menu, top, time.time(), conn.getUserId()))
+        logger.info("Value index: top %d values of %d groups built for %s"
+                    % (top, len(groups), menu))
+        return len(leaderboard)
+
+    def _watermark(self, conn, mapann_ns, mapann_names):
+        service_opts = deepcopy(conn.SERVICE_OPTS)
+        service_opts.setOmeroGroup(-1)
+        params, where_clause = _set_parameters(
+            mapann_ns=mapann_ns, mapann_names=mapann_names,
+            mapann_value=None, params=None)
+        q = WATERMARK_QUERY % (" and ".join(where_clause))
+        rows = unwrap(get_query_service(conn).projection(
+            q, params, service_opts))
+        return rows[0][0] if rows and rows[0][0] is not None else 0
+
+    def refresh_casefold(self, conn, mapann_ns=[], mapann_names=[],
+                         batch=BUILD_BATCH):
+        ''' Adds the values of the map annotations updated since the last
+            refresh to the case-fold table of the namespaces and keys,
+            mapping lowercased values to their spellings.
+            All values are loaded the first time.
+            The table is used for the queries of every user, so it must be
+            refreshed by an administrator reading all groups: ValueError
+            is raised for other users.
+
+            @param conn OMERO gateway.
+            @type conn L{omero.gateway.BlitzGateway}
+            @param mapann_ns The Map annotation namespace to filter by.
+            @type mapann_ns L{string}
+            @param mapann_names The Map annotation names to filter by.
+            @type mapann_names L{string}
+            @param batch Number of values loaded per query
+            @type batch L{long}
+        '''
+
+        if not conn.isAdmin():
+            raise ValueError(
+                "The case-fold tables must be refreshed by an administrator,"
+                " not user %s" % conn.getUserId())
+        scope = casefold_scope(mapann_ns, mapann_names)
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "select since, all_groups from mapr_casefold_scope "
+                "where scope = ?", (scope,)).fetchone()
+        # tables refreshed by another user may miss values, load all again
+        since = row[0] if row is not None and row[1] else -1
+        # annotations updated while loading are loaded again next time
+        watermark = self._watermark(conn, mapann_ns, mapann_names)
+
+        service_opts = deepcopy(conn.SERVICE_OPTS)
+        service_opts.setOmeroGroup(-1)
+        qs = get_query_service(conn)
+        count = 0
+        page = 1
+        with closing(self._connect()) as db, db:
+            while True:
+                params, where_clause = _set_parameters(
+                    mapann_ns=mapann_ns, mapann_names=mapann_names,
+                    mapann_value=None, params=None,
+                    page=page, limit=batch)
+                params.add('since', rlong(since))
+                q = CASEFOLD_QUERY % (" and ".join(where_clause))
+                rows = unwrap(qs.projection(q, params, service_opts))
+                db.executemany(
+                    "insert or ignore into mapr_casefold values (?,?,?)",
+                    [(scope, r[0].lower(), r[0]) for r in rows])
+                count += len(rows)
+                if len(rows) < batch:
+                    break
+                page += 1
+            db.execute(
+                "insert or replace into mapr_casefold_scope "
+                "(scope, since, refreshed, user_id, all_groups) "
+                "values (?, ?, ?, ?, 1)",
+                (scope, max(since, watermark), time.time(),
+                 conn.getUserId()))
+        self._lookups.clear()
+        logger.info("Value index: %d values refreshed for %s"
+                    % (count, scope))
+        return count
+
+    def _since(self, db, scope):
+        # only tables holding the values of all groups serve every user
+        row = db.execute(
+            "select since from mapr_casefold_scope "
+            "where scope = ? and all_groups = 1",
+            (scope,)).fetchone()
+        return row[0] if row is not None else None
+
+    def variants(self, mapann_ns, mapann_names, mapann_value):
+        ''' Returns (spellings, since), the spellings of a value differing
+            only by case in the case-fold table of the namespaces and keys
+            and the last update event of the annotations it holds, or None
+            if the table was never refreshed by an administrator.
+            Annotations updated after since may hold other spellings.
+            A refresh only adds spellings and moves since forward, so the
+            pair is cached for LOOKUP_TTL seconds.
+
+            @param mapann_ns The Map annotation namespace to filter by.
+            @type mapann_ns L{string}
+            @param mapann_names The Map annotation names to filter by.
+            @type mapann_names L{string}
+            @param mapann_value The Map annotation value.
+            @type mapann_value L{string}
+        '''
+
+        scope = casefold_scope(mapann_ns, mapann_names)
+        key = ('variants', scope, mapann_value.lower())
+        result = self._lookups.get(key)
+        if result is not None:
+            return result
+        try:
+            with closing(self._connect()) as db:
+                since = self._since(db, scope)
+                if since is None:
+                    return None
+                rows = db.execute(
+                    "select value from mapr_casefold "
+                    "where scope = ? and value_lower = ?",
+                    (scope, mapann_value.lower())).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+        result = ([r[0] for r in rows], since)
+        self._lookups.set(key, result)
+        return result
+
+    def search(self, mapann_ns, mapann_names, mapann_value,
+               case_sensitive=False, limit=SEARCH_LIMIT):
+        ''' Returns (values, since), the values containing mapann_value in
+            the case-fold table of the namespaces and keys and the last
+            update event of the annotations it holds, or None if the table
+            was never refreshed by an administrator, see
+            L{refresh_casefold}, or more than limit values contain it.
+            Annotations updated after since may hold other values, see
+            L{variants}.
+
+            @param mapann_ns The Map annotation namespace to filter by.
+            @type mapann_ns L{string}
+            @param mapann_names The Map annotation names to filter by.
+            @type mapann_names L{string}
+            @param mapann_value The substring to search for.
+            @type mapann_value L{string}
+            @param case_sensitive Whether the case of mapann_value matters
+            @type case_sensitive L{boolean}
+            @param limit The maximum number of values
+            @type limit L{long}
+        '''
+
+        scope = casefold_scope(mapann_ns, mapann_names)
+        key = ('search', scope, mapann_value, case_sensitive, limit)
+        result = self._lookups.get(key)
+        if result is not None:
+            return result
+        lower = mapann_value.lower()
+        if case_sensitive:
+            contains = ("instr(value, ?) > 0", mapann_value)
+        else:
+            contains = ("instr(value_lower, ?) > 0", lower)
+        try:
+            with closing(self._connect()) as db:
+                since = self._since(db, scope)
+                if since is None:
+                    return None
+                if self._search and len(lower) >= 3:
+                    # trigrams of the lowercased value narrow the search
+                    q = ("select value from mapr_casefold_search "
+                         "where mapr_casefold_search match ? "
+                         "and scope = ? and %s limit ?" % contains[0])
+                    args = ('"%s"' % lower.replace('"', '""'), scope)
+                else:
+                    q = ("select value from mapr_casefold "
+                         "where scope = ? and %s limit ?" % contains[0])
+                    args = (scope,)
+                rows = db.execute(
+                    q, args + (contains[1], limit + 1)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+        if len(rows) > limit:
+            return None
+        result = ([r[0] for r in rows], since)
+        self._lookups.set(key, result)
+        return result
+
+    def values(self, menu):
+        ''' Returns the distinct (group_id, value) pairs of a menu '''
+
+        with closing(self._connect()) as db:
+            return db.execute(
+                "select distinct group_id, value from mapr_value "
+                "where menu = ?", (menu,)).fetchall()
+
+    def _where(self, menu, group_id):
+        where_clause = ["menu = ?"]
+        args = [menu]
+        if group_id is not None and group_id != -1:
+            where_clause.append("group_id = ?")
+            args.append(group_id)
+        return where_clause, args
+
+    def count(self, menu, mapann_value, query=False, case_sensitive=False,
+              group_id=-1):
+        ''' Counts distinct values, see
+            L{omero_mapr.tree.count_mapannotations}, or returns None if the
+            index is unavailable
+        '''
+
+        where_clause, args = self._where(menu, group_id)
+        if mapann_value:
+            _cwc = 'value' if case_sensitive else 'value_lower'
+            if not case_sensitive:
+                mapann_value = mapann_value.lower()
+            if query:
+                where_clause.append("instr(%s, ?) > 0" % _cwc)
+            else:
+                where_clause.append("%s = ?" % _cwc)
+            args.append(mapann_value)
+
+        q = "select count(distinct value) from mapr_value where %s" % (
+            " and ".join(where_clause))
+        try:
+            with closing(self._connect()) as db:
+                return db.execute(q, args).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+
+    def estimate(self, mapann_ns, mapann_names, group_ids=None):
+        ''' Estimates the number of distinct values of the namespaces and
+            keys of a menu from the sketches of the groups, see
+            L{omero_mapr.tree.count_mapannotations}, or returns None if
+            no administrator built the index of the menu.
+
+            @param mapann_ns The Map annotation namespace to filter by.
+            @type mapann_ns L{string}
+            @param mapann_names The Map annotation names to filter by.
+            @type mapann_names L{string}
+            @param group_ids The IDs of the groups to count the values of
+            or None for all groups
+            @type group_ids L{list}
+        '''
+
+        scope = casefold_scope(mapann_ns, mapann_names)
+        if group_ids is None:
+            group_ids = [-1]
+        try:
+            with closing(self._connect()) as db:
+                if db.execute(
+                        "select 1 from mapr_sketch "
+                        "where scope = ? and group_id = -1",
+                        (scope,)).fetchone() is None:
+                    return None
+                sketch = HyperLogLog()
+                for group_id in group_ids:
+                    row = db.execute(
+                        "select registers from mapr_sketch "
+                        "where scope = ? and group_id = ?",
+                        (scope, group_id)).fetchone()
+                    if row is not None:
+                        sketch.merge(HyperLogLog(bytes(row[0])))
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+        return sketch.estimate()
+
+    def top(self, menu, user_id, group_id=-1, offset=0,
+            limit=settings.PAGE, cursor=None, end=0):
+        ''' Lists the values annotating most images from the leaderboard
+            as (value, image count, child count) rows, see
+            L{omero_mapr.tree.marshal_mapannotations}, or None if the
+            leaderboard does not hold them or was built by another user.
+
+            @param user_id The ID of the current user
+            @type user_id L{long}
+
+            @param offset Number of values skipped
+            @type offset L{long}
+            @param limit The limit of results per page to get
+            @type limit L{long}
+            @param cursor [image count, value] of the last row of the
+            previous page, replacing offset
+            @type cursor L{list}
+            @param end Number of values listed at most or 0 for all
+            @type end L{long}
+        '''
+
+        if group_id is None:
+            group_id = -1
+        if cursor and (not isinstance(cursor, list) or len(cursor) != 2):
+            return None
+        try:
+            with closing(self._connect()) as db:
+                row = db.execute(
+                    "select top from mapr_top_menu "
+                    "where menu = ? and user_id = ?",
+                    (menu, user_id)).fetchone()
+                if row is None:
+                    return None
+                top = row[0]
+                if cursor:
+                    row = db.execute(
+                        "select rank from mapr_top where menu = ? "
+                        "and group_id = ? and image_count = ? and value = ?",
+                        [menu, group_id] + cursor).fetchone()
+                    if row is None:
+                        return None
+                    offset = row[0]
+                rows = db.execute(
+                    "select value, image_count, child_count from mapr_top "
+                    "where menu = ? and group_id = ? "
+                    "and rank > ? and rank <= ? order by rank limit ?",
+                    (menu, group_id, offset, min(end or top, top),
+                     limit)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+        if (len(rows) < limit and offset + len(rows) >= top and
+                (not end or end > top)):
+            # the page continues past the values kept
+            return None
+        return rows
+
+    def autocomplete(self, menu, mapann_value, case_sensitive=False,
+                     group_id=-1, page=1, limit=settings.PAGE):
+        ''' Lists values for autocomplete, see
+            L{omero_mapr.tree.marshal_autocomplete}.
+            Values starting with mapann_value come first, ordered by length,
+            followed by values containing it, ordered alphabetically.
+            Returns None if the index is unavailable.
+        '''
+
+        autocomplete = []
+        if not mapann_value:
+            return autocomplete
+
+        _cwc = 'value' if case_sensitive else 'value_lower'
+        if not case_sensitive:
+            mapann_value = mapann_value.lower()
+
+        if page is not None and page > 0:
+            paging = (limit, (page - 1) * limit)
+        else:
+            paging = (-1, 0)
+
+        _q = """
+            select value from mapr_value
+            where {where_clause}
+            group by value
+            order by {order_by}
+            limit ? offset ?
+            """
+        prefix = "({0} >= ? and {0} < ?)".format(_cwc)
+        prefix_args = [mapann_value, mapann_value + PREFIX_UPPER]
+
+        where_clause, args = self._where(menu, group_id)
+        # query by value%
+        q = _q.format(
+            where_clause=" and ".join(where_clause + [prefix]),
+            order_by="length(value) ASC, value_lower ASC")
+        args1 = args + prefix_args + list(paging)
+
+        # query by %value% and exclude value%
+        q2 = _q.format(
+            where_clause=" and ".join(
+                where_clause + ["instr(%s, ?) > 0" % _cwc, "not " + prefix]),
+            order_by="value_lower")
+        args2 = args + [mapann_value] + prefix_args + list(paging)
+
+        try:
+            with closing(self._connect()) as db:
+                for row in db.execute(q, args1):
+                    autocomplete.append({'value': row[0]})
+                for row in db.execute(q2, args2):
+                    autocomplete.append({'value': row[0]})
+        except sqlite3.Error as e:
+            logger.warning("Value index %s unavailable: %s" % (self.path, e))
+            return None
+        return autocomplete
+
+
+_indexes = {}
+
+
+def get_value_index():
+    ''' Returns the index configured by omero.web.mapr.value_index
+        or None if it is not set.
+    '''
+
+    path = mapr_settings.VALUE_INDEX
+    if not path:
+        return None
+    index = _indexes.get(path)
+    if index is None:
+        index = _indexes.setdefault(path, ValueIndex(path))
+    return index
+
+
+def resolve_variants(mapann_ns, mapann_names, mapann_value):
+    ''' Returns the spellings of a value differing only by case from
+        the case-fold table of the index configured by
+        omero.web.mapr.value_index and the update event they are known up
+        to, or None if they are not known, see L{ValueIndex.variants}.
+    '''
+
+    index = get_value_index()
+    if index is None:
+        return None
+    return index.variants(mapann_ns, mapann_names, mapann_value)
+
+
+def search_values(mapann_ns, mapann_names, mapann_value,
+                  case_sensitive=False):
+    ''' Returns the values containing mapann_value from the case-fold
+        table of the index configured by omero.web.mapr.value_index and
+        the update event they are known up to, or None if they are not
+        known, see L{ValueIndex.search}.
+    '''
+
+    index = get_value_index()
+    if index is None:
+        return None
+    return index.search(mapann_ns, mapann_names, mapann_value,
+                        case_sensitive=case_sensitive)
+
+
+def estimate_values(mapann_ns, mapann_names, group_ids=None):
+    ''' Estimates the number of distinct values of the namespaces and
+        keys of a menu from the index configured by
+        omero.web.mapr.value_index or returns None if it can not, see
+        L{ValueIndex.estimate}.
+    '''
+
+    index = get_value_index()
+    if index is None:
+        return None
+    return index.estimate(mapann_ns, mapann_names, group_ids=group_ids)
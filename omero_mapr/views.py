@@ -20,10 +20,11 @@
 #
 # Version: 1.0
 
+import json
 import logging
 import traceback
-import requests
-from io import BytesIO
+from collections import OrderedDict
+from itertools import chain
 try:
     from urllib.parse import urlparse
 except ImportError:
@@ -37,29 +38,29 @@ from .mapr_settings import mapr_settings
 
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseServerError, HttpResponseBadRequest
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.http import Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 
 from django.utils.html import strip_tags
 
-from django_redis import get_redis_connection
-
 from omero.gateway.utils import toBoolean
 
-from .show import mapr_paths_to_object
 from .show import MapShow as Show
-from .tree import count_mapannotations, \
-                  marshal_mapannotations, \
-                  marshal_screens, \
-                  marshal_projects, \
-                  marshal_datasets, \
-                  marshal_plates, \
-                  marshal_images, \
-                  load_mapannotation, \
-                  marshal_autocomplete
+from .tree import encode_cursor, decode_cursor, marshal_top_values
+from .backends import get_backend
+from .value_index import get_value_index
+from .cache import cached
+from .config import serialized_config
+from .executor import QueryExecutor
+from .tracing import trace_view
+from .metrics import REGISTRY
+from .autocomplete import get_prefix_tables
+from .favicon import get_favicon, get_favicons, data_uri
 
 from omeroweb.webclient.decorators import login_required, render_response
 from omeroweb.webclient.views import get_long_or_default, get_bool_or_default
@@ -72,26 +73,28 @@ from omeroweb.webclient.views import api_paths_to_object \
 
 try:
     # renamed for Django 1.11
-    from omeroweb.httprsp import HttpJPEGResponse
+    from omeroweb.httprsp import HttpJPEGResponse, ConnCleaningHttpResponse
 except ImportError:
     # old name for backwards compatibility
-    from omeroweb.http import HttpJPEGResponse
+    from omeroweb.http import HttpJPEGResponse, ConnCleaningHttpResponse
 
 import omeroweb
 
 logger = logging.getLogger(__name__)
 
 
-try:
-    from PIL import Image  # see ticket:2597
-except ImportError:
-    try:
-        import Image  # see ticket:2597
-    except ImportError:
-        logger.error(
-            "You need to install the Python Imaging Library. Get it at"
-            " http://www.pythonware.com/products/pil/")
-        logger.error(traceback.format_exc())
+# Number of screens and projects whose children are bundled
+BUNDLE_CHILDREN = 5
+
+# Values of count_mode, see _marshal_experimenter
+COUNT_EXACT = 'exact'
+COUNT_APPROX = 'approx'
+
+# Number of values returned per menu by api/search/
+SEARCH_VALUES = 10
+
+# Number of urls whose favicons can be requested at once
+MAX_FAVICONS = 100
 
 
 # Views Helpers
@@ -168,6 +171,291 @@ def _get_case_sensitive(mapr_settings, menu):
     return cs
 
 
+def _get_value_index(conn, menu, experimenter_id=-1):
+    index = get_value_index()
+    if index is not None and index.covers(menu, conn.getUserId(),
+                                          experimenter_id):
+        return index
+    return None
+
+
+def _get_count_mode(request):
+    """
+    Returns the count_mode of the request, raising ValueError if it is
+    neither exact nor approx
+    """
+    count_mode = get_unicode_or_default(request, 'count_mode', COUNT_EXACT)
+    if count_mode not in (COUNT_EXACT, COUNT_APPROX):
+        raise ValueError("Invalid count_mode: %s" % count_mode)
+    return count_mode
+
+
+def _get_cursor(request):
+    """
+    Returns the decoded keyset cursor of the request, [] for the first page
+    or None when paging by page number
+    """
+    cursor = get_unicode_or_default(request, 'cursor', None)
+    if cursor is None:
+        return None
+    return decode_cursor(cursor) or []
+
+
+def _get_list_cursor(cursor, name):
+    """
+    Returns the paging arguments of one of the lists sharing a cursor,
+    e.g. screens and projects, or None once that list is exhausted
+    """
+    if cursor is None:
+        return {}
+    if not isinstance(cursor, dict):
+        cursor = {}
+    key = cursor.get(name, [])
+    if key is None:
+        return None
+    return {'cursor': key}
+
+
+def _get_prefix_table(value_index, menu, group_id=-1):
+    prefix_tables = get_prefix_tables()
+    if value_index is None or prefix_tables is None:
+        return None
+    return prefix_tables.get(value_index, menu, group_id)
+
+
+def _get_values(request):
+    """
+    Retrieves the list of values of a batch request, given as repeated
+    'value' parameters or as a JSON body {"values": [...]}
+    """
+    if request.method == 'POST':
+        if request.content_type == 'application/json':
+            values = json.loads(request.body.decode('utf-8'))
+            if isinstance(values, dict):
+                values = values.get('values')
+            if not isinstance(values, list) or \
+                    not all(isinstance(v, str) for v in values):
+                raise ValueError("Invalid values")
+        else:
+            values = request.POST.getlist('value')
+    else:
+        values = request.GET.getlist('value')
+    # unique values in the requested order
+    seen = set()
+    return [v for v in (v.strip() for v in values)
+            if v and not (v in seen or seen.add(v))]
+
+
+def _marshal_experimenter(conn, menu, backend, mapann_value, query,
+                          case_sensitive, group_id, experimenter_id,
+                          count_mode=COUNT_EXACT):
+    """
+    Marshals the experimenter, or the fake experimenter -1, with the
+    number of values matching mapann_value as childCount.
+    With count_mode approx, values are counted from the value index or
+    estimated and marked as approximate.
+    """
+    if experimenter_id > -1:
+        # Get the experimenter
+        experimenter = webclient_tree.marshal_experimenter(
+            conn=conn, experimenter_id=experimenter_id)
+    else:
+        # fake experimenter -1
+        experimenter = fake_experimenter(
+            mapr_settings.CONFIG[menu]['label'])
+
+    if _get_wildcard(mapr_settings, menu) or mapann_value:
+        experimenter['extra'] = {'case_sensitive': case_sensitive}
+        if query:
+            experimenter['extra']['query'] = query
+
+        # count children
+        value_index = _get_value_index(conn, menu, experimenter_id)
+        child_count = None
+        if value_index is not None:
+            child_count = value_index.count(
+                menu,
+                mapann_value=mapann_value,
+                query=query,
+                case_sensitive=case_sensitive,
+                group_id=group_id)
+        if child_count is not None:
+            experimenter['childCount'] = child_count
+        else:
+            count = backend.count_mapannotations
+            if count_mode == COUNT_APPROX:
+                count = backend.estimate_mapannotations
+                experimenter['extra']['approximate'] = True
+            experimenter['childCount'] = cached(
+                conn, menu, count,
+                mapann_value=mapann_value,
+                query=query,
+                case_sensitive=case_sensitive,
+                mapann_ns=_get_ns(mapr_settings, menu),
+                mapann_names=_get_keys(mapr_settings, menu),
+                group_id=group_id,
+                experimenter_id=experimenter_id)
+
+        wildcard_limit = _get_wildcard_limit(mapr_settings, menu)
+        if wildcard_limit and not mapann_value:
+            # no more values are listed, see _marshal_top
+            experimenter['childCount'] = min(
+                experimenter['childCount'], wildcard_limit)
+
+        if experimenter['childCount'] > 0 and mapann_value:
+            experimenter['extra']['value'] = mapann_value
+    return experimenter
+
+
+def _marshal_top(conn, menu, backend, mapann_ns, mapann_names,
+                 group_id, experimenter_id, page, limit, cursor=None):
+    """
+    Lists the values of a wildcard menu annotating most images, at most
+    wildcard.limit of them, from the leaderboard of the value index
+    if it holds them, or else from the backend.
+    The cursor holds the sort key of the last value listed followed by
+    the number of values listed so far.
+    """
+    wildcard_limit = _get_wildcard_limit(mapr_settings, menu)
+    offset = 0
+    top_limit = limit
+    key = None
+    if cursor is None:
+        if page:
+            offset = (page - 1) * limit
+        else:
+            # not paged, all values up to the limit
+            top_limit = wildcard_limit
+    else:
+        if not cursor:
+            cursor = [0]
+        if len(cursor) not in (1, 3) or isinstance(cursor[-1], bool) or \
+                not isinstance(cursor[-1], int) or cursor[-1] < 0:
+            raise ApiUsageException(None, None, "Invalid cursor")
+        key = cursor[:-1]
+        offset = cursor[-1]
+    if wildcard_limit:
+        if offset >= wildcard_limit:
+            return [] if cursor is None else ([], None)
+        top_limit = min(top_limit, wildcard_limit - offset)
+
+    mapannotations = None
+    value_index = _get_value_index(conn, menu, experimenter_id)
+    if value_index is not None and top_limit:
+        rows = value_index.top(
+            menu, conn.getUserId(), group_id=group_id, offset=offset,
+            limit=top_limit, cursor=key, end=wildcard_limit)
+        if rows is not None:
+            mapannotations = marshal_top_values(
+                conn, rows, experimenter_id=experimenter_id,
+                limit=None if cursor is None else top_limit)
+
+    if mapannotations is None:
+        paging = {} if cursor is None else {'cursor': key}
+        mapannotations = cached(
+            conn, menu, backend.marshal_mapannotations,
+            mapann_value=None,
+            mapann_ns=mapann_ns,
+            mapann_names=mapann_names,
+            group_id=group_id,
+            experimenter_id=experimenter_id,
+            page=page if cursor is None else None,
+            limit=limit if cursor is None else top_limit,
+            **paging)
+    if cursor is None:
+        if wildcard_limit:
+            mapannotations = mapannotations[:top_limit]
+        return mapannotations
+
+    mapannotations, next_key = mapannotations
+    offset += len(mapannotations)
+    if next_key is None or (wildcard_limit and offset >= wildcard_limit):
+        return mapannotations, None
+    return mapannotations, next_key + [offset]
+
+
+def _load_bundle(conn, menu, mapann_value, query, case_sensitive,
+                 group_id, experimenter_id=-1, children=BUNDLE_CHILDREN,
+                 limit=settings.PAGE, count_mode=COUNT_EXACT):
+    """
+    Loads what the tree requests when the page is opened, i.e. the
+    responses of count/, of the first page of api/<menu>/ and of plates/
+    and datasets/ for the first children screens and projects.
+    The lists are loaded concurrently, then the children of all of them
+    with one query per type.
+    """
+    backend = get_backend()
+    kwargs = {
+        'mapann_value': mapann_value,
+        'query': query,
+        'mapann_ns': _get_ns(mapr_settings, menu),
+        'mapann_names': _get_keys(mapr_settings, menu),
+        'group_id': group_id,
+        'experimenter_id': experimenter_id,
+        'page': 1,
+        'limit': limit,
+    }
+    bundle = {
+        'value': mapann_value,
+        'group': group_id,
+        'experimenter': None,
+        'mapannotations': {'maps': [], 'screens': [], 'projects': []},
+        'plates': {},
+        'datasets': {},
+    }
+    with QueryExecutor(conn) as executor:
+        experimenter = executor.submit(
+            _marshal_experimenter, conn, menu, backend,
+            mapann_value=mapann_value,
+            query=query,
+            case_sensitive=case_sensitive,
+            group_id=group_id,
+            experimenter_id=experimenter_id,
+            count_mode=count_mode)
+        if _get_wildcard(mapr_settings, menu) or mapann_value:
+            screens = executor.submit(
+                cached, conn, menu, backend.marshal_screens, **kwargs)
+            projects = executor.submit(
+                cached, conn, menu, backend.marshal_projects, **kwargs)
+            lists = bundle['mapannotations']
+            lists['screens'] = screens.result()
+            lists['projects'] = projects.result()
+
+            plates = executor.submit(
+                cached, conn, menu, backend.marshal_plates_batch,
+                screen_ids=[c['id'] for c in lists['screens'][:children]],
+                **kwargs)
+            datasets = executor.submit(
+                cached, conn, menu, backend.marshal_datasets_batch,
+                project_ids=[c['id'] for c in lists['projects'][:children]],
+                **kwargs)
+            bundle['plates'] = plates.result()
+            bundle['datasets'] = datasets.result()
+        bundle['experimenter'] = experimenter.result()
+    return bundle
+
+
+def _json_script(data):
+    """
+    Serializes data to be embedded in a <script> element
+    """
+    return json.dumps(data).replace('<', '\\u003c').replace(
+        '>', '\\u003e').replace('&', '\\u0026')
+
+
+def _get_ids(request):
+    """
+    Retrieves the parent ids of a batch request, given as repeated or
+    comma separated 'ids' parameters
+    """
+    ids = []
+    for value in request.GET.getlist('ids'):
+        ids.extend(int(i) for i in value.split(',') if i.strip())
+    # unique ids in the requested order
+    seen = set()
+    return [i for i in ids if not (i in seen or seen.add(i))]
+
+
 def _get_page(request):
     page = get_long_or_default(request, 'page', 1)
     if page < 1:
@@ -176,6 +464,7 @@ def _get_page(request):
 
 
 @login_required()
+@trace_view
 @render_response()
 def index(request, menu, conn=None, url=None, **kwargs):
     """
@@ -210,21 +499,57 @@ def index(request, menu, conn=None, url=None, **kwargs):
          'case_sensitive': case_sensitive or ""}
     context['template'] = "mapr/base_mapr.html"
 
+    if mapr_settings.INLINE_BUNDLE and value:
+        group_id = request.session.get('active_group') or \
+            conn.getEventContext().groupId
+        try:
+            bundle = _load_bundle(conn, menu, value, query, case_sensitive,
+                                  group_id)
+            context['mapr_bundle'] = _json_script(bundle)
+        except (ApiUsageException, ServerError, IceException):
+            # the tree loads it by itself
+            logger.warning("Failed to load the tree bundle", exc_info=True)
+
     return context
 
 
+def _config_etag(request):
+    return serialized_config().hash
+
+
+@trace_view
+@condition(etag_func=_config_etag)
 def api_mapr_config(request):
-    """Return mapr_settings.CONFIG as JSON."""
-    return JsonResponse(mapr_settings.CONFIG)
+    """
+    Return mapr_settings.CONFIG as JSON, with the hash of the config as
+    ETag so that clients revalidate it with If-None-Match.
+    """
+    rsp = HttpResponse(serialized_config().json,
+                       content_type='application/json')
+    rsp['Cache-Control'] = 'no-cache'
+    return rsp
+
+
+def api_metrics(request):
+    """
+    Return the metrics of this process in the Prometheus text format,
+    if enabled by omero.web.mapr.metrics.
+    """
+    if not mapr_settings.METRICS:
+        raise Http404
+    return HttpResponse(REGISTRY.render(),
+                        content_type='text/plain; version=0.0.4')
 
 
 @login_required()
+@trace_view
 def api_paths_to_object(request, menu=None, conn=None, **kwargs):
     """
     This override omeroweb.webclient.api_paths_to_object
     to support custom path to map.value
     """
 
+    backend = get_backend()
     try:
         mapann_ns = _get_ns(mapr_settings, menu)
         mapann_names = _get_keys(mapr_settings, menu)
@@ -244,16 +569,19 @@ def api_paths_to_object(request, menu=None, conn=None, **kwargs):
             screen_id = get_long_or_default(request, 'screen', None)
             plate_id = get_long_or_default(request, 'plate', None)
             group_id = get_long_or_default(request, 'group', None)
+            first = get_bool_or_default(request, 'first', False)
         except ValueError:
             return HttpResponseBadRequest('Invalid parameter value')
 
-        paths = mapr_paths_to_object(
-            conn=conn, mapann_value=mapann_value,
+        paths = cached(
+            conn, menu, backend.mapr_paths_to_object,
+            mapann_value=mapann_value,
             mapann_ns=mapann_ns, mapann_names=mapann_names,
             screen_id=screen_id, plate_id=plate_id,
             project_id=project_id, dataset_id=dataset_id,
             image_id=image_id,
-            experimenter_id=experimenter_id, group_id=group_id)
+            experimenter_id=experimenter_id, group_id=group_id,
+            first=first)
 
         return JsonResponse({'paths': paths})
     return webclient_api_paths_to_object(request, conn=conn, **kwargs)
@@ -263,13 +591,11 @@ omeroweb.webclient.views.api_paths_to_object = api_paths_to_object
 
 
 @login_required()
+@trace_view
 def api_experimenter_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
     try:
-        mapann_ns = _get_ns(mapr_settings, menu)
-        mapann_names = _get_keys(mapr_settings, menu)
-
         # page = _get_page(request)
         # limit = get_long_or_default(request, 'limit', settings.PAGE)
         group_id = get_long_or_default(request, 'group', -1)
@@ -282,39 +608,109 @@ def api_experimenter_list(request, menu, conn=None, **kwargs):
                 request, 'case_sensitive', False)
         else:
             case_sensitive = False
+        count_mode = _get_count_mode(request)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
 
     experimenter = {}
     try:
-        if experimenter_id > -1:
-            # Get the experimenter
-            experimenter = webclient_tree.marshal_experimenter(
-                conn=conn, experimenter_id=experimenter_id)
+        experimenter = _marshal_experimenter(
+            conn, menu, get_backend(),
+            mapann_value=mapann_value,
+            query=query,
+            case_sensitive=case_sensitive,
+            group_id=group_id,
+            experimenter_id=experimenter_id,
+            count_mode=count_mode)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    return JsonResponse({'experimenter': experimenter})
+
+
+@login_required()
+@trace_view
+def api_bundle(request, menu, conn=None, **kwargs):
+
+    # Get parameters
+    try:
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request, 'experimenter', -1)
+        mapann_value = get_unicode_or_default(request, 'value', None)
+        query = get_bool_or_default(request, 'query', False)
+        if _get_case_sensitive(mapr_settings, menu):
+            case_sensitive = get_bool_or_default(
+                request, 'case_sensitive', False)
         else:
-            # fake experimenter -1
-            experimenter = fake_experimenter(
-                mapr_settings.CONFIG[menu]['label'])
+            case_sensitive = False
+        limit = get_long_or_default(request, 'limit', settings.PAGE)
+        children = get_long_or_default(request, 'children', BUNDLE_CHILDREN)
+        children = max(0, min(children, limit))
+        count_mode = _get_count_mode(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
 
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
-            experimenter['extra'] = {'case_sensitive': case_sensitive}
-            if query:
-                experimenter['extra']['query'] = query
+    try:
+        bundle = _load_bundle(conn, menu, mapann_value, query,
+                              case_sensitive, group_id,
+                              experimenter_id=experimenter_id,
+                              children=children, limit=limit,
+                              count_mode=count_mode)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    return JsonResponse(bundle)
 
-            # count children
-            experimenter['childCount'] = count_mapannotations(
-                conn=conn,
-                mapann_value=mapann_value,
-                query=query,
-                case_sensitive=case_sensitive,
-                mapann_ns=mapann_ns,
-                mapann_names=mapann_names,
-                group_id=group_id,
-                experimenter_id=experimenter_id)
 
-            if experimenter['childCount'] > 0 and mapann_value:
-                experimenter['extra']['value'] = mapann_value
+@login_required()
+@trace_view
+def api_search(request, conn=None, **kwargs):
+    """
+    Search a value in all menus at once, returning the number of matching
+    values of each menu and those annotating most images
+    """
 
+    # Get parameters
+    try:
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request, 'experimenter', -1)
+        limit = get_long_or_default(request, 'limit', SEARCH_VALUES)
+        mapann_value = get_unicode_or_default(request, 'value', None)
+        query = get_bool_or_default(request, 'query', False)
+        case_sensitive = get_bool_or_default(
+            request, 'case_sensitive', False)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+
+    if not mapann_value:
+        return HttpResponseBadRequest('Missing value')
+    limit = max(0, min(limit, settings.PAGE))
+
+    menus = OrderedDict(
+        (menu, (_get_ns(mapr_settings, menu), _get_keys(mapr_settings, menu)))
+        for menu in mapr_settings.CONFIG)
+    # unless all menus allow case sensitive searches
+    case_sensitive = case_sensitive and all(
+        _get_case_sensitive(mapr_settings, menu) for menu in menus)
+
+    try:
+        results = get_backend().search_mapannotations(
+            conn,
+            mapann_value=mapann_value,
+            menus=menus,
+            query=query,
+            case_sensitive=case_sensitive,
+            group_id=group_id,
+            experimenter_id=experimenter_id,
+            limit=limit)
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
@@ -322,10 +718,61 @@ def api_experimenter_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'experimenter': experimenter})
+    for menu, result in results['menus'].items():
+        result['label'] = mapr_settings.CONFIG[menu].get('label', menu)
+    return JsonResponse(results)
 
 
+# read-only, values may be POSTed by pipelines without a CSRF token
+@csrf_exempt
 @login_required()
+@trace_view
+def api_mapannotation_count_batch(request, menu, conn=None, **kwargs):
+
+    # Get parameters
+    try:
+        mapann_ns = _get_ns(mapr_settings, menu)
+        mapann_names = _get_keys(mapr_settings, menu)
+
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request, 'experimenter', -1)
+        mapann_values = _get_values(request)
+        if _get_case_sensitive(mapr_settings, menu):
+            case_sensitive = get_bool_or_default(
+                request, 'case_sensitive', False)
+        else:
+            case_sensitive = False
+    except ValueError:
+        return HttpResponseBadRequest('Invalid parameter value')
+
+    if len(mapann_values) > mapr_settings.COUNT_BATCH_SIZE:
+        return HttpResponseBadRequest(
+            'Too many values, at most %d are allowed' %
+            mapr_settings.COUNT_BATCH_SIZE)
+
+    counts = {}
+    backend = get_backend()
+    try:
+        counts = cached(
+            conn, menu, backend.count_mapannotations_batch,
+            mapann_values=mapann_values,
+            case_sensitive=case_sensitive,
+            mapann_ns=mapann_ns,
+            mapann_names=mapann_names,
+            group_id=group_id,
+            experimenter_id=experimenter_id)
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    return JsonResponse({'counts': counts})
+
+
+@login_required()
+@trace_view
 def api_mapannotation_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
@@ -346,50 +793,66 @@ def api_mapannotation_list(request, menu, conn=None, **kwargs):
         else:
             case_sensitive = False
         orphaned = get_bool_or_default(request, 'orphaned', False)
+        cursor = _get_cursor(request)
     except ValueError:
         logger.error(traceback.format_exc())
         return HttpResponseBadRequest('Invalid parameter value')
 
-    mapannotations = []
-    screens = []
-    projects = []
+    results = {'maps': [], 'screens': [], 'projects': []}
+    backend = get_backend()
     try:
         if _get_wildcard(mapr_settings, menu) or mapann_value:
             # Get attributes from map annotation
-            if orphaned:
-                # offset = _get_wildcard_limit(mapr_settings, menu)
-                mapannotations = marshal_mapannotations(
-                    conn=conn,
-                    mapann_value=mapann_value,
-                    query=query,
-                    case_sensitive=case_sensitive,
-                    mapann_ns=mapann_ns,
-                    mapann_names=mapann_names,
-                    group_id=group_id,
-                    experimenter_id=experimenter_id,
-                    page=page,
-                    limit=limit)
+            if orphaned and not mapann_value:
+                paging = _get_list_cursor(cursor, 'maps')
+                if paging is not None:
+                    results['maps'] = _marshal_top(
+                        conn, menu, backend,
+                        mapann_ns=mapann_ns,
+                        mapann_names=mapann_names,
+                        group_id=group_id,
+                        experimenter_id=experimenter_id,
+                        page=page,
+                        limit=limit,
+                        **paging)
+            elif orphaned:
+                paging = _get_list_cursor(cursor, 'maps')
+                if paging is not None:
+                    results['maps'] = cached(
+                        conn, menu, backend.marshal_mapannotations,
+                        mapann_value=mapann_value,
+                        query=query,
+                        case_sensitive=case_sensitive,
+                        mapann_ns=mapann_ns,
+                        mapann_names=mapann_names,
+                        group_id=group_id,
+                        experimenter_id=experimenter_id,
+                        page=page,
+                        limit=limit,
+                        **paging)
             else:
-                screens = marshal_screens(
-                    conn=conn,
-                    mapann_value=mapann_value,
-                    query=query,
-                    mapann_ns=mapann_ns,
-                    mapann_names=mapann_names,
-                    group_id=group_id,
-                    experimenter_id=experimenter_id,
-                    page=page,
-                    limit=limit)
-                projects = marshal_projects(
-                    conn=conn,
-                    mapann_value=mapann_value,
-                    query=query,
-                    mapann_ns=mapann_ns,
-                    mapann_names=mapann_names,
-                    group_id=group_id,
-                    experimenter_id=experimenter_id,
-                    page=page,
-                    limit=limit)
+                # screens and projects are independent, query both at once
+                with QueryExecutor(conn) as executor:
+                    for name, marshal in (
+                            ('screens', backend.marshal_screens),
+                            ('projects', backend.marshal_projects)):
+                        paging = _get_list_cursor(cursor, name)
+                        if paging is None:
+                            continue
+                        results[name] = executor.submit(
+                            cached, conn, menu, marshal,
+                            mapann_value=mapann_value,
+                            query=query,
+                            mapann_ns=mapann_ns,
+                            mapann_names=mapann_names,
+                            group_id=group_id,
+                            experimenter_id=experimenter_id,
+                            page=page,
+                            limit=limit,
+                            **paging)
+                for name in ('screens', 'projects'):
+                    if not isinstance(results[name], list):
+                        results[name] = results[name].result()
 
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
@@ -398,11 +861,24 @@ def api_mapannotation_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'maps': mapannotations,
-                         'screens': screens, 'projects': projects})
+    if cursor is not None:
+        # each list is paged by its own key in the cursor
+        next_cursor = {}
+        for name, result in list(results.items()):
+            if isinstance(result, list) and len(result) == 0:
+                # not queried, e.g. exhausted by a previous page
+                next_cursor[name] = None
+                continue
+            results[name], next_cursor[name] = result
+        if any(next_cursor.values()):
+            results['next_cursor'] = encode_cursor(next_cursor)
+        else:
+            results['next_cursor'] = None
+    return JsonResponse(results)
 
 
 @login_required()
+@trace_view
 def api_datasets_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
@@ -416,17 +892,40 @@ def api_datasets_list(request, menu, conn=None, **kwargs):
         experimenter_id = get_long_or_default(request,
                                               'experimenter_id', -1)
         project_id = get_long_or_default(request, 'id', None)
+        project_ids = _get_ids(request)
         mapann_value = get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', False)
+        cursor = _get_cursor(request)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
 
+    if len(project_ids) > settings.PAGE:
+        return HttpResponseBadRequest(
+            'Too many ids, at most %d are allowed' % settings.PAGE)
+
     datasets = []
+    next_cursor = None
+    backend = get_backend()
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
+        if project_ids:
+            # datasets of each project, paged per project
+            datasets = {}
+            if _get_wildcard(mapr_settings, menu) or mapann_value:
+                datasets = cached(
+                    conn, menu, backend.marshal_datasets_batch,
+                    project_ids=project_ids,
+                    mapann_value=mapann_value,
+                    query=query,
+                    mapann_ns=mapann_ns,
+                    mapann_names=mapann_names,
+                    group_id=group_id,
+                    experimenter_id=experimenter_id,
+                    page=page,
+                    limit=limit)
+        elif _get_wildcard(mapr_settings, menu) or mapann_value:
             # Get the images
-            datasets = marshal_datasets(
-                conn=conn,
+            datasets = cached(
+                conn, menu, backend.marshal_datasets,
                 project_id=project_id,
                 mapann_value=mapann_value,
                 query=query,
@@ -435,7 +934,10 @@ def api_datasets_list(request, menu, conn=None, **kwargs):
                 group_id=group_id,
                 experimenter_id=experimenter_id,
                 page=page,
-                limit=limit)
+                limit=limit,
+                cursor=cursor)
+            if cursor is not None:
+                datasets, next_cursor = datasets
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
@@ -443,10 +945,14 @@ def api_datasets_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'datasets': datasets})
+    rsp = {'datasets': datasets}
+    if cursor is not None and not project_ids:
+        rsp['next_cursor'] = encode_cursor(next_cursor)
+    return JsonResponse(rsp)
 
 
 @login_required()
+@trace_view
 def api_plate_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
@@ -460,17 +966,40 @@ def api_plate_list(request, menu, conn=None, **kwargs):
         experimenter_id = get_long_or_default(request,
                                               'experimenter_id', -1)
         screen_id = get_long_or_default(request, 'id', None)
+        screen_ids = _get_ids(request)
         mapann_value = get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', False)
+        cursor = _get_cursor(request)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
 
+    if len(screen_ids) > settings.PAGE:
+        return HttpResponseBadRequest(
+            'Too many ids, at most %d are allowed' % settings.PAGE)
+
     plates = []
+    next_cursor = None
+    backend = get_backend()
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
+        if screen_ids:
+            # plates of each screen, paged per screen
+            plates = {}
+            if _get_wildcard(mapr_settings, menu) or mapann_value:
+                plates = cached(
+                    conn, menu, backend.marshal_plates_batch,
+                    screen_ids=screen_ids,
+                    mapann_value=mapann_value,
+                    query=query,
+                    mapann_ns=mapann_ns,
+                    mapann_names=mapann_names,
+                    group_id=group_id,
+                    experimenter_id=experimenter_id,
+                    page=page,
+                    limit=limit)
+        elif _get_wildcard(mapr_settings, menu) or mapann_value:
             # Get the images
-            plates = marshal_plates(
-                conn=conn,
+            plates = cached(
+                conn, menu, backend.marshal_plates,
                 screen_id=screen_id,
                 mapann_value=mapann_value,
                 query=query,
@@ -479,7 +1008,10 @@ def api_plate_list(request, menu, conn=None, **kwargs):
                 group_id=group_id,
                 experimenter_id=experimenter_id,
                 page=page,
-                limit=limit)
+                limit=limit,
+                cursor=cursor)
+            if cursor is not None:
+                plates, next_cursor = plates
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
@@ -487,10 +1019,14 @@ def api_plate_list(request, menu, conn=None, **kwargs):
     except IceException as e:
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'plates': plates})
+    rsp = {'plates': plates}
+    if cursor is not None and not screen_ids:
+        rsp['next_cursor'] = encode_cursor(next_cursor)
+    return JsonResponse(rsp)
 
 
 @login_required()
+@trace_view
 def api_image_list(request, menu, conn=None, **kwargs):
 
     # Get parameters
@@ -508,41 +1044,137 @@ def api_image_list(request, menu, conn=None, **kwargs):
                                               'experimenter_id', -1)
         parent = get_unicode_or_default(request, 'node', None)
         parent_id = get_long_or_default(request, 'id', None)
+        parent_ids = _get_ids(request)
         mapann_value = get_unicode_or_default(request, 'value', None)
         query = get_bool_or_default(request, 'query', False)
+        cursor = _get_cursor(request)
     except ValueError:
         return HttpResponseBadRequest('Invalid parameter value')
 
+    if len(parent_ids) > settings.PAGE:
+        return HttpResponseBadRequest(
+            'Too many ids, at most %d are allowed' % settings.PAGE)
+
     images = []
+    next_cursor = None
+    backend = get_backend()
     try:
-        if _get_wildcard(mapr_settings, menu) or mapann_value:
+        if parent_ids:
+            # images of each plate or dataset, paged per parent
+            images = {}
+            if _get_wildcard(mapr_settings, menu) or mapann_value:
+                images = cached(
+                    conn, menu, backend.marshal_images_batch,
+                    parent=parent,
+                    parent_ids=parent_ids,
+                    mapann_ns=mapann_ns,
+                    mapann_names=mapann_names,
+                    mapann_value=mapann_value,
+                    query=query,
+                    load_pixels=load_pixels,
+                    group_id=group_id,
+                    experimenter_id=experimenter_id,
+                    page=page,
+                    date=date,
+                    thumb_version=thumb_version,
+                    limit=limit)
+        elif _get_wildcard(mapr_settings, menu) or mapann_value:
             # Get the images
-            images = marshal_images(
-                conn=conn,
-                parent=parent,
-                parent_id=parent_id,
-                mapann_ns=mapann_ns,
-                mapann_names=mapann_names,
-                mapann_value=mapann_value,
-                query=query,
-                load_pixels=load_pixels,
-                group_id=group_id,
-                experimenter_id=experimenter_id,
-                page=page,
-                date=date,
-                thumb_version=thumb_version,
-                limit=limit)
+            with QueryExecutor(conn) as executor:
+                images = cached(
+                    conn, menu, backend.marshal_images,
+                    parent=parent,
+                    parent_id=parent_id,
+                    mapann_ns=mapann_ns,
+                    mapann_names=mapann_names,
+                    mapann_value=mapann_value,
+                    query=query,
+                    load_pixels=load_pixels,
+                    group_id=group_id,
+                    experimenter_id=experimenter_id,
+                    page=page,
+                    date=date,
+                    thumb_version=thumb_version,
+                    limit=limit,
+                    cursor=cursor,
+                    executor=executor)
+            if cursor is not None:
+                images, next_cursor = images
+    except ApiUsageException as e:
+        return HttpResponseBadRequest(e.serverStackTrace)
+    except ServerError as e:
+        return HttpResponseServerError(e.serverStackTrace)
+    except IceException as e:
+        return HttpResponseServerError(e.message)
+
+    rsp = {'images': images}
+    if cursor is not None and not parent_ids:
+        rsp['next_cursor'] = encode_cursor(next_cursor)
+    return JsonResponse(rsp)
+
+
+@login_required(doConnectionCleanup=False)
+@trace_view
+def api_image_export(request, menu, conn=None, **kwargs):
+    """
+    Streams every image matching the value across all screens and
+    projects as newline-delimited JSON.
+    The connection is closed once the response has been sent.
+    """
+
+    # Get parameters
+    try:
+        mapann_ns = _get_ns(mapr_settings, menu)
+        mapann_names = _get_keys(mapr_settings, menu)
+
+        group_id = get_long_or_default(request, 'group', -1)
+        experimenter_id = get_long_or_default(request,
+                                              'experimenter_id', -1)
+        mapann_value = get_unicode_or_default(request, 'value', None)
+        query = get_bool_or_default(request, 'query', False)
+    except ValueError:
+        conn.close(hard=False)
+        return HttpResponseBadRequest('Invalid parameter value')
+
+    if not (_get_wildcard(mapr_settings, menu) or mapann_value):
+        conn.close(hard=False)
+        return HttpResponseBadRequest('Value is required')
+
+    backend = get_backend()
+    chunks = backend.export_images(
+        conn=conn,
+        mapann_value=mapann_value,
+        query=query,
+        mapann_ns=mapann_ns,
+        mapann_names=mapann_names,
+        group_id=group_id,
+        experimenter_id=experimenter_id)
+    try:
+        # run the first queries before streaming to report errors
+        first = next(chunks, [])
     except ApiUsageException as e:
+        conn.close(hard=False)
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
+        conn.close(hard=False)
         return HttpResponseServerError(e.serverStackTrace)
     except IceException as e:
+        conn.close(hard=False)
         return HttpResponseServerError(e.message)
 
-    return JsonResponse({'images': images})
+    def lines():
+        for chunk in chain([first], chunks):
+            yield "".join(json.dumps(i) + "\n" for i in chunk)
+
+    rsp = ConnCleaningHttpResponse(lines(),
+                                   content_type='application/x-ndjson')
+    rsp.conn = conn
+    rsp['Content-Disposition'] = 'attachment; filename="%s.ndjson"' % menu
+    return rsp
 
 
 @login_required()
+@trace_view
 @render_response()
 def load_metadata_details(request, c_type, conn=None, share_id=None,
                           **kwargs):
@@ -571,6 +1203,7 @@ def load_metadata_details(request, c_type, conn=None, share_id=None,
 
 
 @login_required()
+@trace_view
 def api_annotations(request, menu, conn=None, **kwargs):
 
     # Get parameters
@@ -584,8 +1217,9 @@ def api_annotations(request, menu, conn=None, **kwargs):
 
     anns = []
     exps = []
+    backend = get_backend()
     try:
-        anns, exps = load_mapannotation(
+        anns, exps = backend.load_mapannotation(
             conn=conn,
             mapann_ns=mapann_ns,
             mapann_names=mapann_names,
@@ -601,6 +1235,7 @@ def api_annotations(request, menu, conn=None, **kwargs):
 
 
 @login_required()
+@trace_view
 def mapannotations_autocomplete(request, menu, conn=None, **kwargs):
 
     # Get parameters
@@ -623,19 +1258,39 @@ def mapannotations_autocomplete(request, menu, conn=None, **kwargs):
         return HttpResponseBadRequest('Invalid parameter value')
 
     autocomplete = []
+    backend = get_backend()
     try:
-        if mapann_value:
-            autocomplete = marshal_autocomplete(
-                conn=conn,
-                mapann_value=mapann_value,
-                query=query,
+        value_index = _get_value_index(conn, menu, experimenter_id)
+        prefix_table = _get_prefix_table(value_index, menu, group_id)
+        if mapann_value and prefix_table is not None:
+            autocomplete = prefix_table.autocomplete(
+                mapann_value,
                 case_sensitive=case_sensitive,
-                mapann_ns=mapann_ns,
-                mapann_names=mapann_names,
-                group_id=group_id,
-                experimenter_id=experimenter_id,
                 page=page,
                 limit=limit)
+        elif mapann_value:
+            autocomplete = None
+            if value_index is not None:
+                autocomplete = value_index.autocomplete(
+                    menu,
+                    mapann_value=mapann_value,
+                    case_sensitive=case_sensitive,
+                    group_id=group_id,
+                    page=page,
+                    limit=limit)
+            if autocomplete is None:
+                # no index or unavailable
+                autocomplete = backend.marshal_autocomplete(
+                    conn=conn,
+                    mapann_value=mapann_value,
+                    query=query,
+                    case_sensitive=case_sensitive,
+                    mapann_ns=mapann_ns,
+                    mapann_names=mapann_names,
+                    group_id=group_id,
+                    experimenter_id=experimenter_id,
+                    page=page,
+                    limit=limit)
     except ApiUsageException as e:
         return HttpResponseBadRequest(e.serverStackTrace)
     except ServerError as e:
@@ -646,39 +1301,48 @@ def mapannotations_autocomplete(request, menu, conn=None, **kwargs):
     return JsonResponse(list(autocomplete), safe=False)
 
 
+def _favicon_domain(url):
+    """
+    Returns the scheme and host of the url, or None if it is not valid
+    """
+    favdomain = "{0.scheme}://{0.netloc}/".format(urlparse(url))
+    try:
+        URLValidator()(favdomain)
+    except ValidationError:
+        return None
+    return favdomain
+
+
 @login_required()
+@trace_view
 def mapannotations_favicon(request, conn=None, **kwargs):
 
-    icon = None
-    favdomain = "{0.scheme}://{0.netloc}/".format(
-        urlparse(request.GET.get('u', None)))
-    if favdomain is not None:
-        validate = URLValidator()
-        try:
-            validate(favdomain)
-        except ValidationError:
-            return HttpResponseBadRequest('Invalid url')
-
-        _cache_key = "favicon.%s" % favdomain
-
-        cache = get_redis_connection("default")
-        icon = cache.hget('favdomain', _cache_key)
-        if icon is None:
-            try:
-                r = requests.get(
-                    "%s%s" % (mapr_settings.FAVICON_WEBSERVICE, favdomain),
-                    stream=True)
-                if r.status_code == 200:
-                    icon = r.content
-                    cache.hset('favdomain', _cache_key, icon)
-            finally:
-                r.connection.close()
-        return HttpJPEGResponse(icon)
-
-    with Image.open(mapr_settings.DEFAULT_FAVICON) as img:
-        img.thumbnail((16, 16), Image.ANTIALIAS)
-        f = BytesIO()
-        img.save(f, "PNG")
-        f.seek(0)
-        return HttpJPEGResponse(f.read())
-    raise Http404
+    favdomain = _favicon_domain(request.GET.get('u', ''))
+    if favdomain is None:
+        return HttpResponseBadRequest('Invalid url')
+
+    return HttpJPEGResponse(get_favicon(favdomain))
+
+
+@login_required()
+@trace_view
+def mapannotations_favicons(request, conn=None, **kwargs):
+    """
+    Returns the favicons of many urls ?u=<url>&u=<url> as data URIs,
+    loading the favicon of each domain once. Invalid urls are left out.
+    """
+
+    urls = request.GET.getlist('u')
+    if len(urls) > MAX_FAVICONS:
+        return HttpResponseBadRequest(
+            'At most %d urls are allowed' % MAX_FAVICONS)
+
+    domains = {}
+    for u in urls:
+        favdomain = _favicon_domain(u)
+        if favdomain is not None:
+            domains[u] = favdomain
+    uris = dict((d, data_uri(icon))
+                for d, icon in get_favicons(domains.values()).items())
+    return JsonResponse({'favicons': dict(
+        (u, uris[d]) for u, d in domains.items())})
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import json
+import os
+import platform
+import time
+
+import pytest
+
+from omero_version import omero_version
+
+from .fakegateway import FakeConn, SyntheticData
+
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Measured time may exceed its baseline by this factor
+TOLERANCE = float(os.environ.get('MAPR_BENCHMARK_TOLERANCE', 1.5))
+
+# Set to write the measured times to baselines.json instead of comparing
+UPDATE = os.environ.get('MAPR_BENCHMARK_UPDATE')
+
+
+def machine():
+    """
+    Describes the machine the benchmarks run on, recorded with the
+    baselines they were measured on
+    """
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except IOError:
+        pass
+    return "%s, %d CPUs, %s, Python %s, omero-py %s" % (
+        cpu, os.cpu_count(), platform.system(),
+        platform.python_version(), omero_version)
+
+
+@pytest.fixture(scope="session")
+def data():
+    return SyntheticData()
+
+
+@pytest.fixture
+def conn(data):
+    return FakeConn(data)
+
+
+@pytest.fixture(scope="session")
+def baselines(request):
+    with open(BASELINES) as f:
+        baselines = json.load(f)
+    measured = {}
+
+    def finalizer():
+        if UPDATE and measured:
+            baselines['machine'] = machine()
+            baselines['times'].update(measured)
+            with open(BASELINES, 'w') as f:
+                json.dump(baselines, f, indent=4, sort_keys=True)
+                f.write("\n")
+    request.addfinalizer(finalizer)
+    return baselines, measured
+
+
+@pytest.fixture
+def benchmark(baselines):
+    """
+    Returns a function timing func (best of repeat runs) and failing
+    if it is slower than its baseline in seconds times TOLERANCE.
+    Baselines only hold on the machine they were measured on.
+    """
+    baselines, measured = baselines
+
+    def run(name, func, repeat=3):
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        measured[name] = round(best, 4)
+        if not UPDATE:
+            baseline = baselines['times'][name]
+            assert best <= baseline * TOLERANCE, (
+                "%s took %.3fs, baseline %.3fs measured on %s" % (
+                    name, best, baseline, baselines['machine']))
+        return result
+    return run
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from omero.rtypes import rlong, rstring, wrap
+
+
+# Sizes of the synthetic data
+VALUES = 100000
+SCREENS = 5000
+PLATE_IMAGES = 20000
+
+PERMISSIONS = {
+    'perm': 'rwra--', 'canAnnotate': True, 'canDelete': False,
+    'canEdit': False, 'canLink': False, 'canChgrp': False,
+    'canChown': False,
+}
+
+
+def _page(rows, params):
+    # apply the offset and limit set by ParametersI.page()
+    f = getattr(params, 'theFilter', None)
+    if f is None or f.limit is None:
+        return rows
+    offset = f.offset.val if f.offset is not None else 0
+    return rows[offset:offset + f.limit.val]
+
+
+class FakeQueryService(object):
+
+    """
+    Returns synthetic rtype rows shaped like the results of the queries
+    of omero_mapr.tree and omero_mapr.show, without a server.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def projection(self, q, params, service_opts=None):
+        if "count(distinct mv.value)" in q:
+            return [[rlong(len(self.data.values))]]
+        if "thumbs.version" in q:
+            return _page(self.data.thumbnails, params)
+        if "image.id as id" in q:
+            return _page(self.data.images, params)
+        if "plate.id as id" in q:
+            return _page(self.data.plates, params)
+        if "screen.id as id" in q:
+            return _page(self.data.screens, params)
+        if "project.id as id" in q:
+            return []
+        if "map_value" in q:
+            return _page(self.data.paths, params)
+        if "imgCount" in q:
+            return _page(self.data.values, params)
+        if "new map(mv.value as value)" in q:
+            return _page(self.data.autocomplete, params)
+        raise AssertionError("Unexpected query: %s" % q)
+
+    def findAllByQuery(self, q, params, service_opts=None):
+        return []
+
+
+class FakeServiceOpts(object):
+
+    def setOmeroGroup(self, group_id):
+        pass
+
+    def getOmeroGroup(self):
+        return -1
+
+
+class FakeConn(object):
+
+    """
+    Stand-in for BlitzGateway with the methods used by mapr
+    """
+
+    SERVICE_OPTS = FakeServiceOpts()
+
+    def __init__(self, data):
+        self.qs = FakeQueryService(data)
+
+    def getQueryService(self):
+        return self.qs
+
+    def getUserId(self):
+        return 2
+
+    def isAdmin(self):
+        return False
+
+    def getEventContext(self):
+        return None
+
+
+class SyntheticData(object):
+
+    """
+    Rows at the sizes of a large public resource: 100k distinct values,
+    5k screens and a 20k image plate. Built once per session.
+    """
+
+    def __init__(self):
+        self.values = [
+            [rstring("GENE%06d" % i), rlong(1000 - i % 1000),
+             rlong(i % 3), rlong(i % 2)]
+            for i in range(VALUES)]
+        self.autocomplete = [[wrap({'value': "GENE%06d" % i})]
+                             for i in range(VALUES)]
+        self.screens = [
+            [wrap({'value': "GENE000001", 'id': i,
+                   'name': "idr%04d-screen" % i,
+                   'sortName': "idr%04d-screen" % i,
+                   'ownerId': 2,
+                   'screen_details_permissions': PERMISSIONS,
+                   'childCount': 4, 'imgCount': 1536})]
+            for i in range(SCREENS)]
+        self.plates = [
+            [wrap({'value': "GENE000001", 'id': i,
+                   'name': "plate%04d" % i, 'sortName': "plate%04d" % i,
+                   'ownerId': 2,
+                   'plate_details_permissions': PERMISSIONS,
+                   'childCount': 384})]
+            for i in range(SCREENS)]
+        self.images = [
+            [wrap({'id': i, 'name': "image%06d.tif" % i,
+                   'sortName': "image%06d.tif" % i,
+                   'ownerId': 2,
+                   'image_details_permissions': PERMISSIONS,
+                   'filesetId': i})]
+            for i in range(PLATE_IMAGES)]
+        self.thumbnails = [[rlong(i), rlong(1)]
+                           for i in range(PLATE_IMAGES)]
+        self.paths = [
+            [wrap({'map_value': "GENE000001", 'owner': 2,
+                   'screen_id': i, 'plate_id': i, 'imgCount': 384})]
+            for i in range(SCREENS)]
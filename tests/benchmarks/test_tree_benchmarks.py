@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2026 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+"""
+Benchmarks of the Python side of omero_mapr (unwrap, marshalling,
+permissions and JSON encoding) against a fake gateway returning
+synthetic rows, compared to the times in baselines.json.
+
+Run with MAPR_BENCHMARK_UPDATE=1 to record new baselines.
+"""
+
+import inspect
+import json
+
+from django.test import RequestFactory
+
+from omero_mapr import tree, views
+from omero_mapr.executor import QueryExecutor
+from omero_mapr.show import mapr_paths_to_object
+
+from .fakegateway import VALUES, SCREENS, PLATE_IMAGES
+
+
+NS = ["openmicroscopy.org/mapr/gene"]
+NAMES = ["Gene Symbol", "Gene Identifier"]
+
+
+def _call_view(view, params, **kwargs):
+    # skip login_required and other decorators
+    request = RequestFactory().get('/', params)
+    return inspect.unwrap(view)(request, **kwargs)
+
+
+class TestTreeBenchmarks(object):
+
+    def test_marshal_mapannotations(self, conn, benchmark):
+        maps = benchmark('marshal_mapannotations', lambda: (
+            tree.marshal_mapannotations(
+                conn, mapann_value="GENE", query=True,
+                mapann_ns=NS, mapann_names=NAMES, page=None)))
+        assert len(maps) == VALUES
+
+    def test_marshal_autocomplete(self, conn, benchmark):
+        values = benchmark('marshal_autocomplete', lambda: (
+            tree.marshal_autocomplete(
+                conn, mapann_value="GENE",
+                mapann_ns=NS, mapann_names=NAMES, page=None)))
+        assert len(values) == 2 * VALUES
+
+    def test_marshal_screens(self, conn, benchmark):
+        screens = benchmark('marshal_screens', lambda: (
+            tree.marshal_screens(
+                conn, mapann_value="GENE000001",
+                mapann_ns=NS, mapann_names=NAMES, page=None)))
+        assert len(screens) == SCREENS
+
+    def test_marshal_plates(self, conn, benchmark):
+        plates = benchmark('marshal_plates', lambda: (
+            tree.marshal_plates(
+                conn, screen_id=1, mapann_value="GENE000001",
+                mapann_ns=NS, mapann_names=NAMES, page=None)))
+        assert len(plates) == SCREENS
+
+    def test_marshal_images(self, conn, benchmark):
+        images = benchmark('marshal_images', lambda: (
+            tree.marshal_images(
+                conn, parent='plate', parent_id=1,
+                mapann_value="GENE000001",
+                mapann_ns=NS, mapann_names=NAMES,
+                thumb_version=True, page=None)))
+        assert len(images) == PLATE_IMAGES
+        assert images[0]['thumbVersion'] == 1
+
+    def test_marshal_images_executor(self, conn, benchmark):
+        def marshal():
+            with QueryExecutor(conn) as executor:
+                return tree.marshal_images(
+                    conn, parent='plate', parent_id=1,
+                    mapann_value="GENE000001",
+                    mapann_ns=NS, mapann_names=NAMES,
+                    thumb_version=True, page=None, executor=executor)
+        images = benchmark('marshal_images_executor', marshal)
+        assert len(images) == PLATE_IMAGES
+
+    def test_mapr_paths_to_object(self, conn, benchmark):
+        paths = benchmark('mapr_paths_to_object', lambda: (
+            mapr_paths_to_object(
+                conn, mapann_value="GENE000001",
+                mapann_ns=NS, mapann_names=NAMES, screen_id=1)))
+        assert len(paths) == SCREENS
+
+    def test_json_screens(self, conn, benchmark):
+        screens = tree.marshal_screens(
+            conn, mapann_value="GENE000001",
+            mapann_ns=NS, mapann_names=NAMES, page=None)
+        benchmark('json_screens', lambda: json.dumps({'screens': screens}))
+
+
+class TestViewBenchmarks(object):
+
+    def test_api_mapannotation_list(self, conn, benchmark):
+        rsp = benchmark('api_mapannotation_list', lambda: _call_view(
+            views.api_mapannotation_list,
+            {'value': 'GENE', 'query': 'true', 'orphaned': 'true',
+             'limit': VALUES},
+            menu='gene', conn=conn))
+        assert rsp.status_code == 200
+
+    def test_api_image_list(self, conn, benchmark):
+        rsp = benchmark('api_image_list', lambda: _call_view(
+            views.api_image_list,
+            {'value': 'GENE000001', 'node': 'plate', 'id': 1,
+             'thumbVersion': 'true', 'limit': PLATE_IMAGES},
+            menu='gene', conn=conn))
+        assert rsp.status_code == 200
+        assert len(json.loads(rsp.content)['images']) == PLATE_IMAGES
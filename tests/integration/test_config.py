@@ -44,6 +44,14 @@ class TestMaprConfig(IWebTest):
         json = get_json(self.django_client, request_url)
         assert json == settings.MAPR_CONFIG
 
+    def test_config_etag(self, settings):
+        request_url = reverse("mapr_config")
+        rsp = get(self.django_client, request_url)
+        assert rsp['Cache-Control'] == 'no-cache'
+        etag = rsp['ETag']
+        rsp = self.django_client.get(request_url, HTTP_IF_NONE_MATCH=etag)
+        assert rsp.status_code == 304
+
     def test_settings(self, settings):
         assert len(list(settings.MAPR_CONFIG.keys())) > 0
         for menu in settings.MAPR_CONFIG.keys():
@@ -28,7 +28,7 @@ import pytest
 
 from django.core.urlresolvers import reverse
 
-from omeroweb.testlib import get_json
+from omeroweb.testlib import get, get_json
 
 
 class TestMaprViews(object):
@@ -89,6 +89,18 @@ class TestMaprViews(object):
         assert response == _expected(
             ac['menu'], ac['res_value'], ac['count'], -1)
 
+    def test_api_experimenter_list_approx(self, imaprtest):
+        request_url = reverse("mapannotations_api_experimenters",
+                              args=['gene'])
+        response = get_json(imaprtest.django_client, request_url,
+                            {'value': 'cdc14', 'count_mode': 'approx'})
+        experimenter = response['experimenter']
+        # values of annotations not linked to images are counted too
+        assert experimenter['childCount'] >= 3
+        assert experimenter['extra']['approximate']
+        get(imaprtest.django_client, request_url,
+            {'value': 'cdc14', 'count_mode': 'fast'}, status_code=400)
+
     @pytest.mark.parametrize('ac', (
         {'menu': 'organism', 'value': 'Homo sapiens',
          'res_value': {'Homo sapiens': 2}},
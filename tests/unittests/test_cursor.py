@@ -0,0 +1,48 @@
+import pytest
+
+import omero
+
+from omero.sys import ParametersI
+
+from omero_mapr.tree import encode_cursor, decode_cursor, _set_cursor
+
+
+class TestCursor(object):
+
+    """
+    Tests keyset pagination cursors
+    """
+
+    @pytest.mark.parametrize('key', [
+        [10, u"CDC20"],
+        [u"plate 1", 3, u"CDC20"],
+        {'screens': [u"idr0001", 3, u"CDC20"], 'projects': None},
+    ])
+    def test_roundtrip(self, key):
+        assert decode_cursor(encode_cursor(key)) == key
+
+    def test_empty(self):
+        assert encode_cursor(None) is None
+        assert decode_cursor("") is None
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            decode_cursor("not a cursor")
+
+    def test_keyset_clause(self):
+        params = ParametersI()
+        clause = _set_cursor(
+            params, [("count(distinct i.id)", True), ("mv.value", False)],
+            [10, u"CDC20"], 5)
+        assert clause == (
+            "((count(distinct i.id) < :cursor0) or "
+            "(count(distinct i.id) = :cursor0 and mv.value > :cursor1))")
+
+    def test_first_page(self):
+        assert _set_cursor(ParametersI(), [("image.id", False)], [], 5) \
+            is None
+
+    @pytest.mark.parametrize('cursor', [[1, 2], [None], [1.5]])
+    def test_invalid_keyset(self, cursor):
+        with pytest.raises(omero.ApiUsageException):
+            _set_cursor(ParametersI(), [("image.id", False)], cursor, 5)
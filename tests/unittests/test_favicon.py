@@ -0,0 +1,185 @@
+import pytest
+import requests
+
+from omero_mapr import favicon
+
+
+class FakePipeline(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return command
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs)
+                for name, args, kwargs in self.commands]
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.index = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.index.update(mapping)
+
+    def zremrangebyscore(self, key, low, high):
+        for d, score in list(self.index.items()):
+            if low <= score <= high:
+                del self.index[d]
+
+    def zcard(self, key):
+        return len(self.index)
+
+    def zpopmin(self, key, count):
+        oldest = sorted(self.index.items(), key=lambda i: i[1])[:count]
+        for d, score in oldest:
+            del self.index[d]
+        return [(d.encode('utf-8'), score) for d, score in oldest]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakeRaw(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def read(self, amount, decode_content=False):
+        return self.content[:amount]
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.raw = FakeRaw(content)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.icons = {}
+        self.urls = []
+
+    def get(self, url, stream=False, timeout=None):
+        assert timeout
+        self.urls.append(url)
+        domain = url.split("domain=")[-1]
+        if domain == "http://down/":
+            raise requests.ConnectionError("down")
+        if domain not in self.icons:
+            return FakeResponse(404, b"")
+        return FakeResponse(200, self.icons[domain])
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(favicon, 'get_redis_connection', lambda alias: redis)
+    favicon._icons.clear()
+    return redis
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    session.icons["http://a/"] = b"icon-a"
+    monkeypatch.setattr(favicon, 'get_session', lambda: session)
+    return session
+
+
+class TestFavicon(object):
+
+    """
+    Tests the favicon cache
+    """
+
+    def test_default_favicon(self):
+        icon = favicon.default_favicon()
+        assert icon.startswith(b"\x89PNG")
+        assert favicon.default_favicon() is icon
+
+    def test_cached(self, redis, session):
+        assert favicon.get_favicon("http://a/") == b"icon-a"
+        assert redis.data["mapr.favicon.http://a/"] == b"icon-a"
+        assert redis.ttls["mapr.favicon.http://a/"] == 604800
+        # from the in-process cache
+        assert favicon.get_favicon("http://a/") == b"icon-a"
+        favicon._icons.clear()
+        # from redis
+        assert favicon.get_favicon("http://a/") == b"icon-a"
+        assert len(session.urls) == 1
+
+    @pytest.mark.parametrize('domain', ["http://b/", "http://down/"])
+    def test_failure_cached(self, redis, session, domain):
+        assert favicon.get_favicon(domain) == favicon.default_favicon()
+        assert redis.data["mapr.favicon.%s" % domain] == b""
+        assert redis.ttls["mapr.favicon.%s" % domain] == 3600
+        favicon._icons.clear()
+        assert favicon.get_favicon(domain) == favicon.default_favicon()
+        assert len(session.urls) == 1
+
+    def test_too_large(self, redis, session):
+        session.icons["http://c/"] = b"x" * (favicon.MAX_ICON_SIZE + 1)
+        assert favicon.get_favicon("http://c/") == favicon.default_favicon()
+        assert redis.data["mapr.favicon.http://c/"] == b""
+
+    def test_eviction(self, redis, session, monkeypatch):
+        monkeypatch.setattr(favicon.mapr_settings,
+                            'FAVICON_MAX_ENTRIES', 2, raising=False)
+        for domain in ["http://a/", "http://b/", "http://c/"]:
+            favicon.get_favicon(domain)
+        assert "mapr.favicon.http://a/" not in redis.data
+        assert "mapr.favicon.http://c/" in redis.data
+        assert sorted(redis.index) == ["http://b/", "http://c/"]
+
+    def test_redis_unavailable(self, monkeypatch, session):
+        favicon._icons.clear()
+        assert favicon.get_favicon("http://a/") == b"icon-a"
+
+    def test_get_favicons(self, redis, session):
+        session.icons["http://c/"] = b"GIF89a"
+        favicon.get_favicon("http://a/")
+        favicon._icons.clear()
+        icons = favicon.get_favicons(
+            ["http://a/", "http://b/", "http://c/", "http://c/"])
+        assert icons == {"http://a/": b"icon-a",
+                         "http://b/": favicon.default_favicon(),
+                         "http://c/": b"GIF89a"}
+        # cached icons are not loaded again, the others once each
+        assert sorted(session.urls) == [
+            "http://icons/?domain=http://%s/" % d for d in "abc"]
+
+    def test_data_uri(self):
+        assert favicon.data_uri(b"GIF89a") == "data:image/gif;base64,R0lGODlh"
+        assert favicon.data_uri(
+            favicon.default_favicon()).startswith("data:image/png;base64,")
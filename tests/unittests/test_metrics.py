@@ -0,0 +1,58 @@
+from omero_mapr.metrics import Counter, Histogram, Registry, HQL_DURATION
+from omero_mapr.tracing import get_query_service
+
+
+class FakeQueryService(object):
+
+    def projection(self, q, params, service_opts):
+        return [[1], [2]]
+
+
+class FakeConn(object):
+
+    def getQueryService(self):
+        return FakeQueryService()
+
+
+class TestMetrics(object):
+
+    """
+    Tests the Prometheus text metrics
+    """
+
+    def test_counter(self):
+        registry = Registry()
+        c = registry.register(Counter(
+            'mapr_test_total', 'Test.', ('cache', 'result')))
+        c.inc('favicon', 'hit')
+        c.inc('favicon', 'hit', amount=2)
+        c.inc('favicon', 'miss')
+        assert registry.render().splitlines() == [
+            '# HELP mapr_test_total Test.',
+            '# TYPE mapr_test_total counter',
+            'mapr_test_total{cache="favicon",result="hit"} 3',
+            'mapr_test_total{cache="favicon",result="miss"} 1',
+        ]
+
+    def test_histogram(self):
+        registry = Registry()
+        h = registry.register(Histogram(
+            'mapr_test_seconds', 'Test.', ('view',), buckets=(0.1, 1)))
+        h.observe(0.05, 'index')
+        h.observe(0.5, 'index')
+        h.observe(5, 'index')
+        assert registry.render().splitlines()[2:] == [
+            'mapr_test_seconds_bucket{view="index",le="0.1"} 1',
+            'mapr_test_seconds_bucket{view="index",le="1.0"} 2',
+            'mapr_test_seconds_bucket{view="index",le="+Inf"} 3',
+            'mapr_test_seconds_sum{view="index"} 5.55',
+            'mapr_test_seconds_count{view="index"} 3',
+        ]
+
+    def test_hql_per_function(self):
+        def marshal_test(conn):
+            return get_query_service(conn).projection("select 1", None)
+
+        before = HQL_DURATION.count('marshal_test')
+        marshal_test(FakeConn())
+        assert HQL_DURATION.count('marshal_test') == before + 1
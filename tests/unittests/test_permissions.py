@@ -0,0 +1,148 @@
+import pytest
+
+from omero.rtypes import unwrap
+
+from omero_mapr import permissions
+from omero_mapr.permissions import PermissionsProjection
+from omero_mapr.utils.lru import LRUCache
+
+
+class FakeServiceOpts(object):
+
+    def setOmeroGroup(self, group_id):
+        pass
+
+
+class FakePermissions(object):
+
+    def __init__(self, perm):
+        self.perm = perm
+
+    def isGroupRead(self):
+        return self.perm[2] == 'r'
+
+    def isGroupAnnotate(self):
+        return self.perm[3] in 'aw'
+
+    def isGroupWrite(self):
+        return self.perm[3] == 'w'
+
+
+class FakeGroup(object):
+
+    def __init__(self, perm):
+        self.perm = perm
+
+    def getDetails(self):
+        return self
+
+    def getPermissions(self):
+        return FakePermissions(self.perm)
+
+
+class FakeQueryService(object):
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.queries = 0
+
+    def findByQuery(self, q, params, service_opts):
+        self.queries += 1
+        return FakeGroup(self.groups[unwrap(params.map['gid'])])
+
+
+class FakeEventContext(object):
+
+    userId = 2
+    isAdmin = False
+    memberOfGroups = [3, 4, 5]
+    leaderOfGroups = [5]
+
+
+class FakeConn(object):
+
+    SERVICE_OPTS = FakeServiceOpts()
+
+    def __init__(self):
+        self.qs = FakeQueryService(
+            {3: 'rwr---', 4: 'rwra--', 5: 'rwr---', 6: 'rwrw--'})
+
+    def getQueryService(self):
+        return self.qs
+
+    def getEventContext(self):
+        return FakeEventContext()
+
+
+@pytest.fixture(autouse=True)
+def clear_groups():
+    permissions.GROUP_PERMISSIONS.clear()
+
+
+class TestPermissionsProjection(object):
+
+    """
+    Tests permissions derived from the group and the owner
+    """
+
+    def test_select(self):
+        conn = FakeConn()
+        assert PermissionsProjection(conn, light=False).select("image") == \
+            "image as image_details_permissions"
+        assert PermissionsProjection(conn, light=True).select("image") == \
+            "image.details.group.id as image_details_group"
+
+    def test_whole_object(self):
+        row = {'image_details_permissions': {'canEdit': True}}
+        perms = PermissionsProjection(FakeConn(), light=False)
+        assert perms.get(row, 'image', 1) == {'canEdit': True}
+
+    @pytest.mark.parametrize('ac', [
+        # group, owner, can edit, can annotate
+        (3, 2, True, True),
+        (3, 1, False, False),
+        (4, 1, False, True),
+        (5, 1, True, True),
+        (6, 1, False, False),
+    ])
+    def test_light(self, ac):
+        group_id, owner_id, can_edit, can_annotate = ac
+        perms = PermissionsProjection(FakeConn(), light=True)
+        p = perms.get({'image_details_group': group_id}, 'image', owner_id)
+        assert p['canEdit'] == can_edit
+        assert p['canAnnotate'] == can_annotate
+        assert p['canChgrp'] == (owner_id == 2)
+        assert not p['canChown']
+
+    def test_memoized(self):
+        conn = FakeConn()
+        perms = PermissionsProjection(conn, light=True)
+        rows = [{'image_details_group': 4}] * 3
+        derived = [perms.get(row, 'image', 1) for row in rows]
+        assert derived[0] is derived[2]
+        # group permissions are loaded once for all requests
+        PermissionsProjection(conn, light=True).get(rows[0], 'image', 2)
+        assert conn.qs.queries == 1
+
+
+class TestLRUCache(object):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert len(cache) == 2
+
+    def test_ttl(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr('omero_mapr.utils.lru.time.monotonic',
+                            lambda: now[0])
+        cache = LRUCache(ttl=10)
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        now[0] = 111.0
+        assert cache.get('a', 0) == 0
@@ -0,0 +1,28 @@
+import json
+
+from omero_mapr import config
+
+
+class TestSerializedConfig(object):
+
+    """
+    Tests the config serialized once per process
+    """
+
+    def test_serialized_once(self, monkeypatch):
+        menus = {"gene": {"all": ["Gene Symbol"], "label": "Gene"}}
+        monkeypatch.setattr(config.mapr_settings, 'CONFIG', menus,
+                            raising=False)
+        serialized = config.serialized_config()
+        assert json.loads(serialized.json) == menus
+        assert config.serialized_config() is serialized
+
+    def test_reload(self, monkeypatch):
+        monkeypatch.setattr(config.mapr_settings, 'CONFIG',
+                            {"gene": {"label": "Gene"}}, raising=False)
+        before = config.serialized_config()
+        monkeypatch.setattr(config.mapr_settings, 'CONFIG',
+                            {"gene": {"label": "Genes"}}, raising=False)
+        after = config.serialized_config()
+        assert after.hash != before.hash
+        assert json.loads(after.json) == {"gene": {"label": "Genes"}}
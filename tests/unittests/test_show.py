@@ -0,0 +1,85 @@
+from omero.rtypes import unwrap
+
+from omero_mapr.show import mapr_paths_to_object
+
+
+class FakeServiceOpts(object):
+
+    def setOmeroGroup(self, group_id):
+        pass
+
+
+class FakeQueryService(object):
+
+    def __init__(self, spw_rows, pdi_rows):
+        self.spw_rows = spw_rows
+        self.pdi_rows = pdi_rows
+        self.queries = []
+
+    def projection(self, q, params, service_opts):
+        self.queries.append((q, params))
+        if "wellSamples" in q:
+            return self.spw_rows
+        return self.pdi_rows
+
+
+class FakeConn(object):
+
+    SERVICE_OPTS = FakeServiceOpts()
+
+    def __init__(self, spw_rows=[], pdi_rows=[]):
+        self.qs = FakeQueryService(spw_rows, pdi_rows)
+
+    def getQueryService(self):
+        return self.qs
+
+
+class TestPathsToObject(object):
+
+    """
+    Tests resolving the paths from a value to an object
+    """
+
+    def test_screen(self):
+        conn = FakeConn(spw_rows=[[{'map_value': "CDC20", 'owner': 2,
+                                    'screen_id': 3, 'imgCount': 1}]])
+        paths = mapr_paths_to_object(conn, "CDC20", screen_id=3)
+        assert paths == [[{'type': 'experimenter', 'id': 2},
+                          {'type': 'map', 'id': "CDC20"},
+                          {'type': 'screen', 'id': 3}]]
+        # only the Screen/Plate branch is queried, without outer joins
+        assert len(conn.qs.queries) == 1
+        q, params = conn.qs.queries[0]
+        assert "outer" not in q
+        assert unwrap(params.map['sid']) == 3
+
+    def test_dataset(self):
+        conn = FakeConn(pdi_rows=[[{'map_value': "CDC20", 'owner': 2,
+                                    'project_id': 4, 'dataset_id': 5,
+                                    'imgCount': 1}]])
+        paths = mapr_paths_to_object(conn, "CDC20", dataset_id=5)
+        assert [p['type'] for p in paths[0]] == [
+            'experimenter', 'map', 'project', 'dataset']
+        assert len(conn.qs.queries) == 1
+        assert "datasetLinks" in conn.qs.queries[0][0]
+
+    def test_image_first(self):
+        row = {'map_value': "CDC20", 'owner': 2, 'screen_id': 3,
+               'plate_id': 6, 'image_id': 7, 'imgCount': 1}
+        conn = FakeConn(spw_rows=[[row]], pdi_rows=[[row]])
+        paths = mapr_paths_to_object(conn, "CDC20", image_id=7, first=True)
+        assert [p['type'] for p in paths[0]] == [
+            'experimenter', 'map', 'screen', 'plate', 'image']
+        # the Project/Dataset branch is skipped once a path is found
+        assert len(conn.qs.queries) == 1
+        params = conn.qs.queries[0][1]
+        assert unwrap(params.theFilter.offset) == 0
+        assert unwrap(params.theFilter.limit) == 1
+
+    def test_image_in_dataset(self):
+        row = {'map_value': "CDC20", 'owner': 2, 'project_id': 4,
+               'dataset_id': 5, 'image_id': 7, 'imgCount': 1}
+        conn = FakeConn(pdi_rows=[[row]])
+        paths = mapr_paths_to_object(conn, "CDC20", image_id=7, first=True)
+        assert paths[0][-1] == {'type': 'image', 'id': 7}
+        assert len(conn.qs.queries) == 2
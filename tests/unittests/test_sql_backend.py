@@ -0,0 +1,290 @@
+import sqlite3
+
+import pytest
+
+from omero_mapr.backends import sql
+from omero_mapr.backends.sql import SqlBackend
+
+
+SCHEMA = """
+    create table annotation (id integer primary key, ns text,
+                             owner_id integer, group_id integer,
+                             update_id integer);
+    create table annotation_mapvalue (annotation_id integer, name text,
+                                      value text);
+    create table image (id integer primary key, name text, fileset integer,
+                        owner_id integer, group_id integer,
+                        creation_id integer, acquisitiondate text);
+    create table imageannotationlink (id integer primary key,
+                                      parent integer, child integer);
+    create table wellannotationlink (id integer primary key,
+                                     parent integer, child integer);
+    create table well (id integer primary key, plate integer);
+    create table wellsample (id integer primary key, image integer,
+                             well integer);
+    create table plate (id integer primary key, name text,
+                        owner_id integer, group_id integer);
+    create table screen (id integer primary key, name text,
+                         owner_id integer, group_id integer);
+    create table screenplatelink (id integer primary key, parent integer,
+                                  child integer);
+    create table dataset (id integer primary key, name text,
+                          owner_id integer, group_id integer);
+    create table project (id integer primary key, name text,
+                          owner_id integer, group_id integer);
+    create table datasetimagelink (id integer primary key, parent integer,
+                                   child integer);
+    create table projectdatasetlink (id integer primary key,
+                                     parent integer, child integer);
+    create table pixels (id integer primary key, image integer,
+                         sizex integer, sizey integer, sizez integer,
+                         sizet integer);
+    create table thumbnail (id integer primary key, pixels integer,
+                            version integer, owner_id integer);
+    create table event (id integer primary key, time text);
+    create table experimentergroup (id integer primary key,
+                                    permissions integer);
+    """
+
+NS = "openmicroscopy.org/mapr/gene"
+
+
+class FakeEventContext(object):
+
+    def __init__(self, userId, memberOfGroups, leaderOfGroups=[],
+                 isAdmin=False):
+        self.userId = userId
+        self.memberOfGroups = memberOfGroups
+        self.leaderOfGroups = leaderOfGroups
+        self.isAdmin = isAdmin
+
+
+class FakeConn(object):
+
+    def __init__(self, user_id=2, groups=[3]):
+        self.ec = FakeEventContext(user_id, groups)
+
+    def getUserId(self):
+        return self.ec.userId
+
+    def getEventContext(self):
+        return self.ec
+
+
+@pytest.fixture
+def backend(tmpdir):
+    """
+    Snapshot with screen 1 / plate 1 holding images 1-3 annotated with
+    CDC20 (images 1, 2) and cdc14 (image 3), and project 1 / dataset 1
+    holding image 4 annotated with CDC20.
+    """
+    path = str(tmpdir.join("omero.db"))
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    db.executemany("insert into annotation values (?,?,2,3,?)",
+                   [(1, NS, 1), (2, NS, 2)])
+    db.executemany("insert into annotation_mapvalue values (?,?,?)",
+                   [(1, "Gene Symbol", "CDC20"),
+                    (2, "Gene Symbol", "cdc14")])
+    db.execute("insert into screen values (1, 'Screen A', 2, 3)")
+    db.execute("insert into plate values (1, 'Plate A', 2, 3)")
+    db.execute("insert into screenplatelink values (1, 1, 1)")
+    db.execute("insert into project values (1, 'Project A', 2, 3)")
+    db.execute("insert into dataset values (1, 'Dataset A', 2, 3)")
+    db.execute("insert into projectdatasetlink values (1, 1, 1)")
+    for i, ann in ((1, 1), (2, 1), (3, 2)):
+        db.execute("insert into image values (?,?,?,2,3,null,null)",
+                   (i, "image %d" % i, i))
+        db.execute("insert into well values (?, 1)", (i,))
+        db.execute("insert into wellsample values (?,?,?)", (i, i, i))
+        db.execute("insert into imageannotationlink values (?,?,?)",
+                   (i, i, ann))
+        db.execute("insert into wellannotationlink values (?,?,?)",
+                   (i, i, ann))
+    db.execute("insert into image values (4, 'image 4', 4, 2, 3, null, null)")
+    db.execute("insert into datasetimagelink values (1, 1, 4)")
+    db.execute("insert into imageannotationlink values (4, 4, 1)")
+    db.execute("insert into pixels values (1, 1, 10, 10, 1, 1)")
+    db.execute("insert into thumbnail values (1, 1, 5, 2)")
+    # read-annotate group
+    db.execute("insert into experimentergroup values (3, -40)")
+    db.commit()
+    db.close()
+    return SqlBackend("sqlite:///%s" % path)
+
+
+class TestSqlBackend(object):
+
+    """
+    Tests the SQL backend against a SQLite snapshot
+    """
+
+    def test_count(self, backend):
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value=None, mapann_ns=[NS]) == 2
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="cdc", query=True) == 2
+
+    def test_estimate(self, backend, monkeypatch):
+        # counted without sketches
+        monkeypatch.setattr(sql, 'estimate_values', lambda *args: None)
+        assert backend.estimate_mapannotations(
+            FakeConn(), mapann_value=None, mapann_ns=[NS]) == 2
+
+        estimated = []
+
+        def estimate_values(mapann_ns, mapann_names, group_ids):
+            estimated.append(group_ids)
+            return 40
+        monkeypatch.setattr(sql, 'estimate_values', estimate_values)
+        assert backend.estimate_mapannotations(
+            FakeConn(), mapann_value=None, mapann_ns=[NS]) == 40
+        # counted, not reading the read-annotate group of non members
+        assert backend.estimate_mapannotations(
+            FakeConn(groups=[]), mapann_value=None, mapann_ns=[NS]) == 0
+        assert backend.estimate_mapannotations(
+            FakeConn(), mapann_value="cdc20", mapann_ns=[NS]) == 1
+        assert estimated == [[3]]
+
+    def test_count_batch(self, backend):
+        counts = backend.count_mapannotations_batch(
+            FakeConn(), mapann_values=["cdc20", "PAX6"])
+        assert counts["cdc20"] == {'images': 3, 'screens': 1, 'projects': 1}
+        assert counts["PAX6"]['images'] == 0
+
+    def test_mapannotations(self, backend):
+        maps = backend.marshal_mapannotations(
+            FakeConn(), mapann_value=None, page=None)
+        assert [m['extra']['counter'] for m in maps] == [3, 1]
+
+    def test_screens_projects(self, backend):
+        screens = backend.marshal_screens(FakeConn(), mapann_value="CDC20")
+        assert [(s['id'], s['name']) for s in screens] == [
+            (1, "Screen A (2)")]
+        projects = backend.marshal_projects(FakeConn(), mapann_value="CDC20")
+        assert [(p['id'], p['name']) for p in projects] == [
+            (1, "Project A (1)")]
+
+    def test_plates_datasets(self, backend):
+        plates = backend.marshal_plates(
+            FakeConn(), screen_id=1, mapann_value="CDC20")
+        assert [p['id'] for p in plates] == [1]
+        datasets = backend.marshal_datasets(
+            FakeConn(), project_id=1, mapann_value="CDC20")
+        assert [d['id'] for d in datasets] == [1]
+
+    def test_images_cursor(self, backend):
+        images, cursor = backend.marshal_images(
+            FakeConn(), parent='plate', parent_id=1, mapann_value="CDC20",
+            thumb_version=True, limit=1, cursor=[])
+        assert [i['id'] for i in images] == [1]
+        assert images[0]['thumbVersion'] == 5
+        images, cursor = backend.marshal_images(
+            FakeConn(), parent='plate', parent_id=1, mapann_value="CDC20",
+            limit=1, cursor=cursor)
+        assert [i['id'] for i in images] == [2]
+
+    def test_permissions(self, backend):
+        assert sql._permissions(-40)['perm'] == "rwra--"
+        assert sql._permissions(-120)['perm'] == "rw----"
+        assert sql._permissions(-52)['perm'] == "rwr-r-"
+        assert not sql._permissions(-8)['canEdit']
+        # not a member of the group
+        assert backend.count_mapannotations(
+            FakeConn(groups=[4]), mapann_value=None) == 0
+        backend._connect().execute(
+            "update experimentergroup set permissions = -120")
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value=None) == 2
+        # private group, owned by another member
+        assert backend.count_mapannotations(
+            FakeConn(user_id=5), mapann_value=None) == 0
+        conn = FakeConn(user_id=5, groups=[4])
+        conn.ec.isAdmin = True
+        assert backend.count_mapannotations(conn, mapann_value=None) == 2
+
+    def test_autocomplete(self, backend):
+        values = backend.marshal_autocomplete(FakeConn(), mapann_value="c")
+        assert values == [{'value': "cdc14"}, {'value': "CDC20"}]
+        values = backend.marshal_autocomplete(FakeConn(), mapann_value="dc")
+        assert values == [{'value': "cdc14"}, {'value': "CDC20"}]
+
+    def test_search_values(self, backend, monkeypatch):
+        monkeypatch.setattr(
+            sql, 'search_values',
+            lambda ns, names, value, cs: (["CDC20", "cdc14"], 2))
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="dc", query=True) == 2
+        values = backend.marshal_autocomplete(FakeConn(), mapann_value="c")
+        assert values == [{'value': "cdc14"}, {'value': "CDC20"}]
+        monkeypatch.setattr(sql, 'search_values',
+                            lambda ns, names, value, cs: ([], 2))
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="dc", query=True) == 0
+        # cdc14 was annotated after the case-fold table was refreshed
+        monkeypatch.setattr(sql, 'search_values',
+                            lambda ns, names, value, cs: (["CDC20"], 1))
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="dc", query=True) == 2
+        values = backend.marshal_autocomplete(FakeConn(), mapann_value="c")
+        assert values == [{'value': "cdc14"}, {'value': "CDC20"}]
+
+    def test_variants(self, backend, monkeypatch):
+        # cdc14 was annotated after the case-fold table was refreshed
+        monkeypatch.setattr(sql, 'resolve_variants',
+                            lambda ns, names, value: ([], 1))
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="CDC14") == 1
+        monkeypatch.setattr(sql, 'resolve_variants',
+                            lambda ns, names, value: ([], 2))
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="CDC14") == 0
+        monkeypatch.setattr(sql, 'resolve_variants',
+                            lambda ns, names, value: (["cdc14"], 2))
+        assert backend.count_mapannotations(
+            FakeConn(), mapann_value="CDC14") == 1
+
+    def test_search(self, backend):
+        results = backend.search_mapannotations(
+            FakeConn(), mapann_value="cdc", query=True,
+            menus={'gene': ([NS], ["Gene Symbol"]),
+                   'organism': (["openmicroscopy.org/mapr/organism"], [])})
+        assert results['menus'] == {
+            'gene': {'count': 2, 'values': [
+                {'value': "CDC20", 'key': "Gene Symbol", 'images': 3},
+                {'value': "cdc14", 'key': "Gene Symbol", 'images': 1}]},
+            'organism': {'count': 0, 'values': []}}
+
+    def test_paths(self, backend):
+        paths = backend.mapr_paths_to_object(
+            FakeConn(), mapann_value="CDC20", image_id=4)
+        assert paths == [[
+            {'type': 'experimenter', 'id': 2},
+            {'type': 'map', 'id': "CDC20"},
+            {'type': 'project', 'id': 1},
+            {'type': 'dataset', 'id': 1},
+            {'type': 'image', 'id': 4}]]
+
+    def test_paths_branches(self, backend, monkeypatch):
+        paths = backend.mapr_paths_to_object(
+            FakeConn(), mapann_value="CDC20", plate_id=1)
+        assert paths == [[
+            {'type': 'experimenter', 'id': 2},
+            {'type': 'map', 'id': "CDC20"},
+            {'type': 'screen', 'id': 1},
+            {'type': 'plate', 'id': 1}]]
+        # both branches list the owner and value once
+        paths = backend.mapr_paths_to_object(FakeConn(), mapann_value="CDC20")
+        assert paths == [[{'type': 'experimenter', 'id': 2},
+                          {'type': 'map', 'id': "CDC20"}]]
+
+        queries = []
+        execute = backend._execute
+        monkeypatch.setattr(backend, '_execute', lambda name, q, args: (
+            queries.append(q) or execute(name, q, args)))
+        paths = backend.mapr_paths_to_object(
+            FakeConn(), mapann_value="CDC20", first=True)
+        assert len(paths) == 1
+        # the Project/Dataset branch is not queried once a path is found
+        assert len(queries) == 1
+        assert "datasetimagelink" not in queries[0]
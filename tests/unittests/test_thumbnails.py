@@ -0,0 +1,144 @@
+import pytest
+
+from omero.rtypes import unwrap
+
+from omero_mapr import thumbnails
+
+
+class FakeServiceOpts(object):
+
+    def setOmeroGroup(self, group_id):
+        self.group_id = group_id
+
+
+class FakePipeline(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return command
+
+    def execute(self):
+        for name, args, kwargs in self.commands:
+            getattr(self.redis, name)(*args, **kwargs)
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = str(value).encode('utf-8')
+
+    def hmget(self, key, fields):
+        h = self.data.get(key, {})
+        return [h.get(str(f)) for f in fields]
+
+    def hset(self, key, mapping):
+        h = self.data.setdefault(key, {})
+        for k, v in mapping.items():
+            h[str(k)] = v.encode('utf-8')
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def expire(self, key, ttl):
+        pass
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakeQueryService(object):
+
+    def __init__(self):
+        # image id, thumbnail id, version, update event id
+        self.thumbnails = [(1, 10, 3, 100), (1, 11, 1, 101), (2, 12, 7, 102)]
+        self.queries = []
+
+    def projection(self, q, params, service_opts):
+        self.queries.append(q)
+        if "max(t.details.updateEvent.id)" in q:
+            return [[max(t[3] for t in self.thumbnails)]]
+        if ":since" in q:
+            since = unwrap(params.map['since'])
+            return [t for t in self.thumbnails if t[3] > since]
+        ids = unwrap(params.map['ids'])
+        return [t for t in self.thumbnails if t[0] in ids]
+
+
+class FakeConn(object):
+
+    SERVICE_OPTS = FakeServiceOpts()
+
+    def __init__(self):
+        self.qs = FakeQueryService()
+
+    def getQueryService(self):
+        return self.qs
+
+    def getUserId(self):
+        return 5
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(thumbnails, 'get_redis_connection',
+                        lambda alias: redis)
+    monkeypatch.setattr(thumbnails.mapr_settings, 'THUMBNAIL_CACHE_TTL', 60,
+                        raising=False)
+    return redis
+
+
+class TestThumbnailVersions(object):
+
+    """
+    Tests the thumbnail version cache
+    """
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(thumbnails.mapr_settings,
+                            'THUMBNAIL_CACHE_TTL', 0, raising=False)
+        assert thumbnails.get_thumbnail_versions(FakeConn(), [1]) is None
+
+    def test_fill(self, redis):
+        conn = FakeConn()
+        versions = thumbnails.get_thumbnail_versions(conn, [1, 2, 3])
+        # most recent thumbnail of each image
+        assert versions == {1: 1, 2: 7}
+        assert redis.data["mapr.thumbs.5"]["3"] == b""
+        assert redis.data["mapr.thumbs.5.since"] == b"102"
+
+    def test_cached(self, redis):
+        conn = FakeConn()
+        thumbnails.get_thumbnail_versions(conn, [1, 2, 3])
+        conn.qs.queries = []
+        assert thumbnails.get_thumbnail_versions(conn, [2, 3]) == {2: 7}
+        # only the changes since the watermark are loaded
+        assert len(conn.qs.queries) == 1
+        assert ":since" in conn.qs.queries[0]
+        assert "max(t.id)" not in conn.qs.queries[0]
+
+    def test_refresh(self, redis):
+        conn = FakeConn()
+        thumbnails.get_thumbnail_versions(conn, [1, 2, 3])
+        conn.qs.thumbnails += [(2, 12, 8, 103), (3, 13, 1, 104)]
+        versions = thumbnails.get_thumbnail_versions(conn, [1, 2, 3])
+        assert versions == {1: 1, 2: 8, 3: 1}
+        assert redis.data["mapr.thumbs.5.since"] == b"104"
+
+    def test_unavailable(self, monkeypatch):
+        monkeypatch.setattr(thumbnails.mapr_settings,
+                            'THUMBNAIL_CACHE_TTL', 60, raising=False)
+        conn = FakeConn()
+        assert thumbnails.get_thumbnail_versions(conn, [1]) is None
+        assert conn.qs.queries == []
@@ -0,0 +1,109 @@
+import threading
+
+from omero_mapr import executor as executor_module
+from omero_mapr.executor import QueryExecutor
+from omero_mapr.mapr_settings import mapr_settings
+from omero_mapr.tracing import fingerprint, get_query_service, \
+    RequestTrace, _request_trace
+
+
+class FakeQueryService(object):
+
+    def projection(self, q, params, service_opts):
+        return [[1], [2]]
+
+    def findByQuery(self, q, params, service_opts):
+        return None
+
+
+class FakeConn(object):
+
+    def __init__(self):
+        self.services = 0
+
+    def getQueryService(self):
+        self.services += 1
+        return FakeQueryService()
+
+
+class TestTracing(object):
+
+    """
+    Tests HQL query tracing
+    """
+
+    def test_fingerprint(self):
+        assert fingerprint("select a from A a where a.id = 1") == \
+            fingerprint("select a\n  from A a\n where a.id = 22")
+        assert fingerprint("select a from A a where a.name = 'x'") == \
+            fingerprint("select a from A a where a.name = 'y'")
+        assert fingerprint("select a from A a") != \
+            fingerprint("select b from B b")
+
+    def test_request_totals(self):
+        trace = RequestTrace()
+        token = _request_trace.set(trace)
+        try:
+            qs = get_query_service(FakeConn())
+            assert qs.projection("select 1", None, None) == [[1], [2]]
+            assert qs.findByQuery("select 1", None, None) is None
+            # queries run by the executor count towards the request
+            with QueryExecutor(max_workers=2) as executor:
+                executor.submit(qs.projection, "select 2", None, None)
+        finally:
+            _request_trace.reset(token)
+        assert trace.count == 3
+        assert trace.header().startswith("hql;dur=")
+
+    def test_no_request(self):
+        qs = get_query_service(FakeConn())
+        assert qs.projection("select 1", None, None) == [[1], [2]]
+
+    def test_shared_query_service(self):
+        conn = FakeConn()
+        with QueryExecutor(conn, max_workers=2) as executor:
+            futures = [executor.submit(lambda: get_query_service(conn)._qs)
+                       for i in range(4)]
+        # created once by the caller
+        assert conn.services == 1
+        assert len(set(id(f.result()) for f in futures)) == 1
+        get_query_service(conn)
+        assert conn.services == 2
+
+
+class TestExecutor(object):
+
+    """
+    Tests the pool of threads shared by the requests
+    """
+
+    def test_sequential(self, monkeypatch):
+        monkeypatch.setattr(mapr_settings, 'QUERY_WORKERS', 0)
+        monkeypatch.setattr(executor_module, '_pool', None)
+        with QueryExecutor() as executor:
+            future = executor.submit(lambda: threading.current_thread())
+        assert future.result() is threading.current_thread()
+        assert executor_module._pool is None
+
+    def test_shared_pool(self, monkeypatch):
+        monkeypatch.setattr(mapr_settings, 'QUERY_WORKERS', 2)
+        monkeypatch.setattr(executor_module, '_pool', None)
+
+        def nested():
+            # calls of a thread of the pool run in that thread
+            with QueryExecutor() as executor:
+                return executor.submit(
+                    lambda: threading.current_thread()).result()
+
+        try:
+            with QueryExecutor() as executor:
+                futures = [executor.submit(nested) for i in range(4)]
+            assert all(f.done() for f in futures)
+            names = set(f.result().name for f in futures)
+            assert all(n.startswith("mapr_query") for n in names)
+            pool = executor_module._pool
+            with QueryExecutor() as executor:
+                executor.submit(lambda: None)
+            assert executor_module._pool is pool
+        finally:
+            executor_module._pool.shutdown(wait=True)
@@ -0,0 +1,356 @@
+from omero.rtypes import unwrap
+
+from omero_mapr import tree
+from omero_mapr.tree import count_mapannotations_batch, export_images
+from omero_mapr.tree import marshal_images_batch, marshal_plates_batch
+from omero_mapr.tree import estimate_mapannotations, search_mapannotations
+
+
+class FakeServiceOpts(object):
+
+    def setOmeroGroup(self, group_id):
+        pass
+
+
+class FakeQueryService(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def projection(self, q, params, service_opts):
+        self.queries.append((q, params))
+        return self.rows
+
+
+class FakeConn(object):
+
+    SERVICE_OPTS = FakeServiceOpts()
+
+    def __init__(self, rows):
+        self.qs = FakeQueryService(rows)
+
+    def getQueryService(self):
+        return self.qs
+
+
+class TestCountBatch(object):
+
+    """
+    Tests counting many values in one query
+    """
+
+    def test_single_query(self):
+        conn = FakeConn([["cdc20", 10, 1, 2], ["cdc14", 3, 0, 1]])
+        counts = count_mapannotations_batch(
+            conn, ["CDC20", "cdc14", "PAX6"], case_sensitive=False)
+        assert counts == {
+            "CDC20": {'images': 10, 'screens': 1, 'projects': 2},
+            "cdc14": {'images': 3, 'screens': 0, 'projects': 1},
+            "PAX6": {'images': 0, 'screens': 0, 'projects': 0},
+        }
+        assert len(conn.qs.queries) == 1
+        q, params = conn.qs.queries[0]
+        assert "lower(mv.value) in (:values)" in q
+        assert unwrap(params.map['values']) == ["cdc20", "cdc14", "pax6"]
+
+    def test_case_sensitive(self):
+        conn = FakeConn([["CDC20", 10, 1, 2]])
+        counts = count_mapannotations_batch(
+            conn, ["CDC20", "cdc20"], case_sensitive=True)
+        assert counts["CDC20"]['images'] == 10
+        assert counts["cdc20"]['images'] == 0
+        assert "mv.value in (:values)" in conn.qs.queries[0][0]
+
+    def test_empty(self):
+        conn = FakeConn([])
+        assert count_mapannotations_batch(conn, []) == {}
+        assert conn.qs.queries == []
+
+
+class TestEstimate(object):
+
+    """
+    Tests estimating the number of values without joining images
+    """
+
+    class EventContext(object):
+        isAdmin = False
+        leaderOfGroups = []
+
+    class Group(object):
+
+        def __init__(self, id, group_read):
+            self.id = id
+            self.group_read = group_read
+
+        def getId(self):
+            return self.id
+
+        def getDetails(self):
+            return self
+
+        def getPermissions(self):
+            return self
+
+        def isGroupRead(self):
+            return self.group_read
+
+    def conn(self, groups):
+        conn = FakeConn([[42]])
+        conn.getEventContext = lambda: self.EventContext()
+        conn.getGroupsMemberOf = lambda: groups
+        return conn
+
+    def test_estimate(self, monkeypatch):
+        estimated = []
+
+        def estimate_values(mapann_ns, mapann_names, group_ids):
+            estimated.append(group_ids)
+            return 40
+        monkeypatch.setattr(tree, '_estimate_values', estimate_values)
+        conn = self.conn([self.Group(3, True), self.Group(5, True)])
+        assert estimate_mapannotations(
+            conn, None, mapann_ns=["openmicroscopy.org/mapr/gene"]) == 40
+        assert estimate_mapannotations(
+            conn, None, mapann_ns=["openmicroscopy.org/mapr/gene"],
+            group_id=5) == 40
+        assert estimated == [[3, 5], [5]]
+        assert conn.qs.queries == []
+
+    def test_count(self, monkeypatch):
+        monkeypatch.setattr(tree, '_estimate_values', lambda *args: 40)
+        # members of a private group only read their own values
+        conn = self.conn([self.Group(3, True), self.Group(5, False)])
+        assert estimate_mapannotations(
+            conn, None, mapann_ns=["openmicroscopy.org/mapr/gene"]) == 42
+        assert estimate_mapannotations(
+            conn, "CDC20", mapann_ns=["openmicroscopy.org/mapr/gene"]) == 42
+        assert estimate_mapannotations(
+            conn, None, mapann_ns=["openmicroscopy.org/mapr/gene"],
+            experimenter_id=2) == 42
+        assert len(conn.qs.queries) == 3
+        assert "ImageAnnotationLink" in conn.qs.queries[0][0]
+
+
+class TestSearch(object):
+
+    """
+    Tests searching a value in many menus with one query
+    """
+
+    MENUS = {
+        'gene': (["openmicroscopy.org/mapr/gene"],
+                 ["Gene Symbol", "Gene Identifier"]),
+        'organism': (["openmicroscopy.org/mapr/organism"], ["Organism"]),
+        'any': (["openmicroscopy.org/omero/client/mapAnnotation"], []),
+    }
+
+    def test_single_query(self):
+        conn = FakeConn([
+            ["openmicroscopy.org/mapr/gene", "Gene Symbol", "CDC20", 10],
+            ["openmicroscopy.org/mapr/gene", "Gene Identifier", "CDC20", 8],
+            ["openmicroscopy.org/mapr/gene", "Gene Symbol", "cdc14", 3],
+            ["openmicroscopy.org/omero/client/mapAnnotation", "Gene",
+             "CDC20", 1],
+        ])
+        results = search_mapannotations(
+            conn, "cdc", self.MENUS, query=True, limit=1)
+        assert results['menus'] == {
+            'gene': {'count': 2, 'values': [
+                {'value': "CDC20", 'key': "Gene Symbol", 'images': 10}]},
+            'organism': {'count': 0, 'values': []},
+            'any': {'count': 1, 'values': [
+                {'value': "CDC20", 'key': "Gene", 'images': 1}]},
+        }
+        assert not results['truncated']
+        assert len(conn.qs.queries) == 1
+        q, params = conn.qs.queries[0]
+        assert "group by a.ns, mv.name, mv.value" in q
+        assert "a.ns in (:ns2)" in q
+        assert "mv.name in (:filter2)" not in q
+
+    def test_any_namespace(self):
+        conn = FakeConn([])
+        search_mapannotations(conn, "cdc20", {'all': ([], [])})
+        assert "a.ns in" not in conn.qs.queries[0][0]
+
+
+class FakeExportQueryService(object):
+
+    def __init__(self, image_ids):
+        self.image_ids = image_ids
+        self.queries = 0
+
+    def projection(self, q, params, service_opts):
+        self.queries += 1
+        if ":last" in q:
+            limit = unwrap(params.theFilter.limit)
+            last = unwrap(params.map['last'])
+            ids = [i for i in self.image_ids if i > last]
+            return [[i] for i in ids[:limit]]
+        return [[i, "image %d" % i, 100 + i, 1, "plate", 2, "screen",
+                 None, None, None, None] for i in unwrap(params.map['ids'])]
+
+
+class TestExportImages(object):
+
+    """
+    Tests exporting all images of a value in chunks
+    """
+
+    def test_chunks(self):
+        conn = FakeConn([])
+        conn.qs = FakeExportQueryService(list(range(1, 8)))
+        chunks = list(export_images(conn, "CDC20", chunk=3))
+        assert [len(c) for c in chunks] == [3, 3, 1]
+        assert [i['id'] for c in chunks for i in c] == list(range(1, 8))
+        assert chunks[0][0] == {
+            'id': 1, 'name': "image 1", 'filesetId': 101,
+            'plate': {'id': 1, 'name': "plate"},
+            'screen': {'id': 2, 'name': "screen"}}
+        assert conn.qs.queries == 6
+
+    def test_exact_chunk(self):
+        conn = FakeConn([])
+        conn.qs = FakeExportQueryService(list(range(1, 7)))
+        chunks = list(export_images(conn, "CDC20", chunk=3))
+        assert [len(c) for c in chunks] == [3, 3]
+
+
+class FakeKeysetQueryService(object):
+
+    def __init__(self, ids, keys, rows):
+        self.ids = ids
+        self.keys = keys
+        self.rows = sorted(rows, key=lambda r: [r[k] for k in keys])
+        self.queries = []
+        self.parents = []
+        self.loaded = 0
+
+    def projection(self, q, params, service_opts):
+        self.queries.append((q, params))
+        ids = unwrap(params.map[self.ids])
+        self.parents.append(ids)
+        rows = [r for r in self.rows if r['parentId'] in ids]
+        if 'cursor0' in params.map:
+            cursor = [unwrap(params.map['cursor%d' % i])
+                      for i in range(len(self.keys))]
+            rows = [r for r in rows if [r[k] for k in self.keys] > cursor]
+        rows = rows[:unwrap(params.theFilter.limit)]
+        self.loaded += len(rows)
+        return [[r] for r in rows]
+
+
+class TestChildrenBatch(object):
+
+    """
+    Tests listing the children of many parents with one query
+    """
+
+    @staticmethod
+    def rows():
+        # ordered by parent then name
+        return [[{'value': "CDC20", 'parentId': sid, 'id': pid,
+                  'name': "plate %d" % pid, 'sortName': "plate %d" % pid,
+                  'ownerId': 1, 'plate_details_permissions': {},
+                  'childCount': 2}]
+                for sid, pid in [(1, 10), (1, 11), (1, 12), (2, 20)]]
+
+    def test_grouped_by_parent(self):
+        conn = FakeConn(self.rows())
+        plates = marshal_plates_batch(conn, [1, 2, 3], "CDC20", page=None)
+        assert [p['id'] for p in plates[1]] == [10, 11, 12]
+        assert [p['id'] for p in plates[2]] == [20]
+        assert plates[3] == []
+        assert plates[1][0]['extra'] == {'node': 'plate', 'value': "CDC20"}
+        assert len(conn.qs.queries) == 1
+        q, params = conn.qs.queries[0]
+        assert "screen.id in (:sids)" in q
+        assert unwrap(params.map['sids']) == [1, 2, 3]
+
+    def test_paged_per_parent(self):
+        conn = FakeConn(self.rows())
+        plates = marshal_plates_batch(conn, [1, 2], "CDC20", page=2, limit=2)
+        assert [p['id'] for p in plates[1]] == [12]
+        assert plates[2] == []
+
+    def test_bounded_per_parent(self):
+        conn = FakeConn([])
+        conn.qs = FakeKeysetQueryService(
+            'sids', ['parentId', 'sortName', 'id', 'value'],
+            [r[0] for r in self.rows()] +
+            [{'value': "CDC20", 'parentId': 0, 'id': pid,
+              'name': "plate %d" % pid, 'sortName': "plate %d" % pid,
+              'ownerId': 1, 'plate_details_permissions': {},
+              'childCount': 2} for pid in range(100, 200)])
+        plates = marshal_plates_batch(conn, [0, 1, 2], "CDC20", limit=2)
+        assert [p['id'] for p in plates[0]] == [100, 101]
+        assert [p['id'] for p in plates[1]] == [10, 11]
+        assert [p['id'] for p in plates[2]] == [20]
+        # further queries skip the screens already complete
+        assert conn.qs.parents == [[0, 1, 2], [1, 2], [2]]
+        assert conn.qs.loaded == 6 + 4
+
+    def test_empty(self):
+        conn = FakeConn([])
+        assert marshal_plates_batch(conn, [], "CDC20") == {}
+        assert conn.qs.queries == []
+
+
+class FakeImagesQueryService(FakeKeysetQueryService):
+
+    def __init__(self, images=[(1, 10), (1, 11), (2, 20), (2, 21)]):
+        super(FakeImagesQueryService, self).__init__(
+            'pids', ['parentId', 'sortName', 'id'],
+            [{'parentId': pid, 'id': iid, 'name': "image %d" % iid,
+              'sortName': "image %d" % iid, 'ownerId': 1,
+              'image_details_permissions': {}, 'filesetId': None}
+             for pid, iid in images])
+
+    def projection(self, q, params, service_opts):
+        if "thumbs.version" in q:
+            self.queries.append((q, params))
+            return [[i, 3] for i in unwrap(params.map['ids'])]
+        return super(FakeImagesQueryService, self).projection(
+            q, params, service_opts)
+
+
+class TestImagesBatch(object):
+
+    """
+    Tests listing the images of many plates with few queries
+    """
+
+    def test_shared_thumbnails(self):
+        conn = FakeConn([])
+        conn.qs = FakeImagesQueryService()
+        conn.getUserId = lambda: 5
+        images = marshal_images_batch(
+            conn, 'plate', [1, 2, 3], "CDC20", thumb_version=True, limit=1)
+        assert [i['id'] for i in images[1]] == [10]
+        assert [i['id'] for i in images[2]] == [20]
+        assert images[3] == []
+        assert images[1][0]['thumbVersion'] == 3
+        # the third plate is listed again as the first query was full
+        assert conn.qs.parents == [[1, 2, 3], [3]]
+        assert len(conn.qs.queries) == 3
+        q, params = conn.qs.queries[0]
+        assert "plate.id in (:pids)" in q
+        assert sorted(unwrap(conn.qs.queries[2][1].map['ids'])) == [10, 20]
+
+    def test_bounded_per_parent(self):
+        conn = FakeConn([])
+        conn.qs = FakeImagesQueryService(
+            [(1, i) for i in range(100, 1000)] + [(2, 20)])
+        images = marshal_images_batch(
+            conn, 'dataset', [1, 2], "CDC20", page=2, limit=3)
+        assert [i['id'] for i in images[1]] == [103, 104, 105]
+        assert images[2] == []
+        assert conn.qs.parents == [[1, 2], [2]]
+        assert conn.qs.loaded == 12 + 1
+
+    def test_unknown_parent(self):
+        conn = FakeConn([])
+        assert marshal_images_batch(conn, 'screen', [1], "CDC20") == {1: []}
+        assert conn.qs.queries == []
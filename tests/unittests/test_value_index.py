@@ -0,0 +1,337 @@
+import threading
+
+from contextlib import closing
+
+import pytest
+
+from omero.rtypes import unwrap
+
+from omero_mapr import value_index as value_index_module
+from omero_mapr.tree import _set_parameters
+from omero_mapr.value_index import ValueIndex, casefold_scope
+from omero_mapr import autocomplete
+from omero_mapr.autocomplete import PrefixTable, PrefixTables
+
+
+class FakeServiceOpts(object):
+
+    def setOmeroGroup(self, group_id):
+        pass
+
+
+class FakeQueryService(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def projection(self, q, params, service_opts):
+        return self.rows
+
+
+class FakeConn(object):
+
+    SERVICE_OPTS = FakeServiceOpts()
+
+    def __init__(self, values):
+        self.rows = [("openmicroscopy.org/mapr/gene", "Gene Symbol",
+                      v, 3, 2, 1, 0) for v in values]
+
+    def getQueryService(self):
+        return FakeQueryService(self.rows)
+
+    def getUserId(self):
+        return 2
+
+    def isAdmin(self):
+        return False
+
+
+@pytest.fixture
+def value_index(tmpdir):
+    index = ValueIndex(str(tmpdir.join("mapr.db")))
+    conn = FakeConn(["CDC14", "cdc14", "Cdc14", "cdc20", "acdc1", "abc"])
+    index.build(conn, "gene")
+    return index
+
+
+class TestValueIndex(object):
+
+    """
+    Tests the local value index
+    """
+
+    def test_covers(self, value_index):
+        assert value_index.covers("gene", 2)
+        assert not value_index.covers("gene", 2, experimenter_id=2)
+        assert not value_index.covers("phenotype", 2)
+        # built as another user
+        assert not value_index.covers("gene", 3)
+
+    @pytest.mark.parametrize('ac', [
+        ({'mapann_value': 'cdc14'}, 3),
+        ({'mapann_value': 'Cdc14', 'case_sensitive': True}, 1),
+        ({'mapann_value': 'cdc', 'query': True}, 5),
+        ({'mapann_value': None}, 6),
+    ])
+    def test_count(self, value_index, ac):
+        kwargs, count = ac
+        assert value_index.count("gene", **kwargs) == count
+
+    def test_autocomplete(self, value_index):
+        values = [v['value'] for v in value_index.autocomplete("gene", "cdc")]
+        # prefix matches ordered by length then substring matches
+        assert values[-2:] == ["cdc20", "acdc1"]
+        assert set(values[:3]) == set(["CDC14", "cdc14", "Cdc14"])
+
+    def test_autocomplete_case_sensitive(self, value_index):
+        values = value_index.autocomplete("gene", "Cdc", case_sensitive=True)
+        assert values == [{'value': 'Cdc14'}]
+
+    def test_unavailable(self, value_index, tmpdir, monkeypatch):
+        tables = PrefixTables(10 * 1024 * 1024)
+        tables.load(value_index, "gene")
+        with open(value_index.path, "wb") as f:
+            f.write(b"not a database" * 1000)
+        # the views fall back to OMERO
+        assert value_index.count("gene", None) is None
+        assert value_index.autocomplete("gene", "cdc") is None
+        assert value_index.built("gene") is None
+        assert value_index.estimate(["ns"], []) is None
+        monkeypatch.setattr(autocomplete, 'CHECK_INTERVAL', 0)
+        assert len(tables.get(value_index, "gene", 3)) == 6
+
+    def test_estimate(self, value_index, tmpdir):
+        ns = ["openmicroscopy.org/mapr/gene"]
+        # only built by an administrator
+        assert value_index.estimate(ns, []) is None
+
+        conn = FakeConn([])
+        conn.isAdmin = lambda: True
+        conn.rows = [(ns[0], "Gene Symbol", "gene%d" % i, i % 2, 1, 1, 0)
+                     for i in range(20000)]
+        index = ValueIndex(str(tmpdir.join("admin.db")))
+        index.build(conn, "gene", mapann_ns=ns, batch=len(conn.rows) + 1)
+        assert abs(index.estimate(ns, []) - 20000) < 20000 * 0.05
+        assert abs(index.estimate(ns, [], [1]) - 10000) < 10000 * 0.05
+        assert abs(index.estimate(ns, [], [0, 1, 7]) - 20000) < 20000 * 0.05
+        assert index.estimate(ns, [], [7]) == 0
+        assert index.estimate(["openmicroscopy.org/mapr/organism"], []) is None
+
+
+class FakeCasefoldQueryService(object):
+
+    def __init__(self, annotations):
+        # value, update event id
+        self.annotations = annotations
+
+    def projection(self, q, params, service_opts):
+        if "max(" in q:
+            return [[max(e for v, e in self.annotations)]]
+        since = unwrap(params.map['since'])
+        return sorted(set((v,) for v, e in self.annotations if e > since))
+
+
+class FakeCasefoldConn(FakeConn):
+
+    def __init__(self, annotations):
+        self.qs = FakeCasefoldQueryService(annotations)
+
+    def getQueryService(self):
+        return self.qs
+
+    def isAdmin(self):
+        return self.getUserId() == 0
+
+    def getUserId(self):
+        return 0
+
+
+class TestCasefold(object):
+
+    """
+    Tests the case-fold table resolving case insensitive values
+    """
+
+    NS = ["openmicroscopy.org/mapr/gene"]
+    NAMES = ["Gene Symbol"]
+
+    def test_refresh(self, tmpdir):
+        index = ValueIndex(str(tmpdir.join("mapr.db")))
+        conn = FakeCasefoldConn([("CDC14", 1), ("cdc14", 2), ("cdc20", 3)])
+        assert index.variants(self.NS, self.NAMES, "cdc14") is None
+        assert index.refresh_casefold(conn, self.NS, self.NAMES) == 3
+        values, since = index.variants(self.NS, self.NAMES, "Cdc14")
+        assert sorted(values) == ["CDC14", "cdc14"]
+        assert since == 3
+        # values added since are only known by their update event
+        assert index.variants(self.NS, self.NAMES, "pax6") == ([], 3)
+        # other namespaces are not covered
+        assert index.variants([], self.NAMES, "cdc14") is None
+
+        # only the annotations updated since are loaded
+        conn.qs.annotations.append(("Cdc14", 4))
+        assert index.refresh_casefold(conn, self.NS, self.NAMES) == 1
+        values, since = index.variants(self.NS, self.NAMES, "CDC14")
+        assert sorted(values) == ["CDC14", "Cdc14", "cdc14"]
+        assert since == 4
+
+    def test_refresh_admin(self, tmpdir, monkeypatch):
+        index = ValueIndex(str(tmpdir.join("mapr.db")))
+        conn = FakeCasefoldConn([("CDC14", 1)])
+        monkeypatch.setattr(conn, 'getUserId', lambda: 2)
+        # the values of the groups of user 2 would be used for everyone
+        with pytest.raises(ValueError):
+            index.refresh_casefold(conn, self.NS, self.NAMES)
+        assert index.variants(self.NS, self.NAMES, "cdc14") is None
+        # tables refreshed before the user was stored are not used
+        with closing(index._connect()) as db, db:
+            db.execute("insert into mapr_casefold_scope (scope, since,"
+                       " refreshed) values (?, 1, 0)",
+                       (casefold_scope(self.NS, self.NAMES),))
+        with closing(index._connect()) as db, db:
+            db.execute("insert into mapr_casefold values (?, ?, ?)",
+                       (casefold_scope(self.NS, self.NAMES), "cdc14",
+                        "CDC14"))
+        assert index.variants(self.NS, self.NAMES, "cdc14") is None
+        # substrings neither
+        assert index.search(self.NS, self.NAMES, "cdc") is None
+
+    @pytest.mark.parametrize('search', [True, False])
+    def test_search(self, tmpdir, search):
+        index = ValueIndex(str(tmpdir.join("mapr.db")))
+        conn = FakeCasefoldConn(
+            [("CDC14", 1), ("cdc14", 2), ("acdc1", 3), ("PAX6", 4)])
+        assert index.search(self.NS, self.NAMES, "cdc") is None
+        index.refresh_casefold(conn, self.NS, self.NAMES)
+        index._search = search
+        values, since = index.search(self.NS, self.NAMES, "cdc")
+        assert sorted(values) == ["CDC14", "acdc1", "cdc14"]
+        assert since == 4
+        values, since = index.search(self.NS, self.NAMES, "CD")
+        assert sorted(values) == ["CDC14", "acdc1", "cdc14"]
+        assert index.search(
+            self.NS, self.NAMES, "CDC", case_sensitive=True) == (["CDC14"], 4)
+        # values added since are only known by their update event
+        assert index.search(self.NS, self.NAMES, "zzz") == ([], 4)
+        # too many values
+        assert index.search(self.NS, self.NAMES, "c", limit=2) is None
+
+    def test_set_parameters(self, monkeypatch):
+        monkeypatch.setattr(
+            value_index_module, 'resolve_variants',
+            lambda ns, names, value: (["CDC14", "cdc14"], 3))
+        params, where_clause = _set_parameters(
+            self.NS, self.NAMES, "Cdc14", case_sensitive=False)
+        # spellings added after the refresh are matched with lower()
+        assert where_clause[-1] == (
+            "(mv.value in (:variants) or "
+            "(a.details.updateEvent.id > :since and "
+            "lower(mv.value) = :value))")
+        assert unwrap(params.map['since']) == 3
+        assert unwrap(params.map['value']) == "cdc14"
+        params, where_clause = _set_parameters(
+            self.NS, self.NAMES, "Cdc14", case_sensitive=True)
+        assert "variants" not in params.map
+
+    def test_set_parameters_unknown(self, monkeypatch):
+        monkeypatch.setattr(
+            value_index_module, 'resolve_variants',
+            lambda ns, names, value: ([], 3))
+        params, where_clause = _set_parameters(
+            self.NS, self.NAMES, "Cdc14", case_sensitive=False)
+        assert where_clause[-1] == (
+            "(a.details.updateEvent.id > :since and "
+            "lower(mv.value) = :value)")
+
+    def test_set_parameters_query(self, monkeypatch):
+        monkeypatch.setattr(
+            value_index_module, 'search_values',
+            lambda ns, names, value, case_sensitive: (["CDC14", "acdc1"], 3))
+        params, where_clause = _set_parameters(
+            self.NS, self.NAMES, "cdc", query=True, case_sensitive=False)
+        # like only for the annotations updated after the refresh
+        assert where_clause[-1] == (
+            "(mv.value in (:candidates) or "
+            "(a.details.updateEvent.id > :since and "
+            "lower(mv.value) like :query))")
+        assert unwrap(params.map['since']) == 3
+
+
+class TestPrefixTable(object):
+
+    """
+    Tests the in-memory autocomplete prefix table
+    """
+
+    @pytest.fixture
+    def table(self):
+        return PrefixTable(
+            ["CDC14", "cdc14", "Cdc14", "cdc20", "acdc1", "abc"])
+
+    def test_autocomplete_matches_value_index(self, value_index, table):
+        for value in ["cdc", "CDC1", "dc", "c", "zzz"]:
+            for cs in (True, False):
+                expected = value_index.autocomplete(
+                    "gene", value, case_sensitive=cs, page=1, limit=2)
+                assert table.autocomplete(
+                    value, case_sensitive=cs, page=1, limit=2) == expected
+
+    def test_memory(self, table):
+        assert len(table) == 6
+        assert table.size > 0
+
+    def test_reload(self, value_index, monkeypatch):
+        tables = PrefixTables(10 * 1024 * 1024)
+        tables.load(value_index, "gene")
+        assert len(tables.get(value_index, "gene", 3)) == 6
+
+        # rebuilt, reloaded in the background once checked
+        value_index.build(FakeConn(["abc"]), "gene")
+        assert len(tables.get(value_index, "gene", 3)) == 6
+        monkeypatch.setattr(autocomplete, 'CHECK_INTERVAL', 0)
+        tables.get(value_index, "gene", 3)
+        for t in threading.enumerate():
+            if t.name == "mapr-autocomplete-gene":
+                t.join()
+        assert len(tables.get(value_index, "gene", 3)) == 1
+
+
+class TestTop(object):
+
+    """
+    Tests the leaderboard of the values annotating most images
+    """
+
+    VALUES = [("cdc20", 9, 2), ("CDC14", 5, 1), ("abc", 5, 1), ("acdc1", 1, 1)]
+
+    @pytest.fixture
+    def index(self, value_index, monkeypatch):
+        def marshal_mapannotations(conn, mapann_value, mapann_ns,
+                                   mapann_names, group_id, page, limit):
+            return [{'id': v, 'childCount': c, 'extra': {'counter': i}}
+                    for v, i, c in self.VALUES[:limit]]
+        monkeypatch.setattr(value_index_module, 'marshal_mapannotations',
+                            marshal_mapannotations)
+        # all groups and group 3 of the index
+        assert value_index.build_top(FakeConn([]), "gene", top=3) == 6
+        return value_index
+
+    def test_top(self, index):
+        assert index.top("gene", 2, limit=2) == self.VALUES[:2]
+        assert index.top("gene", 2, group_id=3, offset=1, limit=1) == [
+            self.VALUES[1]]
+        assert index.top("gene", 2, cursor=[5, "CDC14"], limit=2,
+                         end=3) == [self.VALUES[2]]
+        assert index.top("phenotype", 2) is None
+        # built as another user
+        assert index.top("gene", 3) is None
+
+    def test_top_not_kept(self, index):
+        # the fourth value is not kept
+        assert index.top("gene", 2, offset=2, limit=2) is None
+        assert index.top("gene", 2, cursor=[1, "acdc1"]) is None
+        # unless no more values are listed
+        assert index.top("gene", 2, offset=2, limit=2, end=3) == [
+            self.VALUES[2]]
+        assert index.top("gene", 2, offset=1, limit=2, end=2) == [
+            self.VALUES[1]]